@@ -0,0 +1,127 @@
+"""Local load generator for the backend: fires concurrent requests at the ML routes and
+prints client-side latency percentiles per route, then the server's /metrics summary.
+
+    python app.py                                   # in one shell (or: flask --app backend.app run)
+    python loadgen.py --requests 500 --concurrency 8
+    python loadgen.py --routes /learning-path --rows 2000   # stress KMeans fitting
+
+/translate and /speech-to-text call external services, so they are opt-in via --routes.
+"""
+import argparse
+import io
+import json
+import math
+import random
+import struct
+import time
+import urllib.error
+import urllib.request
+import wave
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_ROUTES = ['/learning-path', '/recommend', '/optimal-study-time']
+
+
+def _wav_bytes(seconds=1.0, rate=16000):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(b''.join(struct.pack('<h', int(3000 * math.sin(440 * 2 * math.pi * i / rate)))
+                               for i in range(int(seconds * rate))))
+    return buf.getvalue()
+
+
+def make_request(base, route, rows, rng):
+    """Build a urllib Request with a random but valid payload for `route`."""
+    if route == '/speech-to-text':
+        boundary = 'loadgen%d' % rng.randrange(10 ** 9)
+        body = (('--%s\r\nContent-Disposition: form-data; name="file"; filename="a.wav"\r\n'
+                 'Content-Type: audio/wav\r\n\r\n' % boundary).encode()
+                + _wav_bytes() + ('\r\n--%s--\r\n' % boundary).encode())
+        return urllib.request.Request(base + route, data=body, method='POST',
+                                      headers={'Content-Type': 'multipart/form-data; boundary=' + boundary})
+    if route == '/learning-path':
+        payload = {'user_data': [[rng.random(), rng.random()] for _ in range(rows)]}
+    elif route == '/recommend':
+        payload = {'interests': [rng.random() for _ in range(3)]}
+    elif route == '/optimal-study-time':
+        times = [rng.uniform(0, 10) for _ in range(rows)]
+        payload = {'data': {'time_spent': times, 'scores': [50 + 4 * t + rng.gauss(0, 5) for t in times]},
+                   'target_score': 80}
+    elif route == '/translate':
+        payload = {'text': 'Hello, how are you?', 'lang': rng.choice(['es', 'fr', 'de'])}
+    else:
+        raise ValueError('unknown route %s' % route)
+    return urllib.request.Request(base + route, data=json.dumps(payload).encode(), method='POST',
+                                  headers={'Content-Type': 'application/json'})
+
+
+def _send(req):
+    t0 = time.perf_counter()
+    try:
+        with urllib.request.urlopen(req, timeout=60) as r:
+            r.read()
+            status = r.status
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError:
+        status = 0
+    return status, time.perf_counter() - t0
+
+
+def _percentile(sorted_vals, q):
+    return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--routes', nargs='*', default=DEFAULT_ROUTES)
+    parser.add_argument('--requests', type=int, default=200, help='Total requests, spread over routes')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--rows', type=int, default=100, help='Rows per payload for fitting routes')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    jobs = [(route, make_request(args.url, route, args.rows, rng))
+            for route in (rng.choice(args.routes) for _ in range(args.requests))]
+    results = defaultdict(list)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        for route, (status, seconds) in zip((r for r, _ in jobs), pool.map(lambda j: _send(j[1]), jobs)):
+            results[route].append((status, seconds))
+    wall = time.perf_counter() - t0
+
+    print('%d requests in %.1fs (%.1f req/s, concurrency %d)'
+          % (args.requests, wall, args.requests / wall, args.concurrency))
+    print('%-22s%6s%7s%10s%10s%10s' % ('route', 'n', 'errors', 'p50_ms', 'p95_ms', 'p99_ms'))
+    for route, res in sorted(results.items()):
+        lat = sorted(s for _, s in res)
+        errors = sum(1 for st, _ in res if not 200 <= st < 300)
+        print('%-22s%6d%7d%10.1f%10.1f%10.1f' % (route, len(res), errors, 1e3 * _percentile(lat, 0.5),
+                                                  1e3 * _percentile(lat, 0.95), 1e3 * _percentile(lat, 0.99)))
+
+    try:
+        with urllib.request.urlopen(args.url + '/metrics', timeout=10) as r:
+            text = r.read().decode()
+    except OSError as e:
+        print('Could not fetch /metrics: %s' % e)
+        return
+    print('\nServer-side mean time per route / stage (from /metrics):')
+    sums, counts = {}, {}
+    for line in text.splitlines():
+        for suffix, store in (('_sum{', sums), ('_count{', counts)):
+            if line.startswith(('http_request_duration_seconds' + suffix, 'model_stage_duration_seconds' + suffix)):
+                key, value = line.rsplit(' ', 1)
+                store[key.replace(suffix, '{')] = float(value)
+    for key in sorted(sums):
+        if counts.get(key):
+            print('  %-80s %8.2f ms  (n=%d)' % (key, 1e3 * sums[key] / counts[key], counts[key]))
+
+
+if __name__ == '__main__':
+    main()
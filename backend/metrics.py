@@ -0,0 +1,218 @@
+"""Request metrics for the Flask backend, exposed in Prometheus text format on /metrics.
+
+Per route: request counts by status, error counts, latency and payload-size histograms.
+Code inside `with stage('fit')` / `with stage('predict')` is timed separately, so model
+fitting cost can be told apart from inference. Set BACKEND_PROFILE=1 (or pass
+profile=True to init_app) to run a sampling profiler whose folded stacks are served
+on /debug/profile (BACKEND_PROFILE_INTERVAL seconds between samples, default 0.01).
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += value
+        self.n += 1
+
+    def lines(self, name, labels):
+        out, cum = [], 0
+        for bound, c in zip(self.buckets + ('+Inf',), self.counts):
+            cum += c
+            out.append('%s_bucket{%s,le="%s"} %d' % (name, labels, bound, cum))
+        out.append('%s_sum{%s} %.6f' % (name, labels, self.total))
+        out.append('%s_count{%s} %d' % (name, labels, self.n))
+        return out
+
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.requests = Counter()  # (route, method, status)
+        self.errors = Counter()  # (route, '4xx' | '5xx')
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # route
+        self.stages = defaultdict(lambda: Histogram(LATENCY_BUCKETS))  # (route, stage)
+        self.request_bytes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+        self.response_bytes = defaultdict(lambda: Histogram(SIZE_BUCKETS))
+
+    def record(self, route, method, status, seconds, req_bytes, resp_bytes):
+        with self.lock:
+            self.requests[(route, method, status)] += 1
+            if status >= 400:
+                self.errors[(route, '%dxx' % (status // 100))] += 1
+            self.latency[route].observe(seconds)
+            if req_bytes is not None:
+                self.request_bytes[route].observe(req_bytes)
+            if resp_bytes is not None:
+                self.response_bytes[route].observe(resp_bytes)
+
+    def record_stage(self, route, name, seconds):
+        with self.lock:
+            self.stages[(route, name)].observe(seconds)
+
+    def render(self):
+        with self.lock:
+            out = [
+                '# HELP http_requests_total Requests by route, method and status.',
+                '# TYPE http_requests_total counter',
+            ]
+            for (route, method, status), n in sorted(self.requests.items()):
+                out.append('http_requests_total{route="%s",method="%s",status="%d"} %d' % (route, method, status, n))
+            out += ['# HELP http_request_errors_total Requests that ended in a 4xx, a 5xx or an exception.',
+                    '# TYPE http_request_errors_total counter']
+            for (route, cls), n in sorted(self.errors.items()):
+                out.append('http_request_errors_total{route="%s",class="%s"} %d' % (route, cls, n))
+            sections = (
+                ('http_request_duration_seconds', 'Wall time per request.', self.latency),
+                ('model_stage_duration_seconds', 'Time in model fitting vs inference within a request.', self.stages),
+                ('http_request_size_bytes', 'Request body size.', self.request_bytes),
+                ('http_response_size_bytes', 'Response body size.', self.response_bytes),
+            )
+            for name, help_text, hists in sections:
+                out += ['# HELP %s %s' % (name, help_text), '# TYPE %s histogram' % name]
+                for key, hist in sorted(hists.items()):
+                    if isinstance(key, tuple):
+                        labels = 'route="%s",stage="%s"' % key
+                    else:
+                        labels = 'route="%s"' % key
+                    out += hist.lines(name, labels)
+        return '\n'.join(out) + '\n'
+
+
+METRICS = Metrics()
+
+
+def _route():
+    rule = request.url_rule
+    return rule.rule if rule is not None else 'unmatched'
+
+
+@contextmanager
+def stage(name):
+    """Time a block (e.g. 'fit' or 'predict') under the current request's route."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        METRICS.record_stage(_route(), name, time.perf_counter() - t0)
+
+
+class SamplingProfiler:
+    """Samples every thread's Python stack at a fixed interval and counts folded stacks.
+
+    Stacks are read with sys._current_frames() and walked through f_back; only the code
+    object and line number of each frame are kept, and labels are formatted once per
+    (code, line) when the profile is served, so sampling does no string work.
+    """
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.stacks = Counter()
+        self.lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            samples = []
+            for tid, frame in sys._current_frames().items():
+                if tid == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append((frame.f_code, frame.f_lineno))
+                    frame = frame.f_back
+                samples.append(tuple(reversed(stack)))
+            with self.lock:
+                self.stacks.update(samples)
+
+    def folded(self):
+        """Folded-stack text (one 'frame;frame;... count' per line), e.g. for flamegraph.pl."""
+        labels = {}
+
+        def label(code, line):
+            key = (code, line)
+            if key not in labels:
+                labels[key] = '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), line or 0)
+            return labels[key]
+
+        with self.lock:
+            counts = self.stacks.most_common()
+        return '\n'.join('%s %d' % (';'.join(label(c, ln) for c, ln in s), n) for s, n in counts) + '\n'
+
+
+def init_app(app, profile=None):
+    """Install request hooks and the /metrics (and optionally /debug/profile) endpoints."""
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_t0 = time.perf_counter()
+        g._metrics_done = request.endpoint in ('metrics', 'debug_profile')
+
+    def _finish(status):
+        if getattr(g, '_metrics_done', True):
+            return
+        g._metrics_done = True
+        METRICS.record(_route(), request.method, status, time.perf_counter() - g._metrics_t0,
+                       request.content_length, g.get('_metrics_resp_bytes'))
+
+    @app.after_request
+    def _after(response):
+        g._metrics_resp_bytes = response.calculate_content_length()
+        _finish(response.status_code)
+        return response
+
+    @app.teardown_request
+    def _teardown(exc):
+        # Exceptions propagated without a response (e.g. debug mode) skip after_request
+        if exc is not None:
+            _finish(500)
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(METRICS.render(), mimetype='text/plain; version=0.0.4')
+
+    if profile is None:
+        profile = os.environ.get('BACKEND_PROFILE', '') not in ('', '0')
+    if profile:
+        profiler = SamplingProfiler(float(os.environ.get('BACKEND_PROFILE_INTERVAL', '0.01')))
+        profiler.start()
+
+        @app.route('/debug/profile')
+        def debug_profile():
+            return Response(profiler.folded(), mimetype='text/plain')
+
+        app.extensions['sampling_profiler'] = profiler
+    return app
@@ -29,23 +29,23 @@ def main():
     args = parser.parse_args()
 
     if not args.skip_download:
-        run("python -m src.download_data --synthetic")
+        run("python -m src download_data --synthetic")
         if args.dryad:
-            run("python -m src.download_data --dryad-macaque")
+            run("python -m src download_data --dryad-macaque")
 
-    run("python -m src.make_clips")
-    run("python -m src.create_labels")
+    run("python -m src make_clips")
+    run("python -m src create_labels")
 
     if not args.skip_train:
-        cmd = "python -m src.train_ssl"
+        cmd = "python -m src train_ssl"
         if args.epochs is not None:
             cmd += f" --epochs {args.epochs}"
         run(cmd)
 
-    run("python -m src.extract_features")
-    run("python -m src.evaluate_transfer")
-    run("python -m src.retrieve_neighbors")
-    run("python -m src.generate_visuals")
+    run("python -m src extract_features")
+    run("python -m src evaluate_transfer")
+    run("python -m src retrieve_neighbors")
+    run("python -m src generate_visuals")
 
     print("\nPipeline complete. Check outputs/figures/ and outputs/retrieval/")
 
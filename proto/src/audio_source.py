@@ -0,0 +1,253 @@
+"""
+PROTO — Audio sources: plain files and members of zip / tar archives, decoded without extraction.
+A directory listing yields AudioSource items for audio files and for audio members of any archive
+in it. Stored zip members and members of uncompressed tars are read in place through a seekable
+byte-range view of the archive; compressed members are decompressed into memory one at a time.
+Compressed tar streams have no random access: iter_directory lists and reads them in one
+sequential pass, and iter_payloads reads the members of an existing listing the same way; both
+hand the member bytes to the caller (e.g. to a worker pool). A member that cannot be read is
+yielded with the exception instead of bytes, so one bad member does not stop the others.
+"""
+import hashlib
+import io
+import re
+import tarfile
+import zipfile
+from contextlib import contextmanager
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+AUDIO_EXTS = (".wav", ".flac", ".ogg", ".aif", ".aiff")
+ARCHIVE_EXTS = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+SEP = "::"
+
+
+class AudioSource(NamedTuple):
+    path: Path  # audio file, or the archive holding it
+    member: Optional[str] = None  # member name inside the archive
+    size: int = 0  # uncompressed bytes
+
+    @property
+    def name(self) -> str:
+        return Path(self.member).name if self.member else self.path.name
+
+    @property
+    def stem(self) -> str:
+        return Path(self.name).stem
+
+    @property
+    def clip_stem(self) -> str:
+        """
+        Collision-free stem for clips cut from this source. Plain .wav files keep their stem
+        (unique within a species directory); other files and archive members get a readable,
+        sanitized 'archive__dir__file' form plus a short hash of the full source id.
+        """
+        if self.member is None and self.path.suffix.lower() == ".wav":
+            return self.stem
+        if self.member is None:
+            readable = self.stem
+        else:
+            archive = self.path.name
+            for ext in sorted(ARCHIVE_EXTS, key=len, reverse=True):
+                if archive.lower().endswith(ext):
+                    archive = archive[: -len(ext)]
+                    break
+            readable = "__".join([archive, *Path(self.member).with_suffix("").parts])
+        readable = re.sub(r"[^A-Za-z0-9_-]+", "_", readable)[:80]
+        return f"{readable}_{hashlib.sha1(str(self).encode()).hexdigest()[:8]}"
+
+    def key(self, base: Path) -> str:
+        """Stable id relative to `base`, e.g. 'Monkey/calls.zip::set1/a.wav'."""
+        rel = str(self.path.relative_to(base))
+        return f"{rel}{SEP}{self.member}" if self.member else rel
+
+    def __str__(self):
+        return f"{self.path.name}{SEP}{self.member}" if self.member else self.path.name
+
+
+def from_key(base: Path, key: str) -> AudioSource:
+    rel, _, member = key.partition(SEP)
+    return AudioSource(base / rel, member or None)
+
+
+def _is_audio(name: str) -> bool:
+    return name.lower().endswith(AUDIO_EXTS)
+
+
+def is_archive(path: Path) -> bool:
+    return path.name.lower().endswith(ARCHIVE_EXTS)
+
+
+def _is_plain_tar(path: Path) -> bool:
+    return path.name.lower().endswith(".tar")
+
+
+def archive_members(path: Path):
+    """Audio members of a zip / tar archive as AudioSource items, in archive order."""
+    if path.name.lower().endswith(".zip"):
+        with zipfile.ZipFile(path) as z:
+            return [AudioSource(path, i.filename, i.file_size) for i in z.infolist()
+                    if not i.is_dir() and _is_audio(i.filename)]
+    with tarfile.open(path) as t:
+        return [AudioSource(path, m.name, m.size) for m in t if m.isfile() and _is_audio(m.name)]
+
+
+def _is_compressed_tar(path: Path) -> bool:
+    return is_archive(path) and not path.name.lower().endswith(".zip") and not _is_plain_tar(path)
+
+
+def list_sources(directory: Path):
+    """Audio files and archive members directly under `directory`, sorted by path."""
+    out = []
+    for p in sorted(directory.iterdir()):
+        if not p.is_file():
+            continue
+        if is_archive(p):
+            try:
+                out.extend(archive_members(p))  # archive order, so compressed tars stream in one pass
+            except (OSError, zipfile.BadZipFile, tarfile.TarError, EOFError):
+                # Unreadable archive: list it whole, so processing reports it as a failed source
+                out.append(AudioSource(p, None, p.stat().st_size))
+        elif _is_audio(p.name):
+            out.append(AudioSource(p, None, p.stat().st_size))
+    return out
+
+
+class _RangeReader(io.RawIOBase):
+    """Read-only, seekable view of bytes [start, start + size) of an open file."""
+
+    def __init__(self, f, start: int, size: int):
+        self._f, self._start, self._size, self._pos = f, start, size, 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: self._size}[whence]
+        self._pos = max(0, min(self._size, base + offset))
+        return self._pos
+
+    def readinto(self, b):
+        n = min(len(b), self._size - self._pos)
+        if n <= 0:
+            return 0
+        self._f.seek(self._start + self._pos)
+        data = self._f.read(n)
+        b[: len(data)] = data
+        self._pos += len(data)
+        return len(data)
+
+
+def _zip_data_offset(f, info: zipfile.ZipInfo) -> int:
+    """Offset of a member's data: the local header's name/extra lengths can differ from the central directory."""
+    f.seek(info.header_offset)
+    header = f.read(zipfile.sizeFileHeader)
+    name_len = int.from_bytes(header[26:28], "little")
+    extra_len = int.from_bytes(header[28:30], "little")
+    return info.header_offset + zipfile.sizeFileHeader + name_len + extra_len
+
+
+@contextmanager
+def open_source(src: AudioSource, payload: Optional[bytes] = None):
+    """
+    Yield something soundfile / librosa can decode: the path of a plain file, a seekable
+    range view for stored members, or an in-memory buffer for compressed members / payload.
+    """
+    if payload is not None:
+        yield io.BytesIO(payload)
+    elif src.member is None:
+        yield src.path
+    elif src.path.name.lower().endswith(".zip"):
+        with open(src.path, "rb") as f, zipfile.ZipFile(f) as z:
+            info = z.getinfo(src.member)
+            if info.compress_type == zipfile.ZIP_STORED and not info.flag_bits & 0x1:
+                start = _zip_data_offset(f, info)
+                yield io.BufferedReader(_RangeReader(f, start, info.file_size), buffer_size=1 << 16)
+            else:
+                with z.open(info) as m:
+                    yield io.BytesIO(m.read())
+    elif _is_plain_tar(src.path):
+        with open(src.path, "rb") as f, tarfile.open(fileobj=f) as t:
+            m = t.getmember(src.member)
+            yield io.BufferedReader(_RangeReader(f, m.offset_data, m.size), buffer_size=1 << 16)
+    else:
+        with tarfile.open(src.path) as t:
+            yield io.BytesIO(t.extractfile(src.member).read())
+
+
+def iter_directory(directory: Path):
+    """
+    Yield (source, payload) for every source list_sources(directory) would return, in the same
+    order, without a separate listing pass: compressed tars are listed and read in one stream.
+    payload is None for sources opened independently, the member bytes for compressed tars, or
+    the exception when the archive cannot be read (the source is then the archive itself).
+    """
+    for p in sorted(directory.iterdir()):
+        if not p.is_file():
+            continue
+        if _is_compressed_tar(p):
+            try:
+                for name, size, data in _stream_tar(p):
+                    yield AudioSource(p, name, size), data
+            except (OSError, tarfile.TarError, EOFError) as e:
+                # Truncated / corrupt stream: members past the damage cannot be reached
+                yield AudioSource(p), e
+        elif is_archive(p):
+            try:
+                members = archive_members(p)
+            except (OSError, zipfile.BadZipFile, tarfile.TarError, EOFError) as e:
+                yield AudioSource(p), e
+                continue
+            for src in members:
+                yield src, None
+        elif _is_audio(p.name):
+            yield AudioSource(p, None, p.stat().st_size), None
+
+
+def iter_payloads(sources):
+    """
+    Yield (source, payload) in input order. payload is None when the source can be opened
+    independently (plain files, zip members, uncompressed tars); members of compressed tars are
+    read in one sequential pass per archive and yielded with their bytes. A member that is
+    missing or unreadable is yielded with the exception as its payload.
+    """
+    streamed, broken = {}, {}
+    for src in sources:
+        if src.member is None or not _is_compressed_tar(src.path):
+            yield src, None
+            continue
+        if src.path in broken:
+            yield src, broken[src.path]
+            continue
+        try:
+            if src.path not in streamed:
+                streamed[src.path] = _stream_tar(src.path)
+            for name, _, data in streamed[src.path]:
+                if name == src.member:
+                    break
+            else:
+                # Not in the rest of the stream: restart it so later members can still be found
+                streamed[src.path] = _stream_tar(src.path)
+                raise KeyError(f"{src.member} not found in {src.path}")
+        except KeyError as e:
+            yield src, e
+            continue
+        except (OSError, tarfile.TarError, EOFError) as e:
+            broken[src.path] = e
+            yield src, e
+            continue
+        yield src, data
+
+
+def _stream_tar(path: Path):
+    """(member name, size, bytes) of the audio members of a tar, read as one sequential stream."""
+    with tarfile.open(path, mode="r|*") as t:
+        for m in t:
+            if m.isfile() and _is_audio(m.name):
+                yield m.name, m.size, t.extractfile(m).read()
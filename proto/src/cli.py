@@ -0,0 +1,93 @@
+"""
+PROTO — Single command-line entry point: python -m src <stage> [stage options], or `proto <stage>`
+once installed with `pip install -e .` (pyproject.toml console script).
+Stage modules (and their torch / librosa / sklearn imports) are only imported when that
+stage runs, so `--help`, listing stages and light stages start quickly.
+`python -m src bench-startup` reports cold-start wall time of `python -m src <stage> --help` per stage.
+"""
+import argparse
+import importlib
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from .config_loader import PROJECT_ROOT
+
+STAGES = {
+    "download_data": "Generate synthetic WAVs / download Dryad macaque data",
+    "make_clips": "Raw WAV -> mono 16 kHz clips (fixed or event segmentation)",
+    "create_labels": "Write data/clip_labels.csv (auto or --template)",
+    "dedup_clips": "Near-duplicate detection -> data/clip_manifest.csv",
+    "train_ssl": "Train the SSL encoder",
+    "sampler": "Species-balanced / hard-negative batch sampler: epochs-to-target probe report",
+    "sweep": "Parallel ASHA hyperparameter sweep; promotes the best encoder",
+    "extract_features": "Embed clips -> outputs/audio_embeddings.csv",
+    "evaluate_transfer": "Silhouette, transfer test, baseline, transfer matrix",
+    "retrieve_neighbors": "Cross-species retrieval metrics",
+    "generate_visuals": "Figures in outputs/figures/",
+    "codec": "float16 / int8 / PQ embedding codecs: size, speed and accuracy report",
+    "grad_cache": "Chunked InfoNCE equivalence check / --bench peak memory",
+    "distill": "Distill the SSL encoder into a small student",
+    "profile_encoders": "Params / FLOPs / latency / throughput per encoder arch",
+    "shard": "Sharded make_clips / extract_features (manifest, work i/N, merge)",
+}
+
+
+def _prog() -> str:
+    """How this CLI was invoked: the installed `proto` script or `python -m src`."""
+    return "proto" if Path(sys.argv[0]).stem == "proto" else "python -m src"
+
+
+def run_stage(stage: str, args, prog: str = "python -m src") -> None:
+    module = importlib.import_module(f".{stage}", __package__)
+    sys.argv = [f"{prog} {stage}"] + list(args)
+    module.main()
+
+
+def _time_cold_start(args, repeats: int) -> tuple:
+    """(best, median) wall time over `repeats` fresh interpreters running `python <args>`."""
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        subprocess.run([sys.executable, *args], cwd=PROJECT_ROOT, check=True, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - t0)
+    return min(times), statistics.median(times)
+
+
+def bench_startup(argv) -> None:
+    parser = argparse.ArgumentParser(prog="python -m src bench-startup")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args(argv)
+    base_min, _ = _time_cold_start(["-c", "pass"], args.repeats)
+    cli_min, cli_med = _time_cold_start(["-m", "src", "--help"], args.repeats)
+    print(f"{'command':<30}{'best (s)':>10}{'median (s)':>12}{'over python (s)':>17}")
+    print(f"{'python':<30}{base_min:>10.3f}{'':>12}{'':>17}")
+    print(f"{'--help':<30}{cli_min:>10.3f}{cli_med:>12.3f}{cli_min - base_min:>17.3f}")
+    for stage in STAGES:
+        best, med = _time_cold_start(["-m", "src", stage, "--help"], args.repeats)
+        print(f"{stage + ' --help':<30}{best:>10.3f}{med:>12.3f}{best - base_min:>17.3f}")
+
+
+def main(argv=None) -> None:
+    prog = _prog()
+    epilog = "stages:\n" + "\n".join(f"  {name:<20}{desc}" for name, desc in STAGES.items())
+    epilog += f"\n  bench-startup       Cold-start time of `<stage> --help` per stage\n\nRun `{prog} <stage> --help` for stage options."
+    parser = argparse.ArgumentParser(
+        prog=prog,
+        description="PROTO — Cross-Species Acoustic Proto-Language Discovery",
+        epilog=epilog,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument("stage", choices=list(STAGES) + ["bench-startup"], metavar="stage")
+    parser.add_argument("args", nargs=argparse.REMAINDER, help=argparse.SUPPRESS)
+    ns = parser.parse_args(argv)
+    if ns.stage == "bench-startup":
+        bench_startup(ns.args)
+    else:
+        run_stage(ns.stage, ns.args, prog)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+"""
+PROTO — Compact embedding codecs and search on compressed codes.
+  float32 — reference (4 B/dim)
+  float16 — half precision (2 B/dim)
+  int8    — per-dimension scale/offset, uint8 codes (1 B/dim); x ≈ offset + scale · code
+  pq      — product quantization: `codec.pq_subspaces` sub-vectors, each a 1-byte index into a
+            k-means codebook trained on the corpus (m B/vector)
+Scores are computed on the codes, one database tile at a time with a running top-k (as in knn):
+float16 / int8 tiles are upcast only tile by tile, int8 folds scale/offset into the query, and PQ
+sums per-query lookup tables (asymmetric distance) without reconstructing vectors. Memory stays
+O(query_block × db_block) for any corpus size. Per-vector norms of the reconstructions are stored
+alongside, giving cosine scores.
+`python -m src codec` writes outputs/codec_report.csv: bytes per vector, reconstruction cosine,
+silhouette, transfer accuracy, cross-species hit@k / recall@k / mAP@k, top-k overlap with float32, query speed.
+`--save int8` (etc.) writes the compressed store outputs/audio_embeddings.<codec>.npz.
+"""
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from .config_loader import load_config, get_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Float32Codec:
+    name = "float32"
+
+    def fit(self, X):
+        return self
+
+    def encode(self, X):
+        return np.asarray(X, dtype=np.float32)
+
+    def decode(self, codes):
+        return np.asarray(codes, dtype=np.float32)
+
+    def bytes_per_vector(self, dim):
+        return 4 * dim
+
+    def prepare(self, Q):
+        """Per-query-block state reused across database tiles."""
+        return np.asarray(Q, dtype=np.float32)
+
+    def score(self, state, codes):
+        """(n_q, n) inner products for a prepared query block and one tile of codes."""
+        return state @ codes.T.astype(np.float32, copy=False)
+
+    def inner(self, Q, codes):
+        """(n_q, n) inner products between float32 queries and encoded vectors."""
+        return self.score(self.prepare(Q), codes)
+
+    def state(self):
+        return {}
+
+
+class Float16Codec(Float32Codec):
+    name = "float16"
+
+    def encode(self, X):
+        return np.asarray(X, dtype=np.float16)
+
+    def bytes_per_vector(self, dim):
+        return 2 * dim
+
+
+class Int8Codec(Float32Codec):
+    """Per-dimension affine quantization to 256 levels over the fitted min..max range."""
+
+    name = "int8"
+
+    def fit(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        self.offset = X.min(axis=0)
+        self.scale = np.maximum(X.max(axis=0) - self.offset, 1e-12) / 255.0
+        return self
+
+    def encode(self, X):
+        q = np.rint((np.asarray(X, dtype=np.float32) - self.offset) / self.scale)
+        return np.clip(q, 0, 255).astype(np.uint8)
+
+    def decode(self, codes):
+        return self.offset + self.scale * codes.astype(np.float32)
+
+    def bytes_per_vector(self, dim):
+        return dim
+
+    def prepare(self, Q):
+        # q·x = q·offset + (q ∘ scale)·code
+        Q = np.asarray(Q, dtype=np.float32)
+        return (Q * self.scale).astype(np.float32), (Q @ self.offset).astype(np.float32)[:, None]
+
+    def score(self, state, codes):
+        Qs, bias = state
+        return Qs @ codes.T.astype(np.float32) + bias
+
+    def state(self):
+        return {"offset": self.offset, "scale": self.scale}
+
+
+class PQCodec(Float32Codec):
+    """Product quantizer: m sub-spaces × n_centroids (≤ 256) k-means codebooks, one byte per sub-space."""
+
+    name = "pq"
+
+    def __init__(self, n_subspaces=16, n_centroids=256, train_max=100000, seed=42):
+        self.m, self.k, self.train_max, self.seed = n_subspaces, n_centroids, train_max, seed
+
+    def fit(self, X):
+        from sklearn.cluster import KMeans
+
+        X = np.asarray(X, dtype=np.float32)
+        if X.shape[1] % self.m:
+            raise ValueError(f"dim {X.shape[1]} not divisible by pq_subspaces {self.m}")
+        rng = np.random.default_rng(self.seed)
+        if len(X) > self.train_max:
+            X = X[rng.choice(len(X), self.train_max, replace=False)]
+        self.k = min(self.k, 256, len(X))
+        self.sub = X.shape[1] // self.m
+        self.codebooks = np.stack([
+            KMeans(n_clusters=self.k, n_init=1, random_state=self.seed)
+            .fit(X[:, j * self.sub : (j + 1) * self.sub]).cluster_centers_
+            for j in range(self.m)
+        ]).astype(np.float32)  # (m, k, sub)
+        return self
+
+    def encode(self, X):
+        X = np.asarray(X, dtype=np.float32)
+        codes = np.empty((len(X), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            xs = X[:, j * self.sub : (j + 1) * self.sub]
+            C = self.codebooks[j]
+            d = (xs ** 2).sum(1)[:, None] - 2 * xs @ C.T + (C ** 2).sum(1)[None, :]
+            codes[:, j] = d.argmin(axis=1)
+        return codes
+
+    def decode(self, codes):
+        return np.concatenate([self.codebooks[j][codes[:, j]] for j in range(self.m)], axis=1)
+
+    def bytes_per_vector(self, dim):
+        return self.m
+
+    def prepare(self, Q):
+        # Asymmetric distance: per-query lookup table (n_q, m, k), summed over sub-spaces
+        Q = np.asarray(Q, dtype=np.float32).reshape(len(Q), self.m, self.sub)
+        return np.einsum("qms,mks->qmk", Q, self.codebooks)
+
+    def score(self, lut, codes):
+        out = np.zeros((len(lut), len(codes)), dtype=np.float32)
+        for j in range(self.m):
+            out += lut[:, j, codes[:, j]]
+        return out
+
+    def state(self):
+        return {"codebooks": self.codebooks}
+
+
+def build_codec(name, cfg):
+    ccfg = cfg.get("codec", {})
+    if name == "pq":
+        return PQCodec(int(ccfg.get("pq_subspaces", 16)), int(ccfg.get("pq_centroids", 256)),
+                       int(ccfg.get("pq_train_max", 100000)), int(cfg.get("seed", 42)))
+    return {"float32": Float32Codec, "float16": Float16Codec, "int8": Int8Codec}[name]()
+
+
+CODECS = ("float32", "float16", "int8", "pq")
+
+
+def vector_norms(codec, codes, block=65536):
+    return np.concatenate([
+        np.linalg.norm(codec.decode(codes[i : i + block]), axis=1) for i in range(0, len(codes), block)
+    ]).astype(np.float32)
+
+
+def search(codec, codes, norms, Q, k, groups=None, query_groups=None, exclude_ids=None,
+           query_block=256, db_block=8192):
+    """
+    Top-k cosine neighbours of float32 queries Q among encoded vectors, scored on the codes.
+    Each query block streams over tiles of db_block codes and keeps a running top-k.
+    groups / query_groups: skip database items in the query's group (cross-group search).
+    exclude_ids: per-query database id to skip (the query itself), or None.
+    """
+    Qn = np.asarray(Q, dtype=np.float32)
+    Qn = Qn / (np.linalg.norm(Qn, axis=1, keepdims=True) + 1e-10)
+    ids = np.empty((len(Q), k), dtype=np.int64)
+    scores = np.empty((len(Q), k), dtype=np.float32)
+    for s in range(0, len(Q), query_block):
+        state = codec.prepare(Qn[s : s + query_block])
+        n_q = min(query_block, len(Q) - s)
+        best_s = np.full((n_q, k), -np.inf, dtype=np.float32)
+        best_i = np.full((n_q, k), -1, dtype=np.int64)
+        for d0 in range(0, len(codes), db_block):
+            S = codec.score(state, codes[d0 : d0 + db_block]) / (norms[None, d0 : d0 + db_block] + 1e-10)
+            d_ids = np.arange(d0, d0 + S.shape[1])
+            if exclude_ids is not None:
+                S[exclude_ids[s : s + n_q][:, None] == d_ids[None, :]] = -np.inf
+            if groups is not None:
+                S[query_groups[s : s + n_q][:, None] == groups[None, d0 : d0 + db_block]] = -np.inf
+            cand_s = np.concatenate([best_s, S], axis=1)
+            cand_i = np.concatenate([best_i, np.broadcast_to(d_ids, S.shape)], axis=1)
+            part = np.argpartition(-cand_s, k - 1, axis=1)[:, :k]
+            best_s = np.take_along_axis(cand_s, part, axis=1)
+            best_i = np.take_along_axis(cand_i, part, axis=1)
+        order = np.argsort(-best_s, axis=1, kind="stable")
+        ids[s : s + n_q] = np.take_along_axis(best_i, order, axis=1)
+        scores[s : s + n_q] = np.take_along_axis(best_s, order, axis=1)
+    ids[~np.isfinite(scores)] = -1
+    return ids, scores
+
+
+def save_store(path, codec, codes, norms, df):
+    """Compressed embedding store: codes, reconstruction norms, codec parameters, clip / species."""
+    np.savez(path, codec=codec.name, codes=codes, norms=norms,
+             clip=df["clip"].to_numpy(dtype=str), species=df["species"].to_numpy(dtype=str),
+             **{f"param_{k}": v for k, v in codec.state().items()})
+
+
+def load_store(path):
+    """Returns (codec, codes, norms, DataFrame[clip, species])."""
+    z = np.load(path)
+    name = str(z["codec"])
+    codec = {"float32": Float32Codec, "float16": Float16Codec, "int8": Int8Codec, "pq": PQCodec}[name]()
+    params = {k[len("param_"):]: z[k] for k in z.files if k.startswith("param_")}
+    if name == "int8":
+        codec.offset, codec.scale = params["offset"], params["scale"]
+    elif name == "pq":
+        codec.codebooks = params["codebooks"]
+        codec.m, codec.k, codec.sub = codec.codebooks.shape
+    return codec, z["codes"], z["norms"], pd.DataFrame({"clip": z["clip"], "species": z["species"]})
+
+
+def run(cfg, codecs=CODECS, k=10, save=None):
+    from . import evaluate_transfer
+    from .knn import ranking_metrics
+    from .retrieve_neighbors import relevant_counts
+
+    df, X, y_func, labeled_mask, _ = evaluate_transfer.load_embeddings_and_labels(cfg)
+    X = np.asarray(X, dtype=np.float32)
+    species_codes, _ = pd.factorize(df["species"])
+    labels = np.where(labeled_mask, y_func, -1).astype(int)
+    n_relevant = relevant_counts(labels, species_codes, "cross")
+    k = min(k, len(X) - 1)
+    self_ids = np.arange(len(X))
+    csv_bytes = get_path(cfg, "embeddings_csv").stat().st_size / len(X)
+
+    rows, ref_ids = [], None
+    for name in codecs:
+        codec = build_codec(name, cfg)
+        t0 = time.perf_counter()
+        codec.fit(X)
+        codes = codec.encode(X)
+        fit_s = time.perf_counter() - t0
+        norms = vector_norms(codec, codes)
+        X_dec = codec.decode(codes)
+        t0 = time.perf_counter()
+        ids, _ = search(codec, codes, norms, X, k, groups=species_codes, query_groups=species_codes, exclude_ids=self_ids)
+        query_s = time.perf_counter() - t0
+        if ref_ids is None:
+            ref_ids = ids
+        hit, recall, ap, _ = ranking_metrics(ids, labels, labels, n_relevant, k)
+        overlap = np.mean([len(set(a) & set(b)) / k for a, b in zip(ids, ref_ids)])
+        recon = np.sum(X * X_dec, axis=1) / (np.linalg.norm(X, axis=1) * np.linalg.norm(X_dec, axis=1) + 1e-10)
+        sil = evaluate_transfer.eval1_silhouette_by_function(X_dec, y_func, labeled_mask)
+        acc, _ = evaluate_transfer.eval2_transfer_test(df, X_dec, y_func, labeled_mask, cfg)
+        bpv = codec.bytes_per_vector(X.shape[1]) + 4  # + float32 norm
+        rows.append({
+            "codec": name,
+            "bytes_per_vector": bpv,
+            "compression_vs_csv": csv_bytes / bpv,
+            "reconstruction_cosine": float(np.mean(recon)),
+            "silhouette": sil,
+            "transfer_accuracy": acc,
+            f"hit@{k}": float(np.nanmean(hit)) if np.isfinite(hit).any() else np.nan,
+            f"recall@{k}": float(np.nanmean(recall)) if np.isfinite(recall).any() else np.nan,
+            f"mAP@{k}": float(np.nanmean(ap)) if np.isfinite(ap).any() else np.nan,
+            f"overlap@{k}_vs_float32": float(overlap),
+            "queries_per_s": len(X) / query_s,
+            "fit_encode_s": fit_s,
+        })
+        logger.info("%s", rows[-1])
+        if save == name:
+            out_path = get_path(cfg, "embeddings_csv").with_suffix(f".{name}.npz")
+            save_store(out_path, codec, codes, norms, df)
+            logger.info("Saved %s store (%d × %d B) to %s", name, len(codes), bpv, out_path)
+
+    report = pd.DataFrame(rows)
+    out_path = get_path(cfg, "outputs") / "codec_report.csv"
+    report.to_csv(out_path, index=False)
+    logger.info("Codec report (CSV text: %.0f B/vector):\n%s", csv_bytes, report.round(4).to_string(index=False))
+    logger.info("Saved %s", out_path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--codecs", nargs="*", choices=CODECS, default=list(CODECS))
+    parser.add_argument("--k", type=int, default=None, help="Retrieval depth (default eval.n_retrieval_neighbors)")
+    parser.add_argument("--save", choices=CODECS, default=None, help="Also write the compressed store for this codec")
+    args = parser.parse_args()
+    cfg = load_config()
+    k = args.k or int(cfg.get("eval", {}).get("n_retrieval_neighbors", 10))
+    run(cfg, codecs=args.codecs, k=k, save=args.save)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+"""
+PROTO — Near-duplicate clip detection via SimHash / LSH.
+Each clip is described by a cheap spectral fingerprint (mean + std of its log-mel over time)
+or by its SSL embedding; random-hyperplane SimHash bits are split into bands, clips sharing a
+band bucket become candidates, and only candidates are verified by cosine similarity.
+Near-duplicates are grouped within each species (cross-species similarity is what we study).
+Output: data/clip_manifest.csv (clip, species, group, keep)
+"""
+import argparse
+import logging
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import soundfile as sf
+from tqdm import tqdm
+
+from .config_loader import load_config, get_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def spectral_fingerprint(path: Path, sr: int, n_mels: int) -> np.ndarray:
+    from .mel import log_mel
+
+    y, _ = sf.read(path)
+    if len(y.shape) > 1:
+        y = y.mean(axis=1)
+    mel = log_mel(y.astype(np.float32), sr, n_mels)
+    return np.concatenate([mel.mean(axis=1), mel.std(axis=1)])
+
+
+def load_fingerprints(cfg):
+    clips_base = get_path(cfg, "clips_1s")
+    rows, feats = [], []
+    for species in cfg["species"]:
+        d = clips_base / species
+        if not d.exists():
+            continue
+        for path in tqdm(sorted(d.glob("*.wav")), desc=species):
+            try:
+                feats.append(spectral_fingerprint(path, cfg["sr"], cfg["n_mels"]))
+            except Exception as e:
+                logger.warning("Skip %s: %s", path.name, e)
+                continue
+            rows.append({"clip": path.name, "species": species})
+    return pd.DataFrame(rows), np.asarray(feats, dtype=np.float32)
+
+
+def load_embedding_features(cfg):
+    df = pd.read_csv(get_path(cfg, "embeddings_csv"))
+    feat_cols = [c for c in df.columns if c.startswith("f")]
+    return df[["clip", "species"]].reset_index(drop=True), np.asarray(df[feat_cols], dtype=np.float32)
+
+
+def simhash(X: np.ndarray, n_bits: int, seed: int) -> np.ndarray:
+    """Random-hyperplane signatures of mean-centred, L2-normalised rows: (n, n_bits) bool."""
+    X = X - X.mean(axis=0, keepdims=True)
+    X = X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-10)
+    planes = np.random.default_rng(seed).standard_normal((X.shape[1], n_bits)).astype(np.float32)
+    return (X @ planes) > 0
+
+
+def near_duplicate_groups(X: np.ndarray, n_bits=64, n_bands=8, threshold=0.98, seed=42) -> np.ndarray:
+    """
+    Group ids (n,): each group is a leader row plus the rows with cosine >= threshold to it.
+    Only pairs colliding in at least one LSH band are compared, so cost is ~linear in n
+    for sparse duplicates instead of the n^2 of an all-pairs scan. Grouping is by leader
+    (not transitive) so a slow drift of similar clips does not collapse into one group.
+    """
+    n = len(X)
+    if n < 2:
+        return np.arange(n)
+    bits = simhash(X, n_bits, seed)
+    Xn = X - X.mean(axis=0, keepdims=True)
+    Xn = Xn / (np.linalg.norm(Xn, axis=1, keepdims=True) + 1e-10)
+    band_width = n_bits // n_bands
+    weights = 1 << np.arange(band_width, dtype=np.uint64)
+    neighbors = defaultdict(set)
+    for b in range(n_bands):
+        keys = bits[:, b * band_width : (b + 1) * band_width].astype(np.uint64) @ weights
+        buckets = defaultdict(list)
+        for i, k in enumerate(keys):
+            buckets[int(k)].append(i)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            idx = np.asarray(members)
+            sims = Xn[idx] @ Xn[idx].T
+            ii, jj = np.nonzero(np.triu(sims >= threshold, k=1))
+            for a, c in zip(idx[ii], idx[jj]):
+                neighbors[int(a)].add(int(c))
+    groups = np.full(n, -1)
+    for i in range(n):
+        if groups[i] >= 0:
+            continue
+        groups[i] = i
+        for j in neighbors.get(i, ()):
+            if groups[j] < 0:
+                groups[j] = i
+    return groups
+
+
+def kept_clips(cfg):
+    """(species, clip) pairs kept by the dedup manifest, or None when filtering is disabled."""
+    if not cfg.get("dedup", {}).get("enabled", False):
+        return None
+    path = get_path(cfg, "dedup_manifest")
+    if not path.exists():
+        logger.warning("dedup.enabled but %s not found; run dedup_clips first", path)
+        return None
+    m = pd.read_csv(path)
+    m = m[m["keep"] == 1]
+    return set(zip(m["species"].astype(str), m["clip"]))
+
+
+def estimate_clip_cost(cfg, paths, n_sample=32) -> float:
+    """Mean seconds to load + augment + mel one training pair (what an epoch pays per clip)."""
+    from .train_ssl import ClipDataset
+
+    if not paths:
+        return 0.0
+    rng = np.random.default_rng(cfg.get("seed", 42))
+    sample = [paths[i] for i in rng.choice(len(paths), size=min(n_sample, len(paths)), replace=False)]
+    ds = ClipDataset(sample, cfg["sr"], cfg["n_mels"], augment=True)
+    ds[0]  # warm up librosa / numba
+    t0 = time.perf_counter()
+    for i in range(len(ds)):
+        ds[i]
+    return (time.perf_counter() - t0) / len(ds)
+
+
+def run(cfg, source=None) -> pd.DataFrame:
+    dcfg = cfg.get("dedup", {})
+    source = source or dcfg.get("source", "fingerprint")
+    t0 = time.perf_counter()
+    if source == "embeddings":
+        df, X = load_embedding_features(cfg)
+    else:
+        df, X = load_fingerprints(cfg)
+    t_feat = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    df["group"] = ""
+    df["keep"] = 0
+    for species in df["species"].unique():
+        idx = np.flatnonzero(df["species"].values == species)
+        groups = near_duplicate_groups(
+            X[idx],
+            n_bits=int(dcfg.get("n_bits", 64)),
+            n_bands=int(dcfg.get("n_bands", 8)),
+            threshold=float(dcfg.get("threshold", 0.98)),
+            seed=int(cfg.get("seed", 42)),
+        )
+        df.loc[idx, "group"] = [f"{species}_{g:06d}" for g in groups]
+        # Keep the group representative (lowest index == first clip in sorted order)
+        df.loc[idx, "keep"] = (groups == np.arange(len(idx))).astype(int)
+    t_group = time.perf_counter() - t0
+
+    out_path = get_path(cfg, "dedup_manifest")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(out_path, index=False)
+
+    n_total, n_kept = len(df), int(df["keep"].sum())
+    ratio = n_total / max(n_kept, 1)
+    clips_base = get_path(cfg, "clips_1s")
+    all_paths = [str(clips_base / s / c) for s, c in zip(df["species"], df["clip"])]
+    per_clip = estimate_clip_cost(cfg, all_paths)
+    logger.info("Dedup (%s): %d clips -> %d kept (compression %.2fx)", source, n_total, n_kept, ratio)
+    logger.info("Features %.2fs, LSH grouping %.2fs", t_feat, t_group)
+    logger.info(
+        "Estimated train_ssl data time per epoch: %.1fs -> %.1fs (saves %.1fs)",
+        per_clip * n_total, per_clip * n_kept, per_clip * (n_total - n_kept),
+    )
+    logger.info("Saved %s (set dedup.enabled: true to filter training/evaluation)", out_path)
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--source", choices=["fingerprint", "embeddings"], default=None)
+    args = parser.parse_args()
+    cfg = load_config()
+    run(cfg, source=args.source)
+
+
+if __name__ == "__main__":
+    main()
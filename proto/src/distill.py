@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+PROTO — Knowledge distillation of the SSL encoder into a small student.
+Log-mels and teacher embeddings are computed once and cached (outputs/distill/*.npy, keyed by the
+teacher's model hash and each clip's name, size and mtime); the student regresses the teacher's embeddings (MSE) and optionally matches
+its in-batch similarity structure (KL between softmaxed cosine-similarity rows).
+Output: models/student_model.pt (loadable with `extract_features --model student_model.pt`),
+        outputs/distill/distill_report.csv (speedup vs silhouette / transfer accuracy)
+"""
+import argparse
+import copy
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+import soundfile as sf
+from tqdm import tqdm
+
+from .config_loader import load_config, get_path
+from .extract_features import load_encoder, model_hash
+from .mel import log_mel
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _clip_list(cfg):
+    clips_base = get_path(cfg, "clips_1s")
+    rows = []
+    for species in cfg["species"]:
+        d = clips_base / species
+        if d.exists():
+            rows.extend((species, p) for p in sorted(d.glob("*.wav")))
+    return rows
+
+
+def build_cache(cfg, teacher, device, cache_dir, batch_size=256):
+    """Compute (or reuse) cached log-mels and teacher embeddings for every clip."""
+    import torch
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    meta_path = cache_dir / "cache.json"
+    thash = model_hash(cfg)
+    clips = _clip_list(cfg)
+    stats = [p.stat() for _, p in clips]
+    # Size and mtime make regenerated clips with unchanged names invalidate the cache
+    index = pd.DataFrame({
+        "species": [s for s, _ in clips],
+        "clip": [p.name for _, p in clips],
+        "size": [st.st_size for st in stats],
+        "mtime_ns": [st.st_mtime_ns for st in stats],
+    })
+    if meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+        cached = pd.read_csv(cache_dir / "index.csv")
+        if meta.get("teacher_hash") == thash and cached.equals(index):
+            logger.info("Reusing teacher cache (%d clips, teacher %s)", len(index), thash)
+            return index, np.load(cache_dir / "mels.npy", mmap_mode="r"), np.load(cache_dir / "teacher.npy")
+
+    def embed(batch):
+        with torch.no_grad():
+            return teacher(torch.from_numpy(np.stack(batch)).unsqueeze(1).to(device)).cpu().numpy()
+
+    sr, n_mels = cfg["sr"], cfg["n_mels"]
+    mels, teacher_out = [], []
+    batch = []
+    for _, path in tqdm(clips, desc="teacher cache"):
+        y, _ = sf.read(path)
+        if len(y.shape) > 1:
+            y = y.mean(axis=1)
+        mel = log_mel(y.astype(np.float32), sr, n_mels)
+        mels.append(mel.astype(np.float16))
+        batch.append(mel)
+        if len(batch) == batch_size:
+            teacher_out.append(embed(batch))
+            batch = []
+    if batch:
+        teacher_out.append(embed(batch))
+    mels = np.stack(mels)
+    teacher_emb = np.concatenate(teacher_out).astype(np.float32)
+    np.save(cache_dir / "mels.npy", mels)
+    np.save(cache_dir / "teacher.npy", teacher_emb)
+    index.to_csv(cache_dir / "index.csv", index=False)
+    meta_path.write_text(json.dumps({"teacher_hash": thash, "n_clips": len(index)}))
+    logger.info("Cached %d mels + teacher embeddings in %s", len(index), cache_dir)
+    return index, mels, teacher_emb
+
+
+def distill_loss(s, t, similarity_weight=0.0, temperature=0.1):
+    """MSE to teacher embeddings + optional KL between in-batch cosine-similarity distributions."""
+    import torch
+    import torch.nn.functional as F
+
+    loss = F.mse_loss(s, t)
+    if similarity_weight > 0:
+        sn, tn = F.normalize(s, dim=1), F.normalize(t, dim=1)
+        mask = torch.eye(len(s), dtype=torch.bool, device=s.device)
+        s_logits = (sn @ sn.t() / temperature).masked_fill(mask, -1e9)
+        t_logits = (tn @ tn.t() / temperature).masked_fill(mask, -1e9)
+        kl = F.kl_div(F.log_softmax(s_logits, dim=1), F.softmax(t_logits, dim=1), reduction="batchmean")
+        loss = loss + similarity_weight * kl
+    return loss
+
+
+def embed_cached(model, mels, device, batch_size=256):
+    import torch
+
+    model.eval()
+    out = []
+    with torch.no_grad():
+        for i in range(0, len(mels), batch_size):
+            x = torch.from_numpy(np.asarray(mels[i : i + batch_size], dtype=np.float32)).unsqueeze(1).to(device)
+            out.append(model(x).cpu().numpy())
+    return np.concatenate(out)
+
+
+def _score_embeddings(cfg, index, emb, csv_path):
+    """Silhouette by function + transfer accuracy via evaluate_transfer on an embeddings CSV."""
+    from . import evaluate_transfer
+
+    df = index[["clip", "species"]].copy()
+    feats = pd.DataFrame(emb, columns=[f"f{i}" for i in range(emb.shape[1])])
+    pd.concat([df, feats], axis=1).to_csv(csv_path, index=False)
+    vcfg = copy.deepcopy(cfg)
+    vcfg["paths"]["embeddings_csv"] = csv_path
+    df, X, y_func, labeled_mask, _ = evaluate_transfer.load_embeddings_and_labels(vcfg)
+    sil = evaluate_transfer.eval1_silhouette_by_function(X, y_func, labeled_mask)
+    acc, _ = evaluate_transfer.eval2_transfer_test(df, X, y_func, labeled_mask, vcfg)
+    return sil, acc
+
+
+def run(cfg, epochs=None, arch=None):
+    import torch
+
+    from .model import ENCODERS, build_encoder
+    from .profile_encoders import count_flops, measure_latency
+    from .train_ssl import _atomic_save
+
+    dcfg = cfg.get("distill", {})
+    arch = arch or dcfg.get("arch", "tiny")
+    epochs = int(epochs or dcfg.get("epochs", 30))
+    batch_size = int(dcfg.get("batch_size", 128))
+    sim_w = float(dcfg.get("similarity_weight", 0.0))
+    sim_t = float(dcfg.get("temperature", 0.1))
+    seed = int(cfg.get("seed", 42))
+    torch.manual_seed(seed)
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    teacher = load_encoder(cfg, device)
+    out_dir = get_path(cfg, "outputs") / "distill"
+    index, mels, teacher_emb = build_cache(cfg, teacher, device, out_dir)
+    if len(index) == 0:
+        logger.error("No clips found under %s. Run make_clips.py first.", get_path(cfg, "clips_1s"))
+        return None
+
+    student_cfg = copy.deepcopy(cfg)
+    student_cfg.setdefault("encoder", {})["arch"] = arch
+    student = build_encoder(student_cfg).to(device)
+    opt = torch.optim.Adam(student.parameters(), lr=float(dcfg.get("lr", 1e-3)))
+    targets = torch.from_numpy(teacher_emb)
+    gen = torch.Generator().manual_seed(seed)
+    for ep in range(epochs):
+        student.train()
+        perm = torch.randperm(len(index), generator=gen)
+        total, n_batches = 0.0, 0
+        for i in range(0, len(perm), batch_size):
+            idx = perm[i : i + batch_size].numpy()
+            idx.sort()  # monotone reads from the mel memmap
+            x = torch.from_numpy(np.asarray(mels[idx], dtype=np.float32)).unsqueeze(1).to(device)
+            loss = distill_loss(student(x), targets[idx].to(device), sim_w, sim_t)
+            opt.zero_grad()
+            loss.backward()
+            opt.step()
+            total += loss.item()
+            n_batches += 1
+        if (ep + 1) % 10 == 0 or ep == 0:
+            logger.info("Epoch %d distill loss %.4f", ep + 1, total / max(n_batches, 1))
+
+    models_dir = get_path(cfg, "models")
+    student_path = models_dir / "student_model.pt"
+    _atomic_save({
+        "encoder": student.state_dict(),
+        "config": {k: v for k, v in student_cfg.items() if k != "paths"},
+        "teacher_hash": model_hash(cfg),
+    }, student_path)
+    logger.info("Saved %s", student_path)
+
+    # Report: cost vs quality of teacher and student
+    teacher.cpu().eval()
+    student.cpu().eval()
+    x1 = torch.from_numpy(np.asarray(mels[:1], dtype=np.float32)).unsqueeze(1)
+    xb = torch.from_numpy(np.asarray(mels[:64], dtype=np.float32)).unsqueeze(1)
+    rows = []
+    for name, model in (("teacher", teacher), ("student", student)):
+        emb = teacher_emb if name == "teacher" else embed_cached(model, mels, torch.device("cpu"))
+        sil, acc = _score_embeddings(cfg, index, emb, out_dir / f"{name}_embeddings.csv")
+        rows.append({
+            "model": name,
+            "arch": {v: k for k, v in ENCODERS.items()}[type(model)],
+            "params": sum(p.numel() for p in model.parameters()),
+            "mflops_per_clip": count_flops(model, x1) / 1e6,
+            "latency_ms": measure_latency(model, x1) * 1e3,
+            "batch_ms": measure_latency(model, xb, n_warmup=2, n_runs=10) * 1e3,
+            "silhouette": sil,
+            "transfer_accuracy": acc,
+        })
+    report = pd.DataFrame(rows)
+    report["speedup"] = report["latency_ms"].iloc[0] / report["latency_ms"]
+    report.to_csv(out_dir / "distill_report.csv", index=False)
+    logger.info("Distillation report:\n%s", report.round(4).to_string(index=False))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=None)
+    parser.add_argument("--arch", default=None, help="Student encoder arch (default distill.arch)")
+    args = parser.parse_args()
+    cfg = load_config()
+    run(cfg, epochs=args.epochs, arch=args.arch)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,6 @@ from pathlib import Path
 import argparse
 import logging
 import zipfile
-import io
 
 from .config_loader import load_config, PROJECT_ROOT
 
@@ -23,8 +22,12 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def download_dryad_macaque(cfg: dict) -> None:
-    """Download and unpack Dryad macaque vocalization dataset into data/raw_wav/Monkey."""
+def download_dryad_macaque(cfg: dict, extract: bool = False) -> None:
+    """
+    Download the Dryad macaque vocalization dataset into data/raw_wav/Monkey. The zip is kept as-is
+    (make_clips reads its members directly); extract=True instead keeps it in data/downloads and
+    unpacks the WAVs into data/raw_wav/Monkey.
+    """
     try:
         import requests
     except ImportError:
@@ -32,19 +35,28 @@ def download_dryad_macaque(cfg: dict) -> None:
         return
     raw_dir = Path(cfg["paths"]["raw_wav"]) / "Monkey"
     raw_dir.mkdir(parents=True, exist_ok=True)
+    zip_dir = raw_dir.parent.parent / "downloads" if extract else raw_dir
+    zip_dir.mkdir(parents=True, exist_ok=True)
+    zip_path = zip_dir / "Fukushima2015.zip"
     url = "https://datadryad.org/downloads/file_stream/8943"  # Fukushima2015.zip
-    logger.info("Downloading Dryad macaque dataset (Fukushima2015.zip) ...")
-    r = requests.get(url, stream=True, timeout=60)
-    r.raise_for_status()
-    buf = io.BytesIO(r.content)
-    with zipfile.ZipFile(buf) as z:
-        for name in z.namelist():
-            if name.lower().endswith(".wav"):
-                out_path = raw_dir / Path(name).name
-                if out_path.exists():
-                    continue
-                out_path.write_bytes(z.read(name))
-                logger.info("Extracted %s", out_path.name)
+    if not zip_path.exists():
+        logger.info("Downloading Dryad macaque dataset (Fukushima2015.zip) ...")
+        r = requests.get(url, stream=True, timeout=60)
+        r.raise_for_status()
+        tmp = zip_path.with_suffix(".zip.part")
+        with open(tmp, "wb") as f:
+            for chunk in r.iter_content(chunk_size=1 << 20):
+                f.write(chunk)
+        tmp.replace(zip_path)
+    if extract:
+        with zipfile.ZipFile(zip_path) as z:
+            for name in z.namelist():
+                if name.lower().endswith(".wav"):
+                    out_path = raw_dir / Path(name).name
+                    if out_path.exists():
+                        continue
+                    out_path.write_bytes(z.read(name))
+                    logger.info("Extracted %s", out_path.name)
     logger.info("Dryad macaque data in %s", raw_dir)
 
 
@@ -112,13 +124,14 @@ def generate_synthetic_data(cfg: dict, n_monkey: int = 200, n_deer: int = 80) ->
 def main():
     parser = argparse.ArgumentParser(description="PROTO data collection")
     parser.add_argument("--dryad-macaque", action="store_true", help="Download Dryad macaque dataset")
+    parser.add_argument("--extract", action="store_true", help="Unpack the Dryad zip instead of reading it in place")
     parser.add_argument("--synthetic", action="store_true", help="Generate synthetic demo WAVs")
     parser.add_argument("--n-monkey", type=int, default=200, help="Synthetic monkey clips")
     parser.add_argument("--n-deer", type=int, default=80, help="Synthetic deer clips")
     args = parser.parse_args()
     cfg = load_config()
     if args.dryad_macaque:
-        download_dryad_macaque(cfg)
+        download_dryad_macaque(cfg, extract=args.extract)
     if args.synthetic:
         generate_synthetic_data(cfg, n_monkey=args.n_monkey, n_deer=args.n_deer)
     if not (args.dryad_macaque or args.synthetic):
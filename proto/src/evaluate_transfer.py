@@ -4,64 +4,73 @@ PROTO — Core evaluations:
   1) Cross-species functional clustering (silhouette by alarm vs non-alarm)
   2) Cross-species transfer test (train on Monkey alarm/non-alarm, test on Deer)
   3) Baseline: random encoder comparison
+  4) All-pairs transfer matrix over cfg["species"] (source × target accuracy, process pool)
+--stream runs 2) and 3) out of core (src/stream_eval.py).
 """
 import argparse
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from sklearn.linear_model import LogisticRegression
-from sklearn.metrics import silhouette_score, confusion_matrix, classification_report
-from sklearn.model_selection import train_test_split
-from sklearn.preprocessing import StandardScaler
 
 from .config_loader import load_config, get_path
+from .dedup_clips import kept_clips
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def function_labels(df, labels_df=None):
+    """(y_func, labeled_mask) for the rows of df (clip, species): alarm=1, non_alarm=0, -1 unlabeled."""
+    if labels_df is not None:
+        # labels_df: clip, species, label (alarm=1, non_alarm=0)
+        merge = df[["clip", "species"]].merge(
+            labels_df[["clip", "species", "label"]],
+            on=["clip", "species"],
+            how="left",
+        )
+        y_func = merge["label"].values
+        labeled_mask = pd.notna(y_func)
+        return np.where(labeled_mask, y_func.astype(int), -1), labeled_mask
+    # No labels: use synthetic naming convention (monkey_0000_clip000 = alarm if clip index even)
+    y_func = np.full(len(df), -1)
+    labeled_mask = np.zeros(len(df), dtype=bool)
+    for i, clip in enumerate(df["clip"]):
+        if "monkey_" in clip.lower() or "deer_" in clip.lower():
+            try:
+                parts = clip.replace(".wav", "").split("_")
+                idx = int(parts[1]) if len(parts) > 1 else 0
+                y_func[i] = 1 if idx % 2 == 0 else 0
+                labeled_mask[i] = True
+            except (ValueError, IndexError):
+                pass
+    return y_func, labeled_mask
+
+
 def load_embeddings_and_labels(cfg):
     emb_path = get_path(cfg, "embeddings_csv")
     labels_path = get_path(cfg, "labels_csv")
     if not emb_path.exists():
         raise FileNotFoundError(f"Run extract_features.py first: {emb_path}")
     df = pd.read_csv(emb_path)
+    keep = kept_clips(cfg)
+    if keep is not None:
+        df = df[[(s, c) in keep for s, c in zip(df["species"].astype(str), df["clip"])]].reset_index(drop=True)
     feat_cols = [c for c in df.columns if c.startswith("f")]
     X = df[feat_cols].values
     df["species"] = df["species"].astype(str)
 
-    if labels_path.exists():
-        labels_df = pd.read_csv(labels_path)
-        # labels_df: clip, species, label (alarm=1, non_alarm=0)
-        merge = df[["clip", "species"]].merge(
-            labels_df[["clip", "species", "label"]],
-            on=["clip", "species"],
-            how="left",
-        )
-        y_func = merge["label"].values
-        labeled_mask = pd.notna(y_func)
-        y_func = np.where(labeled_mask, y_func.astype(int), -1)
-    else:
-        # No labels: use synthetic naming convention (monkey_0000_clip000 = alarm if clip index even)
-        y_func = np.full(len(df), -1)
-        labeled_mask = np.zeros(len(df), dtype=bool)
-        for i, row in df.iterrows():
-            clip = row["clip"]
-            if "monkey_" in clip.lower() or "deer_" in clip.lower():
-                try:
-                    parts = clip.replace(".wav", "").split("_")
-                    idx = int(parts[1]) if len(parts) > 1 else 0
-                    y_func[i] = 1 if idx % 2 == 0 else 0
-                    labeled_mask[i] = True
-                except (ValueError, IndexError):
-                    pass
+    labels_df = pd.read_csv(labels_path) if labels_path.exists() else None
+    y_func, labeled_mask = function_labels(df, labels_df)
     return df, X, y_func, labeled_mask, feat_cols
 
 
 def eval1_silhouette_by_function(X, y_func, labeled_mask):
     """Silhouette score by FUNCTION (alarm vs non-alarm), only on labeled subset."""
+    from sklearn.metrics import silhouette_score
+
     if labeled_mask.sum() < 10:
         logger.warning("Too few labeled clips for silhouette by function")
         return None
@@ -74,21 +83,31 @@ def eval1_silhouette_by_function(X, y_func, labeled_mask):
     return score
 
 
-def eval2_transfer_test(df, X, y_func, labeled_mask, cfg):
-    """Train linear classifier on Monkey alarm vs non-alarm; test on Deer."""
+def transfer_pair(cfg, source=None, target=None):
+    """(source, target) species, defaulting to the first two in cfg["species"]."""
+    if (source is None or target is None) and len(cfg["species"]) < 2:
+        raise ValueError(f"The transfer test needs two species in config `species`, got {cfg['species']}")
+    return source or cfg["species"][0], target or cfg["species"][1]
+
+
+def eval2_transfer_test(df, X, y_func, labeled_mask, cfg, source=None, target=None):
+    """Train linear classifier on source alarm vs non-alarm (default Monkey); test on target (default Deer)."""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.metrics import confusion_matrix
+    from sklearn.preprocessing import StandardScaler
+
+    source, target = transfer_pair(cfg, source, target)
     species = df["species"].values
-    monkey_mask = species == "Monkey"
-    deer_mask = species == "Deer"
-    monkey_labeled = monkey_mask & labeled_mask
-    deer_labeled = deer_mask & labeled_mask
-    if monkey_labeled.sum() < 10 or deer_labeled.sum() < 5:
-        logger.warning("Insufficient labeled Monkey/Deer for transfer test")
+    source_labeled = (species == source) & labeled_mask
+    target_labeled = (species == target) & labeled_mask
+    if source_labeled.sum() < 10 or target_labeled.sum() < 5:
+        logger.warning("Insufficient labeled %s/%s for transfer test", source, target)
         return None, None
 
-    X_tr = X[monkey_labeled]
-    y_tr = y_func[monkey_labeled]
-    X_te = X[deer_labeled]
-    y_te = y_func[deer_labeled]
+    X_tr = X[source_labeled]
+    y_tr = y_func[source_labeled]
+    X_te = X[target_labeled]
+    y_te = y_func[target_labeled]
 
     scaler = StandardScaler()
     X_tr_s = scaler.fit_transform(X_tr)
@@ -98,26 +117,117 @@ def eval2_transfer_test(df, X, y_func, labeled_mask, cfg):
     acc = clf.score(X_te_s, y_te)
     y_pred = clf.predict(X_te_s)
     cm = confusion_matrix(y_te, y_pred)
-    logger.info("Eval2 — Transfer test (Monkey→Deer) accuracy: %.4f", acc)
-    logger.info("Confusion matrix (Deer):\n%s", cm)
+    logger.info("Eval2 — Transfer test (%s→%s) accuracy: %.4f", source, target, acc)
+    logger.info("Confusion matrix (%s):\n%s", target, cm)
     return acc, cm
 
 
+def _fit_source(X_src, y_src, seed, test_split):
+    """
+    Fit the scaler + probe for one source species once: on all labeled clips (used for every
+    other target) and on a train split (scored on the held-out split for the diagonal).
+    """
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import train_test_split
+    from sklearn.preprocessing import StandardScaler
+
+    if len(y_src) < 10 or len(np.unique(y_src)) < 2:
+        return None
+    scaler = StandardScaler().fit(X_src)
+    clf = LogisticRegression(max_iter=1000, random_state=seed).fit(scaler.transform(X_src), y_src)
+    self_acc = np.nan
+    try:
+        X_tr, X_te, y_tr, y_te = train_test_split(
+            X_src, y_src, test_size=test_split, random_state=seed, stratify=y_src
+        )
+        s_in = StandardScaler().fit(X_tr)
+        c_in = LogisticRegression(max_iter=1000, random_state=seed).fit(s_in.transform(X_tr), y_tr)
+        self_acc = c_in.score(s_in.transform(X_te), y_te)
+    except ValueError:
+        pass
+    return scaler, clf, self_acc
+
+
+def _score_pair(model, X_tgt, y_tgt):
+    scaler, clf, _ = model
+    return clf.score(scaler.transform(X_tgt), y_tgt)
+
+
+def transfer_matrix(df, X, y_func, labeled_mask, cfg, n_workers=None):
+    """
+    Source × target transfer accuracy for every species in cfg["species"].
+    Per-species models are fit once in a process pool (each worker gets only its source's rows)
+    and scored on every target in the parent: predict is cheap, so shipping fitted models and
+    target data back to the pool would cost more than it saves. Diagonal = held-out in-species accuracy.
+    """
+    species_list = [s for s in cfg["species"] if s in set(df["species"])]
+    species = df["species"].values
+    seed = cfg.get("seed", 42)
+    test_split = float(cfg.get("eval", {}).get("transfer_test_split", 0.2))
+    n_workers = n_workers or cfg.get("eval", {}).get("n_workers")
+    data = {}
+    for sp in species_list:
+        m = (species == sp) & labeled_mask
+        data[sp] = (X[m], y_func[m])
+
+    matrix = pd.DataFrame(np.nan, index=species_list, columns=species_list)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        fits = {sp: pool.submit(_fit_source, *data[sp], seed, test_split) for sp in species_list}
+        models = {sp: f.result() for sp, f in fits.items()}
+    for src in species_list:
+        if models[src] is None:
+            continue
+        matrix.loc[src, src] = models[src][2]
+        for tgt in species_list:
+            if tgt != src and len(data[tgt][1]) >= 5:
+                matrix.loc[src, tgt] = _score_pair(models[src], *data[tgt])
+    matrix.index.name = "source"
+    matrix.columns.name = "target"
+    logger.info("Transfer accuracy matrix (rows = source, cols = target):\n%s", matrix.round(4))
+    return matrix
+
+
+def save_matrix(matrix: pd.DataFrame, csv_path: Path, fig_path: Path, title: str, fmt=".2f") -> None:
+    """Write a species × species matrix as CSV plus a heatmap figure."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    csv_path.parent.mkdir(parents=True, exist_ok=True)
+    matrix.to_csv(csv_path)
+    fig_path.parent.mkdir(parents=True, exist_ok=True)
+    n = len(matrix)
+    plt.figure(figsize=(max(4, 0.5 * n + 2), max(3, 0.45 * n + 1.5)))
+    sns.heatmap(matrix.astype(float), annot=n <= 20, fmt=fmt, cmap="viridis", square=True)
+    plt.xlabel(matrix.columns.name or "target")
+    plt.ylabel(matrix.index.name or "source")
+    plt.title(title)
+    plt.tight_layout()
+    plt.savefig(fig_path, dpi=150)
+    plt.close()
+    logger.info("Saved %s and %s", csv_path, fig_path)
+
+
 def eval_baseline_random(df, X, y_func, labeled_mask, cfg):
     """Compare to random encoder: shuffle features and recompute transfer accuracy."""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.preprocessing import StandardScaler
+
     rng = np.random.default_rng(cfg.get("seed", 42))
     X_shuf = X.copy()
     for j in range(X_shuf.shape[1]):
         rng.shuffle(X_shuf[:, j])
+    source, target = transfer_pair(cfg)
     species = df["species"].values
-    monkey_labeled = (species == "Monkey") & labeled_mask
-    deer_labeled = (species == "Deer") & labeled_mask
-    if monkey_labeled.sum() < 10 or deer_labeled.sum() < 5:
+    source_labeled = (species == source) & labeled_mask
+    target_labeled = (species == target) & labeled_mask
+    if source_labeled.sum() < 10 or target_labeled.sum() < 5:
         return None
-    X_tr = X_shuf[monkey_labeled]
-    y_tr = y_func[monkey_labeled]
-    X_te = X_shuf[deer_labeled]
-    y_te = y_func[deer_labeled]
+    X_tr = X_shuf[source_labeled]
+    y_tr = y_func[source_labeled]
+    X_te = X_shuf[target_labeled]
+    y_te = y_func[target_labeled]
     scaler = StandardScaler()
     X_tr_s = scaler.fit_transform(X_tr)
     X_te_s = scaler.transform(X_te)
@@ -126,23 +236,44 @@ def eval_baseline_random(df, X, y_func, labeled_mask, cfg):
     return clf.score(X_te_s, y_te)
 
 
-def run(cfg):
+def run(cfg, n_workers=None):
     df, X, y_func, labeled_mask, _ = load_embeddings_and_labels(cfg)
     eval1_silhouette_by_function(X, y_func, labeled_mask)
     acc, cm = eval2_transfer_test(df, X, y_func, labeled_mask, cfg)
+    matrix = transfer_matrix(df, X, y_func, labeled_mask, cfg, n_workers=n_workers)
+    save_matrix(
+        matrix,
+        get_path(cfg, "outputs") / "transfer_matrix.csv",
+        get_path(cfg, "figures") / "transfer_matrix.png",
+        "Transfer accuracy (source → target)",
+    )
     baseline_acc = eval_baseline_random(df, X, y_func, labeled_mask, cfg)
     if baseline_acc is not None:
         logger.info("Baseline (shuffled features) transfer accuracy: %.4f", baseline_acc)
         if acc is not None:
             logger.info("SSL outperforms random: %s", acc > baseline_acc)
-    return {"transfer_accuracy": acc, "confusion_matrix": cm, "baseline_accuracy": baseline_acc}
+    return {
+        "transfer_accuracy": acc,
+        "confusion_matrix": cm,
+        "baseline_accuracy": baseline_acc,
+        "transfer_matrix": matrix,
+    }
 
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size for the transfer matrix")
+    parser.add_argument("--stream", action="store_true",
+                        help="Out-of-core transfer test + baseline (chunked reads, full-batch Newton probe over chunks); see src/stream_eval.py")
+    parser.add_argument("--check", action="store_true", help="With --stream: also run in memory and log differences")
     args = parser.parse_args()
     cfg = load_config()
-    run(cfg)
+    if args.stream or cfg.get("eval", {}).get("out_of_core", False):
+        from .stream_eval import run as run_stream
+
+        run_stream(cfg, check=args.check)
+    else:
+        run(cfg, n_workers=args.workers)
 
 
 if __name__ == "__main__":
@@ -1,40 +1,128 @@
 #!/usr/bin/env python3
 """
 PROTO — Extract 128-d embeddings for all clips using trained SSL encoder.
-Output: outputs/audio_embeddings.csv (clip, species, f0, ..., f127)
+Output: outputs/audio_embeddings.csv (clip, species, clip_sha1, model_hash, f0, ..., f127)
+Incremental: only clips that are new, changed (content hash) or embedded by a different
+model / mel config (model_hash) are recomputed; other rows are reused. --compact drops
+rows whose clip no longer exists.
 """
 import argparse
+import hashlib
+import json
 import logging
+import os
 import warnings
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import torch
 import soundfile as sf
-import librosa
 from tqdm import tqdm
 
 from .config_loader import load_config, get_path
-from .train_ssl import Encoder, log_mel
+from .mel import log_mel, mel_params
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def load_encoder(cfg, device):
+def load_encoder(cfg, device, model_file="ssl_model.pt"):
+    import torch
+
+    from .model import build_encoder
+
     out_dir = get_path(cfg, "models")
     with warnings.catch_warnings():
         warnings.simplefilter("ignore", FutureWarning)
-        ckpt = torch.load(out_dir / "ssl_model.pt", map_location=device, weights_only=False)
-    model = Encoder(n_mels=cfg["n_mels"], embed_dim=cfg["embed_dim"])
+        ckpt = torch.load(out_dir / model_file, map_location=device, weights_only=False)
+    # Checkpoints record the config they were trained with; older ones predate `encoder.arch`
+    arch = ckpt.get("config", {}).get("encoder", {}).get("arch", "cnn")
+    model = build_encoder(cfg, arch)
     model.load_state_dict(ckpt["encoder"])
     model.to(device)
     model.eval()
     return model
 
 
+def file_sha1(path: Path, chunk_size: int = 1 << 20) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def model_hash(cfg, model_file="ssl_model.pt") -> str:
+    """Short hash of the model checkpoint plus the mel front-end config that produced the embeddings."""
+    h = hashlib.sha1()
+    h.update(file_sha1(get_path(cfg, "models") / model_file).encode())
+    h.update(json.dumps(mel_params(cfg), sort_keys=True).encode())
+    return h.hexdigest()[:12]
+
+
+def load_store(out_path: Path) -> pd.DataFrame:
+    if not out_path.exists():
+        return pd.DataFrame()
+    df = pd.read_csv(out_path)
+    if "clip_sha1" not in df.columns or "model_hash" not in df.columns:
+        logger.info("%s has no version columns; re-embedding everything", out_path)
+        return pd.DataFrame()
+    return df
+
+
+def _write_store(df: pd.DataFrame, out_path: Path) -> None:
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, out_path)
+
+
+def store_index(store: pd.DataFrame) -> dict:
+    """(species, clip) -> (clip_sha1, model_hash, row position) for an embedding store."""
+    if store.empty:
+        return {}
+    return {
+        (sp, clip): (sha, mh, i)
+        for i, (sp, clip, sha, mh) in enumerate(
+            zip(store["species"].astype(str), store["clip"], store["clip_sha1"], store["model_hash"])
+        )
+    }
+
+
+def upsert(store: pd.DataFrame, new: pd.DataFrame, replaced, out_path: Path) -> pd.DataFrame:
+    """Drop store rows at positions `replaced`, add `new`; appends in place when nothing is replaced."""
+    if not store.empty and not replaced and list(new.columns) in ([], list(store.columns)):
+        # Only new clips: append without rewriting the store
+        if len(new):
+            new.to_csv(out_path, mode="a", header=False, index=False)
+        return pd.concat([store, new], ignore_index=True) if len(new) else store
+    keep = store.drop(index=list(replaced)) if not store.empty else store
+    df = pd.concat([keep, new], ignore_index=True)
+    _write_store(df, out_path)
+    return df
+
+
+def compact(cfg, df: pd.DataFrame = None) -> pd.DataFrame:
+    """Drop rows whose clip file no longer exists or whose species left the config."""
+    out_path = get_path(cfg, "embeddings_csv")
+    if df is None:
+        df = load_store(out_path)
+    if df.empty:
+        return df
+    clips_base = get_path(cfg, "clips_1s")
+    alive = [
+        sp in cfg["species"] and (clips_base / sp / clip).exists()
+        for sp, clip in zip(df["species"].astype(str), df["clip"])
+    ]
+    n_before = len(df)
+    df = df[alive].reset_index(drop=True)
+    _write_store(df, out_path)
+    logger.info("Compacted %s: dropped %d orphaned rows, %d remain", out_path, n_before - len(df), len(df))
+    return df
+
+
 def extract_embedding(model, wav_path: Path, sr: int, n_mels: int, device) -> np.ndarray:
+    import torch
+
     y, _ = sf.read(wav_path)
     if len(y.shape) > 1:
         y = y.mean(axis=1)
@@ -45,38 +133,71 @@ def extract_embedding(model, wav_path: Path, sr: int, n_mels: int, device) -> np
     return z.cpu().numpy().flatten()
 
 
-def run(cfg) -> None:
+def embedding_row(model, path: Path, species: str, sha: str, mhash: str, sr: int, n_mels: int, device) -> dict:
+    emb = extract_embedding(model, path, sr, n_mels, device)
+    row = {"clip": path.name, "species": species, "clip_sha1": sha, "model_hash": mhash}
+    for i, v in enumerate(emb):
+        row[f"f{i}"] = float(v)
+    return row
+
+
+def run(cfg, full: bool = False, do_compact: bool = False, model_file: str = "ssl_model.pt") -> None:
+    import torch
+
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = load_encoder(cfg, device)
+    model = load_encoder(cfg, device, model_file)
+    mhash = model_hash(cfg, model_file)
     clips_base = get_path(cfg, "clips_1s")
     sr, n_mels = cfg["sr"], cfg["n_mels"]
+    out_path = get_path(cfg, "embeddings_csv")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    store = pd.DataFrame() if full else load_store(out_path)
+    known = store_index(store)
+
     rows = []
+    replaced = set()
+    n_reused = n_dropped = 0
     for species in cfg["species"]:
         d = clips_base / species
         if not d.exists():
             continue
         for path in tqdm(sorted(d.glob("*.wav")), desc=species):
+            sha = file_sha1(path)
+            prev = known.get((species, path.name))
+            if prev is not None and prev[0] == sha and prev[1] == mhash:
+                n_reused += 1
+                continue
             try:
-                emb = extract_embedding(model, path, sr, n_mels, device)
+                row = embedding_row(model, path, species, sha, mhash, sr, n_mels, device)
             except Exception as e:
                 logger.warning("Skip %s: %s", path.name, e)
+                if prev is not None:
+                    # The old row came from another model or clip content: don't keep it under this model
+                    replaced.add(prev[2])
+                    n_dropped += 1
                 continue
-            row = {"clip": path.name, "species": species}
-            for i, v in enumerate(emb):
-                row[f"f{i}"] = float(v)
+            if prev is not None:
+                replaced.add(prev[2])
             rows.append(row)
-    df = pd.DataFrame(rows)
-    out_path = get_path(cfg, "embeddings_csv")
-    out_path.parent.mkdir(parents=True, exist_ok=True)
-    df.to_csv(out_path, index=False)
+    new = pd.DataFrame(rows)
+    logger.info("Model %s: %d clips embedded, %d reused", mhash, len(new), n_reused)
+    if n_dropped:
+        logger.warning("Dropped %d stale rows whose clips failed to re-embed", n_dropped)
+
+    df = upsert(store, new, replaced, out_path)
+    if do_compact:
+        df = compact(cfg, df)
     logger.info("Saved %d rows to %s", len(df), out_path)
 
 
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--full", action="store_true", help="Ignore the existing store and re-embed every clip")
+    parser.add_argument("--compact", action="store_true", help="Drop rows whose clip no longer exists")
+    parser.add_argument("--model", default="ssl_model.pt", help="Checkpoint in models/ (e.g. student_model.pt)")
     args = parser.parse_args()
     cfg = load_config()
-    run(cfg)
+    run(cfg, full=args.full, do_compact=args.compact, model_file=args.model)
 
 
 if __name__ == "__main__":
@@ -3,19 +3,18 @@
 PROTO — Generate all figures:
   UMAP by species, UMAP by alarm vs non-alarm, confusion matrix,
   similarity histogram (nearest vs random), optional spectrogram comparisons.
+With --spectrogram-grids: for each retrieval query, a row of log-mels (query + top-k
+cross-species neighbours), paginated into outputs/figures/spectrogram_grids/ by a process pool.
 """
 import argparse
+import json
 import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-import matplotlib
-matplotlib.use("Agg")
-import matplotlib.pyplot as plt
-import seaborn as sns
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler
 
 from .config_loader import load_config, get_path
 
@@ -60,12 +59,21 @@ def umap_embed(X, n_neighbors=15, min_dist=0.1):
         reducer = umap.UMAP(n_components=2, n_neighbors=n_neighbors, min_dist=min_dist, random_state=42)
         return reducer.fit_transform(X)
     except ImportError:
+        from sklearn.decomposition import PCA
+        from sklearn.preprocessing import StandardScaler
+
         logger.warning("umap-learn not installed; using PCA for 2D plot")
         pca = PCA(n_components=2, random_state=42)
         return pca.fit_transform(StandardScaler().fit_transform(X))
 
 
 def run(cfg):
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler
+
     fig_dir = get_path(cfg, "figures")
     fig_dir.mkdir(parents=True, exist_ok=True)
     df, X = load_embeddings_and_labels(cfg)
@@ -135,11 +143,209 @@ def run(cfg):
     logger.info("Figures saved to %s", fig_dir)
 
 
+def _grid_neighbors(cfg, df, X, k):
+    """
+    Top-k cross-species neighbour ids per clip: reuse exact_retrieval's arrays when they were
+    computed from the current embedding CSV (size and mtime) for the same clips.
+    """
+    from .knn import blocked_topk, normalize
+
+    species = df["species"].to_numpy(dtype=str)
+    retrieval_dir = get_path(cfg, "retrieval")
+    ids_path, index_path = retrieval_dir / "neighbor_ids.npy", retrieval_dir / "neighbors_index.csv"
+    meta_path = retrieval_dir / "neighbors_meta.json"
+    if ids_path.exists() and index_path.exists() and meta_path.exists():
+        meta = json.loads(meta_path.read_text())
+        emb_stat = get_path(cfg, "embeddings_csv").stat()
+        ids = np.load(ids_path, mmap_mode="r")
+        saved = pd.read_csv(index_path)
+        if (
+            meta.get("embeddings_size") == emb_stat.st_size
+            and meta.get("embeddings_mtime_ns") == emb_stat.st_mtime_ns
+            and ids.shape[1] >= k
+            and len(saved) == len(df)
+            and (saved["clip"].values == df["clip"].values).all()
+            and (saved["species"].to_numpy(dtype=str) == species).all()
+        ):
+            ids = np.asarray(ids[:, :k])
+            valid = ids >= 0
+            if not (species[np.where(valid, ids, 0)] == species[:, None])[valid].any():
+                logger.info("Reusing cross-species neighbours from %s", ids_path)
+                return ids
+    codes, _ = pd.factorize(species)
+    Xn = normalize(X)
+    ids, _ = blocked_topk(Xn, Xn, k, groups=codes, exclude_self=True, cross_group=True)
+    return ids
+
+
+def _grid_mels(cfg, clips):
+    """
+    Log-mels (float16) for (species, clip) pairs, in order. Taken from the distill mel cache
+    (outputs/distill) or outputs/figures/spectrogram_grids/mel_cache, computed once otherwise.
+    Cache entries are used only while the clip file's size and mtime match the recorded ones.
+    """
+    import soundfile as sf
+    from .mel import log_mel
+
+    clips_base = get_path(cfg, "clips_1s")
+    stamps = {}
+    for species, clip in dict.fromkeys(clips):
+        st = (clips_base / species / clip).stat()
+        stamps[(species, clip)] = (st.st_size, st.st_mtime_ns)
+    sources = [get_path(cfg, "outputs") / "distill", get_path(cfg, "figures") / "spectrogram_grids" / "mel_cache"]
+    found = {}
+    for d in sources:
+        if (d / "index.csv").exists() and (d / "mels.npy").exists():
+            idx = pd.read_csv(d / "index.csv")
+            mels = np.load(d / "mels.npy", mmap_mode="r")
+            if len(idx) == len(mels) and {"size", "mtime_ns"} <= set(idx.columns):
+                pos = {
+                    (sp, clip): (i, (size, mtime))
+                    for i, (sp, clip, size, mtime) in enumerate(
+                        zip(idx["species"].astype(str), idx["clip"], idx["size"], idx["mtime_ns"])
+                    )
+                }
+                found.update({
+                    key: (mels, pos[key][0])
+                    for key in stamps
+                    if key in pos and pos[key][1] == stamps[key] and key not in found
+                })
+    missing = [key for key in dict.fromkeys(clips) if key not in found]
+    if missing:
+        computed = []
+        for species, clip in missing:
+            y, _ = sf.read(clips_base / species / clip)
+            if len(y.shape) > 1:
+                y = y.mean(axis=1)
+            computed.append(log_mel(y.astype(np.float32), cfg["sr"], cfg["n_mels"]).astype(np.float16))
+        cache_dir = sources[1]
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        columns = ["species", "clip", "size", "mtime_ns"]
+        old_idx = pd.read_csv(cache_dir / "index.csv") if (cache_dir / "index.csv").exists() else None
+        if old_idx is not None and set(columns) <= set(old_idx.columns):
+            old = np.load(cache_dir / "mels.npy")
+            missing_set = set(missing)
+            keep = [i for i, key in enumerate(zip(old_idx["species"].astype(str), old_idx["clip"])) if key not in missing_set]
+            old_idx, old = old_idx.iloc[keep][columns], old[keep]
+        else:
+            old_idx, old = pd.DataFrame(columns=columns), np.empty((0,) + computed[0].shape, np.float16)
+        added = pd.DataFrame([key + stamps[key] for key in missing], columns=columns)
+        new_idx = pd.concat([old_idx, added], ignore_index=True)
+        new = np.concatenate([old, np.stack(computed)])
+        np.save(cache_dir / "mels.npy", new)
+        new_idx.to_csv(cache_dir / "index.csv", index=False)
+        found.update({key: (new, len(old) + i) for i, key in enumerate(missing)})
+        logger.info("Computed %d log-mels (cache: %s)", len(missing), cache_dir)
+    logger.info("Spectrograms: %d from cache, %d computed", len(set(clips)) - len(missing), len(missing))
+    return np.stack([np.asarray(found[key][0][found[key][1]]) for key in clips])
+
+
+def _render_grid_page(args):
+    """Worker: draw one page of query rows (query + neighbours) and save it."""
+    out_path, mels, titles, vmin, vmax = args
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    n_rows, n_cols = titles.shape
+    fig, axes = plt.subplots(n_rows, n_cols, figsize=(2.2 * n_cols, 1.6 * n_rows), squeeze=False)
+    for r in range(n_rows):
+        for c in range(n_cols):
+            ax = axes[r, c]
+            ax.set_xticks([])
+            ax.set_yticks([])
+            if titles[r, c]:
+                ax.imshow(mels[r, c].astype(np.float32), origin="lower", aspect="auto", cmap="magma",
+                          vmin=vmin, vmax=vmax)
+                ax.set_title(titles[r, c], fontsize=6)
+            else:
+                ax.axis("off")
+    axes[0, 0].set_ylabel("query", fontsize=7)
+    fig.tight_layout()
+    fig.savefig(out_path, dpi=100)
+    plt.close(fig)
+    return out_path
+
+
+def spectrogram_grids(cfg, k=None, n_queries=None, per_page=None, n_workers=None):
+    """
+    For each query (all clips, or n_queries evenly spaced), a row with its log-mel and those of
+    its top-k cross-species neighbours. Rows are paginated (per_page) and pages rendered in a
+    process pool. Writes page_*.png and grid_index.csv (query -> page, row, neighbours).
+    """
+    vcfg = cfg.get("visuals", {})
+    k = int(k or vcfg.get("grid_k", 4))
+    per_page = int(per_page or vcfg.get("grid_per_page", 8))
+    n_queries = n_queries if n_queries is not None else vcfg.get("grid_queries")
+    n_workers = n_workers or vcfg.get("n_workers") or os.cpu_count()
+
+    df, X = load_embeddings_and_labels(cfg)
+    k = min(k, len(df) - 1)
+    if k < 1:
+        logger.warning("Need at least 2 clips for spectrogram grids")
+        return None
+    ids = _grid_neighbors(cfg, df, X, k)
+    queries = np.arange(len(df))
+    if n_queries and n_queries < len(df):
+        queries = np.unique(np.linspace(0, len(df) - 1, int(n_queries)).round().astype(int))
+
+    rows = np.concatenate([queries[:, None], ids[queries]], axis=1)  # (n_queries, 1 + k), -1 = none
+    keys = list(zip(df["species"].astype(str), df["clip"]))
+    needed = sorted(set(rows[rows >= 0].tolist()))
+    mels = _grid_mels(cfg, [keys[i] for i in needed])
+    slot = {clip_id: n for n, clip_id in enumerate(needed)}
+    vmin, vmax = np.percentile(mels.astype(np.float32), [1, 99])
+
+    out_dir = get_path(cfg, "figures") / "spectrogram_grids"
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for old in out_dir.glob("page_*.png"):
+        old.unlink()
+    labels = df["label"].values
+    jobs, index_rows = [], []
+    for p, start in enumerate(range(0, len(rows), per_page)):
+        page = rows[start : start + per_page]
+        page_mels = np.zeros((len(page), k + 1) + mels.shape[1:], dtype=np.float16)
+        titles = np.full((len(page), k + 1), "", dtype=object)
+        for r, clip_ids in enumerate(page):
+            for c, clip_id in enumerate(clip_ids):
+                if clip_id < 0:
+                    continue
+                page_mels[r, c] = mels[slot[clip_id]]
+                label = labels[clip_id]
+                titles[r, c] = f"{keys[clip_id][0]} {keys[clip_id][1]}" + ("" if pd.isna(label) else f" [{int(label)}]")
+            index_rows.append({
+                "query": keys[clip_ids[0]][1],
+                "species": keys[clip_ids[0]][0],
+                "page": p,
+                "row": r,
+                "neighbors": ";".join(f"{keys[i][0]}/{keys[i][1]}" for i in clip_ids[1:] if i >= 0),
+            })
+        jobs.append((out_dir / f"page_{p:04d}.png", page_mels, titles, vmin, vmax))
+
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(jobs))) as pool:
+        for _ in pool.map(_render_grid_page, jobs):
+            pass
+    pd.DataFrame(index_rows).to_csv(out_dir / "grid_index.csv", index=False)
+    logger.info("Saved %d spectrogram pages (%d queries, top-%d cross-species) to %s",
+                len(jobs), len(rows), k, out_dir)
+    return out_dir
+
+
 def main():
     parser = argparse.ArgumentParser()
+    parser.add_argument("--spectrogram-grids", action="store_true",
+                        help="Also render query + top-k cross-species neighbour spectrogram pages")
+    parser.add_argument("--grids-only", action="store_true", help="Only render the spectrogram pages")
+    parser.add_argument("--k", type=int, default=None, help="Neighbours per query (default visuals.grid_k)")
+    parser.add_argument("--queries", type=int, default=None, help="Number of queries (default visuals.grid_queries)")
+    parser.add_argument("--per-page", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
     args = parser.parse_args()
     cfg = load_config()
-    run(cfg)
+    if not args.grids_only:
+        run(cfg)
+    if args.spectrogram_grids or args.grids_only:
+        spectrogram_grids(cfg, k=args.k, n_queries=args.queries, per_page=args.per_page, n_workers=args.workers)
 
 
 if __name__ == "__main__":
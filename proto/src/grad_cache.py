@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+PROTO — Memory-bounded contrastive training (gradient cache / chunked InfoNCE).
+1) embed both views in sub-batches without autograd;
+2) compute the symmetric InfoNCE over the full batch in blocks of logit rows, backpropagating
+   each block immediately into the cached embeddings (never holding B×B logits + graph);
+3) re-run each sub-batch with autograd and backpropagate the cached embedding gradients.
+Peak activation memory is set by the chunk size, not the batch size, so batches of 4096+ fit.
+The loss and gradients equal the naive path (exactly when BatchNorm uses running statistics;
+in train mode BatchNorm normalises per chunk instead of per batch).
+
+`python -m src grad_cache --bench` reports peak memory per batch size for naive vs chunked.
+"""
+import argparse
+import json
+import logging
+import subprocess
+import sys
+import time
+
+from .config_loader import load_config, get_path, PROJECT_ROOT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def _norm_types():
+    """Module types with running statistics: _NormBase (BatchNorm*, InstanceNorm*) where torch has it."""
+    import torch.nn as nn
+
+    base = getattr(nn.modules.batchnorm, "_NormBase", None)
+    return (base,) if base is not None else (nn.BatchNorm1d, nn.BatchNorm2d, nn.BatchNorm3d)
+
+
+def _save_bn(*modules):
+    types = _norm_types()
+    return [
+        (m, m.running_mean.clone(), m.running_var.clone(), m.num_batches_tracked.clone())
+        for mod in modules
+        for m in mod.modules()
+        if isinstance(m, types) and m.track_running_stats
+    ]
+
+
+def _restore_bn(state):
+    for m, mean, var, n in state:
+        m.running_mean.copy_(mean)
+        m.running_var.copy_(var)
+        m.num_batches_tracked.copy_(n)
+
+
+def blocked_info_nce_backward(z_a, z_b, temperature, block):
+    """
+    Symmetric InfoNCE (mean of a→b and b→a, as in train_ssl) over leaf tensors z_a, z_b,
+    computed `block` logit rows at a time; each block is backpropagated into z_a.grad / z_b.grad
+    right away. Returns the loss value.
+    """
+    import torch
+    import torch.nn.functional as F
+
+    batch = z_a.size(0)
+    total = 0.0
+    for q, k in ((z_a, z_b), (z_b, z_a)):
+        for start in range(0, batch, block):
+            qn = F.normalize(q[start : start + block], dim=1)
+            kn = F.normalize(k, dim=1)
+            logits = qn @ kn.t() / temperature
+            labels = torch.arange(start, start + qn.size(0), device=q.device)
+            loss = F.cross_entropy(logits, labels, reduction="sum") / (2 * batch)
+            loss.backward()
+            total += loss.item()
+    return total
+
+
+def grad_cache_step(model, proj, opt, x_a, x_b, device, temperature, chunk_size, logit_block=None):
+    """One optimizer step on (x_a, x_b) with activation memory bounded by chunk_size."""
+    import torch
+
+    logit_block = logit_block or chunk_size
+
+    def encode(x):
+        return proj(model(x.to(device, non_blocking=True)))
+
+    bn_state = _save_bn(model, proj)
+    with torch.no_grad():
+        z_a = torch.cat([encode(c) for c in x_a.split(chunk_size)])
+        z_b = torch.cat([encode(c) for c in x_b.split(chunk_size)])
+    _restore_bn(bn_state)  # running stats are updated once, by the autograd pass below
+    z_a.requires_grad_(True)
+    z_b.requires_grad_(True)
+    loss = blocked_info_nce_backward(z_a, z_b, temperature, logit_block)
+
+    opt.zero_grad()
+    for x, z in ((x_a, z_a), (x_b, z_b)):
+        for c, g in zip(x.split(chunk_size), z.grad.split(chunk_size)):
+            encode(c).backward(g)
+    opt.step()
+    return loss
+
+
+def naive_step(model, proj, opt, x_a, x_b, device, temperature):
+    """The original train_ssl step: full-batch forward, B×B logits, single backward."""
+    from .train_ssl import info_nce_loss
+
+    z_a = proj(model(x_a.to(device)))
+    z_b = proj(model(x_b.to(device)))
+    loss = (info_nce_loss(z_a, z_b, temperature) + info_nce_loss(z_b, z_a, temperature)) / 2
+    opt.zero_grad()
+    loss.backward()
+    opt.step()
+    return loss.item()
+
+
+def _build(cfg, seed=0):
+    import torch
+
+    from .model import ProjectionHead, build_encoder
+
+    torch.manual_seed(seed)
+    model = build_encoder(cfg)
+    proj = ProjectionHead(embed_dim=int(cfg["embed_dim"]), proj_dim=int(cfg.get("projection_dim", 64)))
+    return model, proj
+
+
+def check_equivalence(cfg, batch_size=96, chunk_size=32, logit_block=40, temperature=0.07):
+    """Max |loss| and |grad| difference between naive and chunked paths (BatchNorm in eval mode)."""
+    import torch
+
+    n_frames = int(cfg["clip_len_sec"] * cfg["sr"]) // 160 + 1
+    x_a = torch.randn(batch_size, 1, int(cfg["n_mels"]), n_frames)
+    x_b = x_a + 0.1 * torch.randn_like(x_a)
+    grads, losses = [], []
+    for mode in ("naive", "chunked"):
+        model, proj = _build(cfg)
+        model.eval()
+        proj.eval()
+        params = list(model.parameters()) + list(proj.parameters())
+        opt = torch.optim.SGD(params, lr=0.0)
+        if mode == "naive":
+            losses.append(naive_step(model, proj, opt, x_a, x_b, "cpu", temperature))
+        else:
+            losses.append(grad_cache_step(model, proj, opt, x_a, x_b, "cpu", temperature, chunk_size, logit_block))
+        grads.append(torch.cat([p.grad.flatten() for p in params]))
+    return abs(losses[0] - losses[1]), (grads[0] - grads[1]).abs().max().item()
+
+
+def _reset_peak_rss():
+    """Return current RSS (kB) and reset the kernel's peak-RSS counter where supported (Linux)."""
+    import resource  # Unix only; the benchmark is the only user
+
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _peak_rss():
+    import resource
+
+    try:
+        with open("/proc/self/status") as f:
+            return next(int(line.split()[1]) for line in f if line.startswith("VmHWM:"))
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _bench_case(mode, batch_size, chunk_size):
+    """Run in a fresh process: one training step; print peak extra RSS (MB) as JSON."""
+    import torch
+
+    cfg = load_config()
+    n_frames = int(cfg["clip_len_sec"] * cfg["sr"]) // 160 + 1
+    model, proj = _build(cfg)
+    opt = torch.optim.Adam(list(model.parameters()) + list(proj.parameters()), lr=1e-3)
+    x_a = torch.randn(batch_size, 1, int(cfg["n_mels"]), n_frames)
+    x_b = torch.randn(batch_size, 1, int(cfg["n_mels"]), n_frames)
+    base_kb = _reset_peak_rss()
+    t0 = time.perf_counter()
+    if mode == "naive":
+        loss = naive_step(model, proj, opt, x_a, x_b, "cpu", 0.07)
+    else:
+        loss = grad_cache_step(model, proj, opt, x_a, x_b, "cpu", 0.07, chunk_size)
+    step_s = time.perf_counter() - t0
+    peak_kb = _peak_rss()
+    print(json.dumps({"peak_mb": (peak_kb - base_kb) / 1024, "step_s": step_s, "loss": loss}))
+
+
+def bench(cfg, batch_sizes, chunk_size, naive_max=1024):
+    """Peak step memory per batch size; each case runs in its own process for a clean RSS peak."""
+    import pandas as pd
+
+    rows = []
+    for b in batch_sizes:
+        for mode in ("naive", "chunked"):
+            if mode == "naive" and b > naive_max:
+                continue
+            code = f"from src.grad_cache import _bench_case; _bench_case({mode!r}, {b}, {chunk_size})"
+            r = subprocess.run([sys.executable, "-c", code], cwd=PROJECT_ROOT, capture_output=True, text=True)
+            if r.returncode != 0:
+                # Typically killed by the OOM killer: exactly what chunking avoids
+                logger.warning("%s B=%d failed (exit %d): %s", mode, b, r.returncode, r.stderr.strip()[-200:])
+                res = {"peak_mb": float("nan"), "step_s": float("nan"), "loss": float("nan")}
+            else:
+                res = json.loads(r.stdout.strip().splitlines()[-1])
+            rows.append({
+                "mode": mode,
+                "batch_size": b,
+                "chunk_size": chunk_size if mode == "chunked" else b,
+                "status": "ok" if r.returncode == 0 else "failed",
+                **res,
+            })
+            logger.info("%s", rows[-1])
+    report = pd.DataFrame(rows)
+    logger.info("Peak extra memory per training step:\n%s", report.round(3).to_string(index=False))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bench", action="store_true", help="Peak memory per batch size, naive vs chunked")
+    parser.add_argument("--batch-sizes", type=int, nargs="*", default=[256, 1024, 4096])
+    parser.add_argument("--chunk-size", type=int, default=None)
+    parser.add_argument("--naive-max", type=int, default=1024, help="Skip naive runs above this batch size")
+    args = parser.parse_args()
+    cfg = load_config()
+    chunk = args.chunk_size or int(cfg.get("contrastive", {}).get("chunk_size") or 128)
+    loss_diff, grad_diff = check_equivalence(cfg)
+    logger.info("Naive vs chunked: |Δloss| %.2e, max |Δgrad| %.2e", loss_diff, grad_diff)
+    if args.bench:
+        report = bench(cfg, args.batch_sizes, chunk, args.naive_max)
+        out_path = get_path(cfg, "outputs") / "grad_cache_memory.csv"
+        report.to_csv(out_path, index=False)
+        logger.info("Saved %s", out_path)
+
+
+if __name__ == "__main__":
+    main()
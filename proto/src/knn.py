@@ -0,0 +1,109 @@
+"""
+PROTO — Exact blocked k-nearest-neighbour search over L2-normalised float32 embeddings.
+Queries are split into blocks handled by a thread pool (BLAS matmuls release the GIL);
+each query block streams over database blocks and keeps a running top-k with argpartition,
+so memory is O(query_block × db_block + n_queries × k) for any corpus size.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize(X: np.ndarray) -> np.ndarray:
+    X = np.asarray(X, dtype=np.float32)
+    return X / (np.linalg.norm(X, axis=1, keepdims=True) + 1e-10)
+
+
+def _topk_one_block(Q, X, q_start, k, db_block, groups, exclude_self, cross_group):
+    n_q = len(Q)
+    best_s = np.full((n_q, k), -np.inf, dtype=np.float32)
+    best_i = np.full((n_q, k), -1, dtype=np.int64)
+    q_ids = np.arange(q_start, q_start + n_q)
+    for d0 in range(0, len(X), db_block):
+        S = Q @ X[d0 : d0 + db_block].T
+        d_ids = np.arange(d0, d0 + S.shape[1])
+        if exclude_self:
+            S[q_ids[:, None] == d_ids[None, :]] = -np.inf
+        if cross_group:
+            S[groups[q_ids][:, None] == groups[d_ids][None, :]] = -np.inf
+        cand_s = np.concatenate([best_s, S], axis=1)
+        cand_i = np.concatenate([best_i, np.broadcast_to(d_ids, S.shape)], axis=1)
+        part = np.argpartition(-cand_s, k - 1, axis=1)[:, :k]
+        best_s = np.take_along_axis(cand_s, part, axis=1)
+        best_i = np.take_along_axis(cand_i, part, axis=1)
+    order = np.argsort(-best_s, axis=1, kind="stable")
+    best_s = np.take_along_axis(best_s, order, axis=1)
+    best_i = np.take_along_axis(best_i, order, axis=1)
+    best_i[~np.isfinite(best_s)] = -1
+    return best_i, best_s
+
+
+def blocked_topk(
+    Q,
+    X,
+    k,
+    query_block=1024,
+    db_block=8192,
+    n_threads=None,
+    groups=None,
+    exclude_self=False,
+    cross_group=False,
+    out_ids=None,
+    out_scores=None,
+    on_block=None,
+):
+    """
+    Top-k cosine neighbours of each row of Q among rows of X (both already normalised).
+    exclude_self: Q is X (same row order); a row never retrieves itself.
+    cross_group: only retrieve rows whose `groups` value differs from the query's.
+    out_ids / out_scores: optional preallocated (n_q, k) arrays (e.g. np.memmap) to fill.
+    on_block(q_start, ids, scores): optional callback per finished query block.
+    Returns (ids, scores); ids are -1 where fewer than k candidates exist.
+    """
+    n_q = len(Q)
+    if out_ids is None:
+        out_ids = np.empty((n_q, k), dtype=np.int64)
+    if out_scores is None:
+        out_scores = np.empty((n_q, k), dtype=np.float32)
+    if groups is not None:
+        groups = np.asarray(groups)
+
+    def work(q_start):
+        ids, scores = _topk_one_block(
+            Q[q_start : q_start + query_block], X, q_start, k, db_block, groups, exclude_self, cross_group
+        )
+        out_ids[q_start : q_start + len(ids)] = ids
+        out_scores[q_start : q_start + len(ids)] = scores
+        return q_start, ids, scores
+
+    with ThreadPoolExecutor(max_workers=n_threads) as pool:
+        for q_start, ids, scores in pool.map(work, range(0, n_q, query_block)):
+            if on_block is not None:
+                on_block(q_start, ids, scores)
+    return out_ids, out_scores
+
+
+def ranking_metrics(ids, query_labels, db_labels, n_relevant, k):
+    """
+    Per-query metrics for one block of neighbour ids (n, k):
+      hit@k             — 1 if any of the top k shares the query label
+      recall@k          — fraction of the query's n_relevant items found in the top k
+      ap@k              — average precision over the top k, normalised by min(k, n_relevant)
+      label_agreement@k — fraction of the top k sharing the query label
+    Queries with label < 0 or no relevant items get NaN.
+    """
+    valid = ids >= 0
+    rel = valid & (db_labels[np.where(valid, ids, 0)] == query_labels[:, None])
+    hits = np.cumsum(rel, axis=1)
+    precision_at = hits / np.arange(1, k + 1)
+    denom = np.minimum(n_relevant, k).astype(np.float64)
+    ok = (query_labels >= 0) & (denom > 0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ap = np.where(ok, (precision_at * rel).sum(axis=1) / denom, np.nan)
+        recall = np.where(ok, hits[:, -1] / n_relevant, np.nan)
+    hit = np.where(ok, rel.any(axis=1).astype(np.float64), np.nan)
+    agreement = np.where(ok, rel.mean(axis=1), np.nan)
+    return hit, recall, ap, agreement
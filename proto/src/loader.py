@@ -0,0 +1,100 @@
+"""
+PROTO — Parallel prefetching DataLoader for SSL training.
+Worker processes decode WAVs, augment and compute log-mels ahead of the training step.
+Each worker reseeds its dataset RNG from torch's per-worker seed so augmentations differ
+across workers yet stay reproducible for a given config seed. set_epoch reseeds the shuffle
+from (seed, epoch) and tells the dataset the epoch, so a resumed run replays the same batches.
+"""
+import logging
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, RandomSampler, get_worker_info
+
+logger = logging.getLogger(__name__)
+
+
+def seed_worker(worker_id: int) -> None:
+    """worker_init_fn: derive numpy / dataset RNGs from torch's seed for this worker."""
+    seed = torch.initial_seed() % 2**32
+    np.random.seed(seed)
+    info = get_worker_info()
+    if info is not None and hasattr(info.dataset, "rng"):
+        info.dataset.rng = np.random.default_rng(seed)
+
+
+def shm_collate(batch):
+    """Stack each field of a batch of tensor tuples directly into a shared-memory tensor."""
+    out = []
+    for field in zip(*batch):
+        first = field[0]
+        buf = torch.empty((len(field),) + tuple(first.shape), dtype=first.dtype).share_memory_()
+        out.append(torch.stack(field, out=buf))
+    return tuple(out)
+
+
+def build_loader(dataset, cfg, batch_size, shuffle=True, batch_sampler=None):
+    """DataLoader configured from cfg["loader"] (workers, persistence, prefetch, pinning, collate)."""
+    lcfg = cfg.get("loader", {})
+    num_workers = int(lcfg.get("num_workers", 0))
+    kwargs = {
+        "num_workers": num_workers,
+        "pin_memory": bool(lcfg.get("pin_memory", False)) and torch.cuda.is_available(),
+        "worker_init_fn": seed_worker,
+        "generator": torch.Generator().manual_seed(int(cfg.get("seed", 42))),
+    }
+    if lcfg.get("shared_memory", False):
+        kwargs["collate_fn"] = shm_collate
+    if num_workers > 0:
+        kwargs["persistent_workers"] = bool(lcfg.get("persistent_workers", True))
+        kwargs["prefetch_factor"] = int(lcfg.get("prefetch_factor", 2))
+    if batch_sampler is not None:
+        return DataLoader(dataset, batch_sampler=batch_sampler, **kwargs)
+    if shuffle:
+        # Own generator: the loader's also seeds workers, which would shift the shuffle on resume
+        sampler = RandomSampler(dataset, generator=torch.Generator().manual_seed(int(cfg.get("seed", 42))))
+        return DataLoader(dataset, batch_size=batch_size, sampler=sampler, **kwargs)
+    return DataLoader(dataset, batch_size=batch_size, shuffle=False, **kwargs)
+
+
+def set_epoch(loader, epoch: int, seed: int) -> None:
+    """Call before iterating epoch `epoch`: shuffle order and augmentations depend only on (seed, epoch)."""
+    if isinstance(loader.sampler, RandomSampler) and loader.sampler.generator is not None:
+        loader.sampler.generator.manual_seed(seed * 100003 + epoch)
+    for obj in (loader.batch_sampler, loader.dataset):
+        if hasattr(obj, "set_epoch"):
+            obj.set_epoch(epoch)
+
+
+class StepTimer:
+    """Accumulate per-step data-wait vs compute time over an epoch."""
+
+    def __init__(self, device=None):
+        self.sync = device is not None and device.type == "cuda"
+        self.data = 0.0
+        self.compute = 0.0
+        self.steps = 0
+        self._t = time.perf_counter()
+
+    def data_ready(self):
+        now = time.perf_counter()
+        self.data += now - self._t
+        self._t = now
+
+    def step_done(self):
+        if self.sync:
+            torch.cuda.synchronize()
+        now = time.perf_counter()
+        self.compute += now - self._t
+        self.steps += 1
+        self._t = now
+
+    def summary(self):
+        total = self.data + self.compute
+        return {
+            "steps": self.steps,
+            "data_sec": self.data,
+            "compute_sec": self.compute,
+            "data_frac": self.data / total if total > 0 else 0.0,
+        }
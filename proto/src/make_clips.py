@@ -1,18 +1,28 @@
 #!/usr/bin/env python3
 """
 PROTO — Preprocessing: raw WAV → mono 16kHz, 1s clips, silence filtering.
-Output: data/clips_1s/<Species>/*.wav
+Input: audio files and zip / tar archives of them in data/raw_wav/<Species>/ (members are
+decoded in place, see src/audio_source.py); `segmentation.n_workers` > 1 processes sources in parallel.
+Output: data/clips_1s/<Species>/*.wav, data/clip_index.csv (source offsets per clip)
+Segmentation modes (config `segmentation.mode`):
+  fixed  — tile non-overlapping clip_len_sec windows, drop quiet windows by RMS
+  events — frame-level energy + spectral-flux onset detection; one clip per event,
+           centred and padded/cropped to clip_len_sec
 Uses librosa when available; falls back to scipy.io.wavfile if librosa fails (e.g. libgfortran on Anaconda).
 """
 import argparse
+import hashlib
+import json
 import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
+import pandas as pd
 import soundfile as sf
-from scipy.io import wavfile
-from scipy.signal import resample
 
+from .audio_source import AudioSource, iter_directory, open_source
 from .config_loader import load_config, get_path
 
 logging.basicConfig(level=logging.INFO)
@@ -30,6 +40,9 @@ def _load_librosa(path: Path, sr: int):
 
 
 def _load_scipy(path: Path, sr: int) -> np.ndarray:
+    from scipy.io import wavfile
+    from scipy.signal import resample
+
     orig_sr, y = wavfile.read(path)
     if y.dtype in (np.int16, np.int32):
         y = y.astype(np.float32) / (np.iinfo(y.dtype).max + 1)
@@ -42,6 +55,7 @@ def _load_scipy(path: Path, sr: int) -> np.ndarray:
 
 
 def load_and_resample(path: Path, sr: int) -> np.ndarray:
+    """`path` may also be a seekable binary file object (e.g. an archive member)."""
     global _use_librosa
     if _use_librosa is None:
         try:
@@ -51,35 +65,258 @@ def load_and_resample(path: Path, sr: int) -> np.ndarray:
         except Exception:
             logger.info("Falling back to scipy for WAV load (librosa failed).")
             _use_librosa = False
+            if hasattr(path, "seek"):
+                path.seek(0)
     if _use_librosa:
         return _load_librosa(path, sr)
     return _load_scipy(path, sr)
 
 
+def _fixed_spans(n: int, clip_len: int):
+    return [(start, start + clip_len) for start in range(0, n - clip_len + 1, clip_len)]
+
+
+def _is_silent(seg: np.ndarray, silence_threshold_db: float, min_energy: float) -> bool:
+    rms = np.sqrt(np.mean(seg ** 2))
+    if rms < min_energy:
+        return True
+    db = 20 * np.log10(rms + 1e-10)
+    return db < silence_threshold_db
+
+
 def slice_clips(y: np.ndarray, sr: int, clip_len_sec: float, silence_threshold_db: float, min_energy: float):
     clip_len = int(clip_len_sec * sr)
-    step = clip_len
     clips = []
-    for start in range(0, len(y) - clip_len + 1, step):
-        seg = y[start : start + clip_len]
-        rms = np.sqrt(np.mean(seg ** 2))
-        if rms < min_energy:
-            continue
-        db = 20 * np.log10(rms + 1e-10)
-        if db < silence_threshold_db:
+    for start, end in _fixed_spans(len(y), clip_len):
+        seg = y[start:end]
+        if _is_silent(seg, silence_threshold_db, min_energy):
             continue
         clips.append(seg)
     return clips
 
 
-def run(cfg: dict, overwrite: bool = False) -> None:
-    sr = cfg["sr"]
-    clip_len_sec = cfg["clip_len_sec"]
+def frame_features(y: np.ndarray, n_fft: int = 512, hop: int = 160):
+    """Vectorized per-frame energy (dBFS) and half-wave rectified spectral flux."""
+    if len(y) < n_fft:
+        y = np.pad(y, (0, n_fft - len(y)))
+    frames = np.lib.stride_tricks.sliding_window_view(y, n_fft)[::hop]
+    rms = np.sqrt(np.mean(frames ** 2, axis=1))
+    db = 20 * np.log10(rms + 1e-10)
+    mag = np.abs(np.fft.rfft(frames * np.hanning(n_fft).astype(np.float32), axis=1))
+    flux = np.zeros(len(frames), dtype=np.float32)
+    flux[1:] = np.maximum(np.diff(mag, axis=0), 0).sum(axis=1)
+    return db, flux
+
+
+def detect_events(
+    y: np.ndarray,
+    sr: int,
+    silence_threshold_db: float,
+    n_fft: int = 512,
+    hop: int = 160,
+    flux_threshold: float = 3.0,
+    min_event_sec: float = 0.05,
+    merge_gap_sec: float = 0.15,
+):
+    """
+    Return [(start_sample, end_sample), ...] of acoustic events.
+    A frame is active when it is above the silence threshold or carries a spectral-flux onset
+    (flux > median + flux_threshold * MAD); runs closer than merge_gap_sec are merged.
+    """
+    db, flux = frame_features(y, n_fft, hop)
+    med = np.median(flux)
+    mad = np.median(np.abs(flux - med)) + 1e-10
+    active = (db >= silence_threshold_db) | (flux > med + flux_threshold * mad)
+    if not active.any():
+        return []
+    edges = np.diff(np.concatenate(([0], active.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    # Merge runs separated by short gaps
+    gap_frames = int(merge_gap_sec * sr / hop)
+    keep = np.concatenate(([True], starts[1:] - ends[:-1] > gap_frames))
+    starts = starts[keep]
+    ends = ends[np.concatenate((keep[1:], [True]))]
+    min_frames = max(1, int(min_event_sec * sr / hop))
+    long_enough = ends - starts >= min_frames
+    starts, ends = starts[long_enough], ends[long_enough]
+    return [(int(s * hop), int(min(e * hop + n_fft, len(y)))) for s, e in zip(starts, ends)]
+
+
+def event_windows(events, n: int, clip_len: int):
+    """
+    Fit events to clip_len windows: short events are centred (context from the source, zero-padded
+    only past the recording edges); long events are cropped into consecutive clip_len windows.
+    """
+    spans = []
+    for ev_start, ev_end in events:
+        length = ev_end - ev_start
+        if length <= clip_len:
+            start = ev_start + length // 2 - clip_len // 2
+            start = max(0, min(start, n - clip_len)) if n >= clip_len else 0
+            spans.append((start, start + clip_len, ev_start, ev_end))
+        else:
+            for start in range(ev_start, ev_end, clip_len):
+                spans.append((start, start + clip_len, ev_start, ev_end))
+    return spans
+
+
+def _crop_or_pad(y: np.ndarray, start: int, end: int) -> np.ndarray:
+    seg = y[max(start, 0) : end]
+    if len(seg) < end - start:
+        seg = np.pad(seg, (0, end - start - len(seg)))
+    return seg
+
+
+def segment(y: np.ndarray, sr: int, cfg: dict):
+    """
+    Segment a waveform according to cfg["segmentation"]["mode"].
+    Returns a list of (clip, start_sample, event_start_sample, event_end_sample).
+    """
+    clip_len = int(cfg["clip_len_sec"] * sr)
     silence_threshold_db = cfg.get("silence_threshold_db", -40)
     min_energy = cfg.get("min_clip_energy", 1e-3)
+    seg_cfg = cfg.get("segmentation", {})
+    mode = seg_cfg.get("mode", "fixed")
+    if mode == "fixed":
+        spans = [(s, e, s, e) for s, e in _fixed_spans(len(y), clip_len)]
+    elif mode == "events":
+        events = detect_events(
+            y,
+            sr,
+            silence_threshold_db,
+            n_fft=int(seg_cfg.get("n_fft", 512)),
+            hop=int(seg_cfg.get("hop", 160)),
+            flux_threshold=float(seg_cfg.get("flux_threshold", 3.0)),
+            min_event_sec=float(seg_cfg.get("min_event_sec", 0.05)),
+            merge_gap_sec=float(seg_cfg.get("merge_gap_sec", 0.15)),
+        )
+        spans = event_windows(events, len(y), clip_len)
+    else:
+        raise ValueError(f"Unknown segmentation mode: {mode}")
+    out = []
+    for start, end, ev_start, ev_end in spans:
+        seg = _crop_or_pad(y, start, end)
+        if _is_silent(seg, silence_threshold_db, min_energy):
+            continue
+        out.append((seg, start, ev_start, ev_end))
+    return out
+
+
+def segmentation_params(cfg: dict) -> str:
+    """Short hash of every setting that decides clip boundaries; stored per row in clip_index.csv."""
+    seg_cfg = cfg.get("segmentation", {})
+    params = {k: cfg.get(k) for k in ("sr", "clip_len_sec", "silence_threshold_db", "min_clip_energy")}
+    params["mode"] = seg_cfg.get("mode", "fixed")
+    if params["mode"] == "events":
+        params.update({k: seg_cfg.get(k) for k in ("n_fft", "hop", "flux_threshold", "min_event_sec", "merge_gap_sec")})
+    return hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def process_file(source, species: str, cfg: dict, out_dir: Path, overwrite: bool = False, payload: bytes = None):
+    """
+    Segment one raw recording (a path or an AudioSource; `payload` = member bytes already read
+    from a compressed tar stream) into out_dir; returns (clip index rows, n clips written).
+    """
+    if not isinstance(source, AudioSource):
+        source = AudioSource(Path(source))
+    sr = cfg["sr"]
+    mode = cfg.get("segmentation", {}).get("mode", "fixed")
+    params = segmentation_params(cfg)
+    with open_source(source, payload) as f:
+        y = load_and_resample(f, sr)
+    rows, written = [], 0
+    for i, (seg, start, ev_start, ev_end) in enumerate(segment(y, sr, cfg)):
+        out_name = f"{source.clip_stem}_clip{i:03d}.wav"
+        out_path = out_dir / out_name
+        rows.append({
+            "clip": out_name,
+            "species": species,
+            "source": str(source),
+            "mode": mode,
+            "seg_params": params,
+            "start_sec": start / sr,
+            "end_sec": (start + len(seg)) / sr,
+            "event_start_sec": ev_start / sr,
+            "event_end_sec": ev_end / sr,
+        })
+        if out_path.exists() and not overwrite:
+            continue
+        sf.write(str(out_path), seg, sr, subtype="PCM_16")
+        written += 1
+    return rows, written
+
+
+def _safe_process(source, species, cfg, out_dir, overwrite, payload):
+    if isinstance(payload, Exception):  # the member could not be read from its archive
+        return payload
+    try:
+        return process_file(source, species, cfg, out_dir, overwrite, payload)
+    except Exception as e:
+        return e
+
+
+def process_sources(payloads, species: str, cfg: dict, out_dir: Path, overwrite: bool = False, n_workers: int = 1):
+    """
+    Yield (source, (rows, written) or the exception raised) in input order, for (source, payload)
+    pairs from iter_directory / iter_payloads (a payload may be the exception reading it).
+    With n_workers > 1, sources are segmented in a process pool with a bounded number in flight
+    (streamed tar members hold their bytes until a worker takes them).
+    """
+    if n_workers <= 1:
+        for src, payload in payloads:
+            yield src, _safe_process(src, species, cfg, out_dir, overwrite, payload)
+        return
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        pending = deque()
+        for src, payload in payloads:
+            pending.append((src, pool.submit(_safe_process, src, species, cfg, out_dir, overwrite, payload)))
+            if len(pending) >= 4 * n_workers:
+                src0, fut = pending.popleft()
+                yield src0, fut.result()
+        while pending:
+            src0, fut = pending.popleft()
+            yield src0, fut.result()
+
+
+def _previous_index(cfg: dict):
+    index_path = get_path(cfg, "clip_index")
+    if not index_path.exists():
+        return None
+    old = pd.read_csv(index_path, dtype={"seg_params": str})  # hex hashes like '5517e9...' parse as floats
+    return old if len(old) else None
+
+
+def remove_stale_clips(cfg: dict, old_index, new_rows, done_sources) -> int:
+    """Delete clips of the previous index that this run no longer produces (only for sources it processed)."""
+    if old_index is None:
+        return 0
+    keep = {(r["species"], r["clip"]) for r in new_rows}
+    clips_base = get_path(cfg, "clips_1s")
+    removed = 0
+    for species, clip, source in zip(old_index["species"].astype(str), old_index["clip"], old_index["source"]):
+        if (species, source) in done_sources and (species, clip) not in keep:
+            (clips_base / species / clip).unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def run(cfg: dict, overwrite: bool = False, n_workers: int = None) -> None:
+    mode = cfg.get("segmentation", {}).get("mode", "fixed")
+    n_workers = int(n_workers or cfg.get("segmentation", {}).get("n_workers") or 1)
     raw_base = get_path(cfg, "raw_wav")
     clips_base = get_path(cfg, "clips_1s")
 
+    old_index = _previous_index(cfg)
+    params = segmentation_params(cfg)
+    if not overwrite and old_index is not None and (
+        "seg_params" not in old_index or (old_index["seg_params"] != params).any()
+    ):
+        # Existing clips were cut with other settings: keeping them would mismatch the new offsets
+        logger.warning("Segmentation settings changed since the last run; regenerating all clips")
+        overwrite = True
+
+    index_rows, done_sources = [], set()
     for species in cfg["species"]:
         raw_dir = raw_base / species
         out_dir = clips_base / species
@@ -87,31 +324,85 @@ def run(cfg: dict, overwrite: bool = False) -> None:
             logger.warning("Skipping %s: %s not found", species, raw_dir)
             continue
         out_dir.mkdir(parents=True, exist_ok=True)
-        wavs = list(raw_dir.glob("*.wav")) + list(raw_dir.glob("*.WAV"))
         total = 0
-        for path in wavs:
+        for src, result in process_sources(iter_directory(raw_dir), species, cfg, out_dir, overwrite, n_workers):
+            if isinstance(result, Exception):
+                logger.warning("Failed %s: %s", src, result)
+                continue
+            rows, written = result
+            index_rows.extend(rows)
+            done_sources.add((species, str(src)))
+            total += written
+        logger.info("%s: %d clips in %s", species, total, out_dir)
+
+    removed = remove_stale_clips(cfg, old_index, index_rows, done_sources)
+    if removed:
+        logger.info("Removed %d clips no longer produced by the current segmentation", removed)
+
+    index_path = get_path(cfg, "clip_index")
+    index_path.parent.mkdir(parents=True, exist_ok=True)
+    pd.DataFrame(index_rows).to_csv(index_path, index=False)
+    logger.info("Clip index (%s mode, %d clips) -> %s", mode, len(index_rows), index_path)
+
+
+def compare_modes(cfg: dict) -> pd.DataFrame:
+    """Count clips per species under fixed vs events segmentation (no clips written)."""
+    sr = cfg["sr"]
+    raw_base = get_path(cfg, "raw_wav")
+    seg_cfg = dict(cfg.get("segmentation", {}))
+    cfg_fixed = {**cfg, "segmentation": {**seg_cfg, "mode": "fixed"}}
+    cfg_events = {**cfg, "segmentation": {**seg_cfg, "mode": "events"}}
+    rows = []
+    for species in cfg["species"]:
+        raw_dir = raw_base / species
+        if not raw_dir.exists():
+            continue
+        n_files, audio_sec, n_fixed, n_events = 0, 0.0, 0, 0
+        for src, payload in iter_directory(raw_dir):
+            if isinstance(payload, Exception):
+                logger.warning("Failed %s: %s", src, payload)
+                continue
             try:
-                y = load_and_resample(path, sr)
+                with open_source(src, payload) as f:
+                    y = load_and_resample(f, sr)
             except Exception as e:
-                logger.warning("Failed %s: %s", path.name, e)
+                logger.warning("Failed %s: %s", src, e)
                 continue
-            clips = slice_clips(y, sr, clip_len_sec, silence_threshold_db, min_energy)
-            for i, seg in enumerate(clips):
-                out_name = f"{path.stem}_clip{i:03d}.wav"
-                out_path = out_dir / out_name
-                if out_path.exists() and not overwrite:
-                    continue
-                sf.write(str(out_path), seg, sr, subtype="PCM_16")
-                total += 1
-        logger.info("%s: %d clips in %s", species, total, out_dir)
+            n_files += 1
+            audio_sec += len(y) / sr
+            n_fixed += len(segment(y, sr, cfg_fixed))
+            n_events += len(segment(y, sr, cfg_events))
+        rows.append({
+            "species": species,
+            "n_files": n_files,
+            "audio_sec": round(audio_sec, 2),
+            "fixed_clips": n_fixed,
+            "event_clips": n_events,
+            "event_to_fixed_ratio": n_events / n_fixed if n_fixed else float("nan"),
+        })
+    report = pd.DataFrame(rows)
+    out_path = get_path(cfg, "outputs") / "segmentation_report.csv"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    report.to_csv(out_path, index=False)
+    logger.info("Segmentation comparison:\n%s", report.to_string(index=False))
+    logger.info("Saved %s", out_path)
+    return report
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--overwrite", action="store_true")
+    parser.add_argument("--mode", choices=["fixed", "events"], default=None, help="Override segmentation.mode")
+    parser.add_argument("--compare", action="store_true", help="Report clip counts for fixed vs events; write nothing else")
+    parser.add_argument("--workers", type=int, default=None, help="Parallel source workers (default segmentation.n_workers)")
     args = parser.parse_args()
     cfg = load_config()
-    run(cfg, overwrite=args.overwrite)
+    if args.mode:
+        cfg.setdefault("segmentation", {})["mode"] = args.mode
+    if args.compare:
+        compare_modes(cfg)
+        return
+    run(cfg, overwrite=args.overwrite, n_workers=args.workers)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,17 @@
+"""Log-mel front end shared by training, extraction and fingerprinting (librosa imported on first use)."""
+import numpy as np
+
+N_FFT = 512
+HOP = 160
+
+
+def mel_params(cfg) -> dict:
+    """Front-end settings every log_mel caller uses (for versioning embeddings and caches)."""
+    return {"sr": cfg["sr"], "n_mels": cfg["n_mels"], "n_fft": N_FFT, "hop": HOP}
+
+
+def log_mel(signal: np.ndarray, sr: int, n_mels: int = 80, n_fft: int = N_FFT, hop: int = HOP) -> np.ndarray:
+    import librosa
+
+    S = librosa.feature.melspectrogram(y=signal, sr=sr, n_mels=n_mels, n_fft=n_fft, hop_length=hop)
+    return librosa.power_to_db(S + 1e-8, ref=np.max).astype(np.float32)
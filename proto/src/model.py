@@ -0,0 +1,176 @@
+"""
+PROTO — SSL encoders and projection head (torch only; no audio or data dependencies).
+All encoders map (B, 1, n_mels, T) -> (B, embed_dim); select one with `encoder.arch` in config.yaml:
+  cnn      — 3-layer Conv2d stack (default, original)
+  dsconv   — depthwise-separable Conv2d blocks
+  strided  — strided-frequency Conv2d (shrinks the mel axis early)
+  tcn      — 1-D dilated temporal convs over mel frames (mel bins as channels)
+  tiny     — narrow strided CNN used as the distillation student (src/distill.py)
+"""
+import torch.nn as nn
+
+
+class Encoder(nn.Module):
+    """Small CNN: (1, n_mels, T) -> 128-d."""
+
+    def __init__(self, n_mels=80, embed_dim=128):
+        super().__init__()
+        self.conv = nn.Sequential(
+            nn.Conv2d(1, 32, 3, padding=1),
+            nn.BatchNorm2d(32),
+            nn.ReLU(),
+            nn.MaxPool2d(2),
+            nn.Conv2d(32, 64, 3, padding=1),
+            nn.BatchNorm2d(64),
+            nn.ReLU(),
+            nn.MaxPool2d(2),
+            nn.Conv2d(64, 128, 3, padding=1),
+            nn.BatchNorm2d(128),
+            nn.ReLU(),
+            nn.AdaptiveAvgPool2d(1),
+        )
+        self.fc = nn.Linear(128, embed_dim)
+
+    def forward(self, x):
+        h = self.conv(x)
+        h = h.view(h.size(0), -1)
+        return self.fc(h)
+
+
+def _ds_block(c_in, c_out):
+    return nn.Sequential(
+        nn.Conv2d(c_in, c_in, 3, padding=1, groups=c_in, bias=False),
+        nn.Conv2d(c_in, c_out, 1, bias=False),
+        nn.BatchNorm2d(c_out),
+        nn.ReLU(),
+    )
+
+
+class DSConvEncoder(nn.Module):
+    """Depthwise-separable CNN: (1, n_mels, T) -> embed_dim."""
+
+    def __init__(self, n_mels=80, embed_dim=128):
+        super().__init__()
+        self.conv = nn.Sequential(
+            nn.Conv2d(1, 32, 3, padding=1, bias=False),
+            nn.BatchNorm2d(32),
+            nn.ReLU(),
+            nn.MaxPool2d(2),
+            _ds_block(32, 64),
+            nn.MaxPool2d(2),
+            _ds_block(64, 128),
+            nn.AdaptiveAvgPool2d(1),
+        )
+        self.fc = nn.Linear(128, embed_dim)
+
+    def forward(self, x):
+        h = self.conv(x)
+        h = h.view(h.size(0), -1)
+        return self.fc(h)
+
+
+class StridedFreqEncoder(nn.Module):
+    """CNN with a stride-4 frequency stem so later layers see a 4x smaller mel axis."""
+
+    def __init__(self, n_mels=80, embed_dim=128):
+        super().__init__()
+        self.conv = nn.Sequential(
+            nn.Conv2d(1, 32, (5, 3), stride=(4, 1), padding=(2, 1)),
+            nn.BatchNorm2d(32),
+            nn.ReLU(),
+            nn.Conv2d(32, 64, 3, stride=2, padding=1),
+            nn.BatchNorm2d(64),
+            nn.ReLU(),
+            nn.Conv2d(64, 128, 3, stride=2, padding=1),
+            nn.BatchNorm2d(128),
+            nn.ReLU(),
+            nn.AdaptiveAvgPool2d(1),
+        )
+        self.fc = nn.Linear(128, embed_dim)
+
+    def forward(self, x):
+        h = self.conv(x)
+        h = h.view(h.size(0), -1)
+        return self.fc(h)
+
+
+class TemporalConvEncoder(nn.Module):
+    """1-D dilated convs over time with mel bins as channels: (1, n_mels, T) -> embed_dim."""
+
+    def __init__(self, n_mels=80, embed_dim=128, channels=128):
+        super().__init__()
+        self.conv = nn.Sequential(
+            nn.Conv1d(n_mels, channels, 5, padding=2),
+            nn.BatchNorm1d(channels),
+            nn.ReLU(),
+            nn.Conv1d(channels, channels, 3, padding=2, dilation=2),
+            nn.BatchNorm1d(channels),
+            nn.ReLU(),
+            nn.Conv1d(channels, channels, 3, padding=4, dilation=4),
+            nn.BatchNorm1d(channels),
+            nn.ReLU(),
+        )
+        self.fc = nn.Linear(channels, embed_dim)
+
+    def forward(self, x):
+        h = self.conv(x.squeeze(1))
+        return self.fc(h.mean(dim=2))
+
+
+class TinyEncoder(nn.Module):
+    """Narrow strided CNN (~10x fewer FLOPs than cnn); trained by distillation, not SSL."""
+
+    def __init__(self, n_mels=80, embed_dim=128):
+        super().__init__()
+        self.conv = nn.Sequential(
+            nn.Conv2d(1, 16, (5, 3), stride=(4, 2), padding=(2, 1)),
+            nn.BatchNorm2d(16),
+            nn.ReLU(),
+            nn.Conv2d(16, 32, 3, stride=2, padding=1),
+            nn.BatchNorm2d(32),
+            nn.ReLU(),
+            nn.Conv2d(32, 64, 3, stride=2, padding=1),
+            nn.BatchNorm2d(64),
+            nn.ReLU(),
+            nn.AdaptiveAvgPool2d(1),
+        )
+        self.fc = nn.Linear(64, embed_dim)
+
+    def forward(self, x):
+        h = self.conv(x)
+        h = h.view(h.size(0), -1)
+        return self.fc(h)
+
+
+ENCODERS = {
+    "cnn": Encoder,
+    "dsconv": DSConvEncoder,
+    "strided": StridedFreqEncoder,
+    "tcn": TemporalConvEncoder,
+    "tiny": TinyEncoder,
+}
+
+
+def encoder_arch(cfg) -> str:
+    return cfg.get("encoder", {}).get("arch", "cnn")
+
+
+def build_encoder(cfg, arch=None) -> nn.Module:
+    """Instantiate the encoder named by `arch` (default: cfg["encoder"]["arch"])."""
+    arch = arch or encoder_arch(cfg)
+    if arch not in ENCODERS:
+        raise ValueError(f"Unknown encoder arch {arch!r}; choose from {sorted(ENCODERS)}")
+    return ENCODERS[arch](n_mels=int(cfg["n_mels"]), embed_dim=int(cfg["embed_dim"]))
+
+
+class ProjectionHead(nn.Module):
+    def __init__(self, embed_dim=128, proj_dim=64):
+        super().__init__()
+        self.mlp = nn.Sequential(
+            nn.Linear(embed_dim, embed_dim),
+            nn.ReLU(),
+            nn.Linear(embed_dim, proj_dim),
+        )
+
+    def forward(self, z):
+        return self.mlp(z)
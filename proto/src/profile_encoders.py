@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+PROTO — Profile encoder variants for CPU inference cost vs accuracy.
+For each arch in src/model.py: parameters, FLOPs per 1 s clip, single-clip latency and batch
+throughput. With --train-epochs N each variant is also trained (in outputs/encoder_profile/<arch>/),
+embedded and scored with evaluate_transfer's Monkey→Deer transfer test.
+Output: outputs/encoder_profile.csv
+"""
+import argparse
+import copy
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from .config_loader import load_config, get_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def count_flops(model, x) -> int:
+    """FLOPs (2 × multiply-accumulates) of conv and linear layers for one forward pass of x."""
+    import torch
+    import torch.nn as nn
+
+    macs = []
+
+    def conv_hook(m, inp, out):
+        k = int(np.prod(m.kernel_size)) * (m.in_channels // m.groups)
+        macs.append(out.numel() * k)
+
+    def linear_hook(m, inp, out):
+        macs.append(out.numel() * m.in_features)
+
+    handles = []
+    for m in model.modules():
+        if isinstance(m, (nn.Conv1d, nn.Conv2d)):
+            handles.append(m.register_forward_hook(conv_hook))
+        elif isinstance(m, nn.Linear):
+            handles.append(m.register_forward_hook(linear_hook))
+    with torch.no_grad():
+        model(x)
+    for h in handles:
+        h.remove()
+    return 2 * int(sum(macs)) // x.size(0)
+
+
+def measure_latency(model, x, n_warmup=5, n_runs=50):
+    """Median wall time (s) of model(x)."""
+    import torch
+
+    times = []
+    with torch.no_grad():
+        for _ in range(n_warmup):
+            model(x)
+        for _ in range(n_runs):
+            t0 = time.perf_counter()
+            model(x)
+            times.append(time.perf_counter() - t0)
+    return float(np.median(times))
+
+
+def transfer_accuracy(cfg, arch, epochs):
+    """Train `arch` briefly in its own directory, embed all clips and run the transfer test."""
+    from . import evaluate_transfer, extract_features, train_ssl
+
+    vcfg = copy.deepcopy(cfg)
+    vcfg.setdefault("encoder", {})["arch"] = arch
+    out_dir = get_path(cfg, "outputs") / "encoder_profile" / arch
+    vcfg["paths"]["models"] = out_dir
+    vcfg["paths"]["embeddings_csv"] = out_dir / "audio_embeddings.csv"
+    train_ssl.train(vcfg, epochs=epochs)
+    extract_features.run(vcfg, full=True)
+    df, X, y_func, labeled_mask, _ = evaluate_transfer.load_embeddings_and_labels(vcfg)
+    acc, _ = evaluate_transfer.eval2_transfer_test(df, X, y_func, labeled_mask, vcfg)
+    return acc
+
+
+def run(cfg, archs=None, batch_size=64, n_threads=None, train_epochs=0):
+    import torch
+
+    from .model import ENCODERS, build_encoder
+
+    if n_threads:
+        torch.set_num_threads(n_threads)
+    n_frames = int(cfg["clip_len_sec"] * cfg["sr"]) // 160 + 1  # log_mel hop = 160
+    x1 = torch.randn(1, 1, int(cfg["n_mels"]), n_frames)
+    xb = torch.randn(batch_size, 1, int(cfg["n_mels"]), n_frames)
+    rows = []
+    for arch in archs or list(ENCODERS):
+        model = build_encoder(cfg, arch).eval()
+        latency = measure_latency(model, x1)
+        batch_time = measure_latency(model, xb, n_warmup=2, n_runs=10)
+        row = {
+            "arch": arch,
+            "params": sum(p.numel() for p in model.parameters()),
+            "mflops_per_clip": count_flops(model, x1) / 1e6,
+            "latency_ms": latency * 1e3,
+            "throughput_clips_per_s": batch_size / batch_time,
+        }
+        if train_epochs > 0:
+            row["transfer_accuracy"] = transfer_accuracy(cfg, arch, train_epochs)
+        rows.append(row)
+        logger.info("%s", row)
+    report = pd.DataFrame(rows)
+    out_path = get_path(cfg, "outputs") / "encoder_profile.csv"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    report.to_csv(out_path, index=False)
+    logger.info("Encoder profile (%d threads, batch %d):\n%s", torch.get_num_threads(), batch_size,
+                report.round(3).to_string(index=False))
+    logger.info("Saved %s", out_path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--arch", nargs="*", default=None, help="Encoder archs (default: all in src/model.py ENCODERS)")
+    parser.add_argument("--batch-size", type=int, default=64, help="Batch size for throughput")
+    parser.add_argument("--threads", type=int, default=None, help="torch CPU threads (e.g. 1 for edge recorders)")
+    parser.add_argument("--train-epochs", type=int, default=0, help="Also train each variant and report transfer accuracy")
+    args = parser.parse_args()
+    cfg = load_config()
+    run(cfg, archs=args.arch, batch_size=args.batch_size, n_threads=args.threads, train_epochs=args.train_epochs)
+
+
+if __name__ == "__main__":
+    main()
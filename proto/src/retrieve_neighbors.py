@@ -3,31 +3,71 @@
 PROTO — Evaluation 3: Cross-species retrieval.
 For each Deer alarm clip, retrieve nearest Monkey clips in embedding space.
 Report cosine similarity: nearest vs random.
+Also: query × target retrieval matrix (nearest − random cosine) over all cfg["species"] pairs,
+and exact full-corpus retrieval (hit@k, recall@k, mAP@k, label-agreement@k over every labeled query)
+with per-query neighbour ids / scores saved as .npy.
 """
 import argparse
+import json
 import logging
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from sklearn.metrics.pairwise import cosine_similarity
 
 from .config_loader import load_config, get_path
+from .dedup_clips import kept_clips
+from .evaluate_transfer import save_matrix
+from .knn import blocked_topk, normalize, ranking_metrics
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def load_embeddings_and_labels(cfg):
+def load_embeddings_and_labels(cfg, out_path=None, normalized=False):
+    """
+    (metadata df with clip / species / label, float32 features). The CSV is read
+    `eval.stream_chunk_rows` rows at a time, so only one chunk is ever parsed into a DataFrame.
+    With out_path the features are written there (raw float32, L2-normalised if `normalized`)
+    and returned as a read-only np.memmap, so resident memory stays one chunk.
+    """
     emb_path = get_path(cfg, "embeddings_csv")
     labels_path = get_path(cfg, "labels_csv")
-    df = pd.read_csv(emb_path)
-    feat_cols = [c for c in df.columns if c.startswith("f")]
-    X = np.asarray(df[feat_cols], dtype=np.float32)
-    df = df.copy()
+    chunk_rows = int(cfg.get("eval", {}).get("stream_chunk_rows", 65536))
+    keep = kept_clips(cfg)
+    meta, blocks, d = [], [], 0
+    sink = open(out_path, "wb") if out_path is not None else None
+    try:
+        for chunk in pd.read_csv(emb_path, chunksize=chunk_rows):
+            chunk["species"] = chunk["species"].astype(str)
+            if keep is not None:
+                chunk = chunk[[(s, c) in keep for s, c in zip(chunk["species"], chunk["clip"])]]
+            if chunk.empty:
+                continue
+            X = np.asarray(chunk[[c for c in chunk.columns if c.startswith("f")]], dtype=np.float32)
+            if normalized:
+                X = normalize(X)
+            d = X.shape[1]
+            if sink is not None:
+                sink.write(np.ascontiguousarray(X).tobytes())
+            else:
+                blocks.append(X)
+            meta.append(chunk[["clip", "species"]])
+    finally:
+        if sink is not None:
+            sink.close()
+    df = pd.concat(meta, ignore_index=True) if meta else pd.DataFrame(columns=["clip", "species"])
+    if not len(df):
+        X = np.zeros((0, d), dtype=np.float32)
+    elif sink is not None:
+        X = np.memmap(out_path, dtype=np.float32, mode="r", shape=(len(df), d))
+    else:
+        X = np.concatenate(blocks)
 
     if labels_path.exists():
         labels_df = pd.read_csv(labels_path)
+        labels_df["species"] = labels_df["species"].astype(str)
         merge = df[["clip", "species"]].merge(
             labels_df[["clip", "species", "label"]],
             on=["clip", "species"],
@@ -48,33 +88,45 @@ def load_embeddings_and_labels(cfg):
     return df, X
 
 
-def run(cfg, n_neighbors=10, n_random=50):
+def _retrieval_scores(X_query, X_target, n_neighbors, n_random, seed, exclude_self=False):
+    """Mean cosine of the top-k targets vs random targets, over all query rows."""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    sim_matrix = cosine_similarity(X_query, X_target)
+    if exclude_self:
+        np.fill_diagonal(sim_matrix, -np.inf)
+    n_target = sim_matrix.shape[1] - int(exclude_self)
+    k = min(n_neighbors, n_target)
+    top = np.partition(sim_matrix, -k, axis=1)[:, -k:]
+    rng = np.random.default_rng(seed)
+    random_sims = []
+    for i in range(len(sim_matrix)):
+        sims = sim_matrix[i][np.isfinite(sim_matrix[i])]
+        rand_idx = rng.choice(len(sims), size=min(n_random, len(sims)), replace=False)
+        random_sims.extend(sims[rand_idx])
+    return float(np.mean(top)), float(np.mean(random_sims))
+
+
+def run(cfg, n_neighbors=10, n_random=50, query_species=None, target_species=None):
+    """Alarm clips of query_species (default Deer) retrieve nearest target_species clips (default Monkey)."""
+    query_species = query_species or cfg["species"][1]
+    target_species = target_species or cfg["species"][0]
     df, X = load_embeddings_and_labels(cfg)
     species = df["species"].values
     label = df["label"].values
-    deer_alarm = (species == "Deer") & (label == 1)
-    monkey_idx = np.where(species == "Monkey")[0]
-    if deer_alarm.sum() == 0 or len(monkey_idx) == 0:
-        logger.warning("Need Deer alarm clips and Monkey clips for retrieval")
+    query_alarm = (species == query_species) & (label == 1)
+    target_idx = np.where(species == target_species)[0]
+    if query_alarm.sum() == 0 or len(target_idx) == 0:
+        logger.warning("Need %s alarm clips and %s clips for retrieval", query_species, target_species)
         return
 
-    deer_alarm_idx = np.where(deer_alarm)[0]
-    X_deer = X[deer_alarm_idx]
-    X_monkey = X[monkey_idx]
-    sim_matrix = cosine_similarity(X_deer, X_monkey)
-
-    nearest_sims = []
-    random_sims = []
-    rng = np.random.default_rng(cfg.get("seed", 42))
-    for i in range(len(deer_alarm_idx)):
-        sims = sim_matrix[i]
-        top_k_idx = np.argsort(sims)[-n_neighbors:]
-        nearest_sims.extend(sims[top_k_idx])
-        rand_idx = rng.choice(len(monkey_idx), size=min(n_random, len(monkey_idx)), replace=False)
-        random_sims.extend(sims[rand_idx])
-    nearest_mean = np.mean(nearest_sims)
-    random_mean = np.mean(random_sims)
-    logger.info("Eval3 — Retrieval: mean cosine nearest %.4f vs random %.4f", nearest_mean, random_mean)
+    nearest_mean, random_mean = _retrieval_scores(
+        X[query_alarm], X[target_idx], n_neighbors, n_random, cfg.get("seed", 42)
+    )
+    logger.info(
+        "Eval3 — Retrieval (%s→%s): mean cosine nearest %.4f vs random %.4f",
+        query_species, target_species, nearest_mean, random_mean,
+    )
     logger.info("Nearest > random: %s", nearest_mean > random_mean)
 
     out_dir = get_path(cfg, "retrieval")
@@ -87,13 +139,156 @@ def run(cfg, n_neighbors=10, n_random=50):
     return {"nearest": nearest_mean, "random": random_mean}
 
 
+def retrieval_matrix(cfg, n_neighbors=10, n_random=50, n_workers=None):
+    """
+    Query × target matrix of (nearest − random) mean cosine: alarm clips of each query species
+    retrieve from every target species. Pairs are independent and run on a process pool.
+    """
+    df, X = load_embeddings_and_labels(cfg)
+    species = df["species"].values
+    label = df["label"].values
+    species_list = [s for s in cfg["species"] if s in set(species)]
+    seed = cfg.get("seed", 42)
+    n_workers = n_workers or cfg.get("eval", {}).get("n_workers")
+    matrix = pd.DataFrame(np.nan, index=species_list, columns=species_list)
+    with ProcessPoolExecutor(max_workers=n_workers) as pool:
+        futures = {}
+        for q in species_list:
+            q_alarm = (species == q) & (label == 1)
+            if q_alarm.sum() == 0:
+                continue
+            for t in species_list:
+                if q == t:
+                    # Same species: alarm queries against all other clips of the species
+                    X_t = np.concatenate([X[q_alarm], X[(species == t) & ~q_alarm]])
+                    futures[(q, t)] = pool.submit(_retrieval_scores, X[q_alarm], X_t, n_neighbors, n_random, seed, True)
+                else:
+                    futures[(q, t)] = pool.submit(_retrieval_scores, X[q_alarm], X[species == t], n_neighbors, n_random, seed)
+        for (q, t), f in futures.items():
+            nearest, rand = f.result()
+            matrix.loc[q, t] = nearest - rand
+    matrix.index.name = "query"
+    matrix.columns.name = "target"
+    logger.info("Retrieval matrix, nearest − random cosine (rows = alarm queries):\n%s", matrix.round(4))
+    save_matrix(
+        matrix,
+        get_path(cfg, "retrieval") / "retrieval_matrix.csv",
+        get_path(cfg, "figures") / "retrieval_matrix.png",
+        "Retrieval: nearest − random cosine",
+    )
+    return matrix
+
+
+def relevant_counts(labels, species_codes, scope="all"):
+    """Relevant items per query: same label, not itself (and another species if scope == "cross")."""
+    n_relevant = np.zeros(len(labels), dtype=np.int64)
+    for lab in np.unique(labels[labels >= 0]):
+        m = labels == lab
+        if scope == "cross":
+            per_species = np.bincount(species_codes[m], minlength=species_codes.max() + 1)
+            n_relevant[m] = m.sum() - per_species[species_codes[m]]
+        else:
+            n_relevant[m] = m.sum() - 1
+    return n_relevant
+
+
+def exact_retrieval(cfg, k=10, scope="cross", query_block=1024, db_block=8192, n_threads=None):
+    """
+    Exact top-k retrieval for every clip against the whole corpus (self excluded; scope="cross"
+    restricts neighbours to other species, "all" allows any). Relevance = same alarm label.
+    Normalised features are streamed from the CSV into a float32 memmap, so memory is bounded
+    by the chunk and block sizes plus the (n × k) outputs.
+    Writes neighbor_ids.npy (int32) / neighbor_scores.npy (float16) row-aligned with
+    neighbors_index.csv, neighbors_meta.json (scope and the embedding CSV's size / mtime, so
+    readers can tell stale arrays) and exact_retrieval_metrics.csv.
+    """
+    emb_stat = get_path(cfg, "embeddings_csv").stat()
+    out_dir = get_path(cfg, "retrieval")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    feats_path = out_dir / "embeddings_normalized.f32"
+    df, Xn = load_embeddings_and_labels(cfg, out_path=feats_path, normalized=True)
+    labels = pd.to_numeric(df["label"], errors="coerce").fillna(-1).astype(int).values
+    species_codes, _ = pd.factorize(df["species"].astype(str))
+    n = len(Xn)
+    k = min(k, n - 1)
+    if k < 1:
+        logger.warning("Need at least 2 clips for exact retrieval")
+        del Xn
+        feats_path.unlink()
+        return None
+
+    n_relevant = relevant_counts(labels, species_codes, scope)
+    ids_mm = np.lib.format.open_memmap(out_dir / "neighbor_ids.npy", mode="w+", dtype=np.int32, shape=(n, k))
+    scores_mm = np.lib.format.open_memmap(out_dir / "neighbor_scores.npy", mode="w+", dtype=np.float16, shape=(n, k))
+    sums = {"hit": [], "recall": [], "ap": [], "agreement": []}
+
+    def on_block(q_start, ids, _scores):
+        q = slice(q_start, q_start + len(ids))
+        hit, recall, ap, agreement = ranking_metrics(ids, labels[q], labels, n_relevant[q], k)
+        sums["hit"].append(hit)
+        sums["recall"].append(recall)
+        sums["ap"].append(ap)
+        sums["agreement"].append(agreement)
+
+    blocked_topk(
+        Xn, Xn, k,
+        query_block=query_block, db_block=db_block, n_threads=n_threads,
+        groups=species_codes, exclude_self=True, cross_group=scope == "cross",
+        out_ids=ids_mm, out_scores=scores_mm, on_block=on_block,
+    )
+    ids_mm.flush()
+    scores_mm.flush()
+    del Xn
+    feats_path.unlink()
+    df[["clip", "species", "label"]].to_csv(out_dir / "neighbors_index.csv", index=False)
+    (out_dir / "neighbors_meta.json").write_text(json.dumps({
+        "scope": scope,
+        "k": k,
+        "embeddings_size": emb_stat.st_size,
+        "embeddings_mtime_ns": emb_stat.st_mtime_ns,
+    }))
+
+    hit, recall, ap, agreement = (np.concatenate(sums[key]) for key in ("hit", "recall", "ap", "agreement"))
+    n_eval = int(np.isfinite(ap).sum())
+    if n_eval == 0:
+        logger.warning("No labeled queries with relevant items; saved neighbours only")
+        return None
+    metrics = {
+        f"hit@{k}": float(np.nanmean(hit)),
+        f"recall@{k}": float(np.nanmean(recall)),
+        f"mAP@{k}": float(np.nanmean(ap)),
+        f"label_agreement@{k}": float(np.nanmean(agreement)),
+        "n_queries": n_eval,
+    }
+    logger.info(
+        "Exact retrieval (%s, %d queries): hit@%d %.4f  recall@%d %.4f  mAP@%d %.4f  label-agreement@%d %.4f",
+        scope, n_eval, k, metrics[f"hit@{k}"], k, metrics[f"recall@{k}"], k, metrics[f"mAP@{k}"],
+        k, metrics[f"label_agreement@{k}"],
+    )
+    pd.DataFrame({"metric": list(metrics), "value": list(metrics.values())}).to_csv(
+        out_dir / "exact_retrieval_metrics.csv", index=False
+    )
+    logger.info("Saved neighbours (%d × %d) and metrics to %s", n, k, out_dir)
+    return metrics
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--n-neighbors", type=int, default=10)
     parser.add_argument("--n-random", type=int, default=50)
+    parser.add_argument("--workers", type=int, default=None, help="Process pool size for the retrieval matrix")
+    parser.add_argument("--scope", choices=["all", "cross"], default="cross", help="Exact retrieval neighbour pool")
+    parser.add_argument("--query-block", type=int, default=1024)
+    parser.add_argument("--db-block", type=int, default=8192)
+    parser.add_argument("--threads", type=int, default=None, help="Threads for blocked exact search")
     args = parser.parse_args()
     cfg = load_config()
     run(cfg, n_neighbors=args.n_neighbors, n_random=args.n_random)
+    retrieval_matrix(cfg, n_neighbors=args.n_neighbors, n_random=args.n_random, n_workers=args.workers)
+    exact_retrieval(
+        cfg, k=args.n_neighbors, scope=args.scope,
+        query_block=args.query_block, db_block=args.db_block, n_threads=args.threads,
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+"""
+PROTO — Species-balanced contrastive batches with mined hard negatives.
+BalancedBatchSampler gives every species an equal share of each batch (minority species are
+cycled more often, majority species less), so in-batch InfoNCE negatives are not dominated by
+easy same-species pairs. With `sampler.hard_fraction` > 0 part of each batch is filled with the
+nearest neighbours of its anchors, looked up in an embedding bank that train_ssl fills from the
+encoder outputs it already computes; the neighbour table is rebuilt with knn.blocked_topk every
+`sampler.refresh_every` epochs. Balanced batches oversample minority species, so many majority
+clips are not drawn between two refreshes: train_ssl embeds those (and only those) with an extra
+no-grad pass at refresh time, so every clip can be mined as a hard negative.
+`python -m src sampler` trains once per sampler variant and writes outputs/sampler_report.csv:
+epochs to reach `--target` linear-probe accuracy, best probe accuracy, final loss.
+"""
+import argparse
+import copy
+import logging
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .config_loader import load_config, get_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MODES = ("shuffle", "balanced")
+
+
+class BalancedBatchSampler:
+    """
+    Batch sampler over dataset indices grouped by `groups` (species per clip); DataLoader only
+    needs __iter__ / __len__, so it is a plain class and this module imports without torch.
+    Each epoch yields ceil(n / batch_size) batches without repeated clips inside a batch.
+    """
+
+    def __init__(self, groups, batch_size, hard_fraction=0.0, n_neighbors=10, refresh_every=1, seed=42):
+        codes, self.names = pd.factorize(pd.Series(groups, dtype=str))
+        self.n = len(codes)
+        self.batch_size = min(int(batch_size), self.n)
+        self.members = [np.flatnonzero(codes == g) for g in range(len(self.names))]
+        self.hard_fraction = float(hard_fraction)
+        self.n_neighbors = int(n_neighbors)
+        self.refresh_every = max(int(refresh_every), 1)
+        self.rng = np.random.default_rng(seed)
+        self._perm = [np.empty(0, dtype=np.int64) for _ in self.members]
+        self._pos = [0] * len(self.members)
+        self.epoch = 0
+        self.neighbors = None  # (n, n_neighbors) dataset ids from the last refresh, -1 = none
+        self.bank = None  # latest encoder embedding per clip
+        self.seen = np.zeros(self.n, dtype=bool)  # drawn (and recorded) since the last refresh
+        self.batches = []  # current epoch's plan, in loader order
+
+    @property
+    def mining(self):
+        return self.hard_fraction > 0
+
+    def __len__(self):
+        return -(-self.n // self.batch_size)
+
+    def __iter__(self):
+        # The whole epoch is planned up front so record(step, ...) can map loader steps to clips
+        self.batches = [self._batch() for _ in range(len(self))]
+        for batch in self.batches:
+            yield [int(i) for i in batch]
+
+    def _draw(self, g, m, exclude=()):
+        """Next m clips of species g from its running permutation (reshuffled when exhausted)."""
+        out = []
+        while len(out) < m:
+            if self._pos[g] >= len(self._perm[g]):
+                perm = self.rng.permutation(self.members[g])
+                # Clips already drawn for this batch go to the back of the new permutation
+                taken = np.isin(perm, list(exclude) + out)
+                self._perm[g], self._pos[g] = np.concatenate([perm[~taken], perm[taken]]), 0
+            take = min(m - len(out), len(self._perm[g]) - self._pos[g])
+            out.extend(self._perm[g][self._pos[g] : self._pos[g] + take].tolist())
+            self._pos[g] += take
+        return out
+
+    def _shares(self, n_items):
+        """Per-species counts summing to n_items: as equal as species sizes allow."""
+        sizes = np.array([len(m) for m in self.members])
+        shares = np.zeros(len(sizes), dtype=np.int64)
+        left = n_items
+        while left > 0:
+            room = np.flatnonzero(shares < sizes)
+            if len(room) == 0:
+                break
+            each, extra = divmod(left, len(room))
+            add = np.full(len(room), each)
+            add[self.rng.choice(len(room), size=extra, replace=False)] += 1
+            add = np.minimum(add, sizes[room] - shares[room])
+            shares[room] += add
+            left -= int(add.sum())
+        return shares
+
+    def _batch(self):
+        n_hard = int(round(self.hard_fraction * self.batch_size)) if self.neighbors is not None else 0
+        batch = []
+        for g, m in enumerate(self._shares(self.batch_size - n_hard)):
+            batch.extend(self._draw(g, int(m), batch))
+        if n_hard:
+            in_batch = set(batch)
+            for a in self.rng.permutation(batch):
+                if len(in_batch) - len(batch) >= n_hard:
+                    break
+                for j in self.neighbors[a]:
+                    if j >= 0 and j not in in_batch:
+                        in_batch.add(int(j))
+                        break
+            hard = list(in_batch - set(batch))
+            batch.extend(hard)
+            # Anchors without a free neighbour: top up with balanced draws
+            for g, m in enumerate(self._shares(self.batch_size - len(batch))):
+                batch.extend(self._draw(g, int(m), batch))
+        return self.rng.permutation(batch)
+
+    def record(self, step, embeddings):
+        """train_epoch on_batch hook: store the encoder outputs of loader step `step`."""
+        h = embeddings.detach().float().cpu().numpy()
+        if self.bank is None:
+            self.bank = np.zeros((self.n, h.shape[1]), dtype=np.float32)
+        ids = self.batches[step]
+        self.bank[ids] = h
+        self.seen[ids] = True
+
+    def end_epoch(self, embed=None):
+        """Advance the epoch; rebuild the neighbour table when the schedule says so."""
+        self.epoch += 1
+        if self.mining and self.epoch % self.refresh_every == 0:
+            self.refresh(embed)
+
+    def refresh(self, embed=None):
+        """
+        Rebuild the neighbour table from the bank. embed(ids) -> (len(ids), d) encoder outputs is
+        called for clips not drawn since the last refresh; without it only drawn clips take part.
+        """
+        from .knn import blocked_topk, normalize
+
+        t0 = time.perf_counter()
+        missing = np.flatnonzero(~self.seen)
+        if embed is not None and len(missing):
+            h = np.asarray(embed(missing), dtype=np.float32)
+            if self.bank is None:
+                self.bank = np.zeros((self.n, h.shape[1]), dtype=np.float32)
+            self.bank[missing] = h
+            self.seen[missing] = True
+        ids = np.flatnonzero(self.seen)
+        if len(ids) < 2:
+            return
+        k = min(self.n_neighbors, len(ids) - 1)
+        nn, _ = blocked_topk(normalize(self.bank[ids]), normalize(self.bank[ids]), k, exclude_self=True)
+        self.neighbors = np.full((self.n, k), -1, dtype=np.int64)
+        self.neighbors[ids] = np.where(nn >= 0, ids[np.maximum(nn, 0)], -1)
+        logger.info("Hard-negative table refreshed: %d clips × %d neighbours (%d re-embedded) in %.2fs",
+                    len(ids), k, len(missing) if embed is not None else 0, time.perf_counter() - t0)
+        if embed is not None:
+            self.seen[:] = False  # next refresh re-embeds clips not drawn until then
+
+    def state_dict(self):
+        return {
+            "epoch": self.epoch, "neighbors": self.neighbors, "bank": self.bank, "seen": self.seen,
+            "rng": self.rng.bit_generator.state, "perm": self._perm, "pos": self._pos,
+        }
+
+    def load_state_dict(self, state):
+        self.epoch = state["epoch"]
+        self.neighbors, self.bank, self.seen = state["neighbors"], state["bank"], state["seen"]
+        if "rng" in state:  # checkpoints written before the draw state was saved lack these
+            self.rng.bit_generator.state = state["rng"]
+            self._perm, self._pos = [np.asarray(p) for p in state["perm"]], list(state["pos"])
+
+
+def build_batch_sampler(cfg, paths, batch_size):
+    """BalancedBatchSampler from cfg["sampler"], or None for the plain shuffled loader."""
+    scfg = cfg.get("sampler", {})
+    mode = scfg.get("mode", "shuffle")
+    if mode not in MODES:
+        raise ValueError(f"sampler.mode must be one of {MODES}, got {mode!r}")
+    if mode == "shuffle":
+        return None
+    return BalancedBatchSampler(
+        [Path(p).parent.name for p in paths],
+        batch_size,
+        hard_fraction=float(scfg.get("hard_fraction", 0.0)),
+        n_neighbors=int(scfg.get("n_neighbors", 10)),
+        refresh_every=int(scfg.get("refresh_every", 1)),
+        seed=int(cfg.get("seed", 42)),
+    )
+
+
+VARIANTS = {
+    "shuffle": {"mode": "shuffle"},
+    "balanced": {"mode": "balanced", "hard_fraction": 0.0},
+    "balanced_hard": {"mode": "balanced"},  # hard_fraction / refresh_every from config
+}
+
+
+def compare(cfg, variants=tuple(VARIANTS), epochs=None, target=0.9):
+    """Train once per sampler variant (same seed / budget) and report epochs to `target` linear-probe accuracy."""
+    from .train_ssl import train
+
+    out_root = get_path(cfg, "outputs") / "sampler_compare"
+    hard_fraction = float(cfg.get("sampler", {}).get("hard_fraction") or 0.25)
+    rows, curves = [], {}
+    for name in variants:
+        vcfg = copy.deepcopy(cfg)
+        vcfg["sampler"] = {**cfg.get("sampler", {}), **VARIANTS[name]}
+        if name == "balanced_hard":
+            vcfg["sampler"]["hard_fraction"] = hard_fraction
+        vcfg["early_stopping"] = {**cfg.get("early_stopping", {}), "metric": "linear", "patience": 0}
+        vcfg["paths"]["models"] = out_root / name
+        t0 = time.perf_counter()
+        result = train(vcfg, epochs=epochs)
+        if result is None:
+            return None
+        seconds = time.perf_counter() - t0
+        history = result["history"]
+        if history and "linear" not in history[0]:
+            # train() falls back to loss-based stopping without enough labeled clips for the probe
+            logger.error("The sampler comparison needs the linear probe: label at least 10 clips in %s",
+                         get_path(cfg, "labels_csv"))
+            return None
+        curves[name] = [h["linear"] for h in history]
+        hit = next((h["epoch"] for h in history if h["linear"] >= target), None)
+        rows.append({
+            "sampler": name,
+            "hard_fraction": vcfg["sampler"].get("hard_fraction", 0.0) if name != "shuffle" else 0.0,
+            f"epochs_to_{target:g}": hit if hit is not None else np.nan,
+            "best_linear_probe": max(curves[name]),
+            "final_linear_probe": curves[name][-1],
+            "final_loss": result["loss"],
+            "epochs_run": result["epochs_run"],
+            "seconds": seconds,
+        })
+        logger.info("%s", rows[-1])
+
+    report = pd.DataFrame(rows)
+    out_path = get_path(cfg, "outputs") / "sampler_report.csv"
+    report.to_csv(out_path, index=False)
+    pd.DataFrame({k: pd.Series(v) for k, v in curves.items()}).rename_axis("epoch").rename(
+        index=lambda i: i + 1
+    ).to_csv(out_root / "linear_probe_curves.csv")
+    logger.info("Sampler comparison (target linear probe %.2f):\n%s", target, report.round(4).to_string(index=False))
+    logger.info("Saved %s", out_path)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--variants", nargs="*", choices=list(VARIANTS), default=list(VARIANTS))
+    parser.add_argument("--epochs", type=int, default=None, help="Epochs per variant (default config epochs)")
+    parser.add_argument("--target", type=float, default=0.9, help="Linear-probe accuracy to reach")
+    args = parser.parse_args()
+    cfg = load_config()
+    compare(cfg, variants=args.variants, epochs=args.epochs, target=args.target)
+
+
+if __name__ == "__main__":
+    main()
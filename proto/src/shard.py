@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""
+PROTO — Sharded execution of make_clips and extract_features across workers / hosts.
+  manifest  — list the stage's inputs (raw audio files / archive members, or clips) in order
+  work      — process shard i of N (row k of the manifest belongs to shard k mod N);
+              writes a per-shard CSV and, last, a .done.json marker. Rerunning a shard
+              replaces its outputs, so a failed shard can be rerun alone.
+  merge     — verify every shard finished against the same manifest, then assemble
+              data/clip_index.csv or the embedding store
+  run-local — manifest + N local worker processes (standing in for nodes) + merge
+Outputs under outputs/shards/<stage>/. Workers on other hosts need the project tree on shared storage.
+
+Usage:
+  python -m src shard manifest make_clips
+  python -m src shard work make_clips --shard 3/8
+  python -m src shard merge make_clips --num-shards 8
+  python -m src shard run-local extract_features --num-shards 4
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from .config_loader import load_config, get_path, PROJECT_ROOT
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+STAGES = ("make_clips", "extract_features")
+
+
+def parse_shard(spec: str):
+    """'3/8' -> (3, 8)."""
+    i, n = (int(v) for v in spec.split("/"))
+    if not 0 <= i < n:
+        raise argparse.ArgumentTypeError(f"shard index must be in [0, {n}): {spec}")
+    return i, n
+
+
+def shard_dir(cfg, stage: str) -> Path:
+    return get_path(cfg, "shards") / stage
+
+
+def _shard_paths(cfg, stage, shard, num_shards):
+    base = shard_dir(cfg, stage) / f"shard-{shard:04d}-of-{num_shards:04d}"
+    return base.with_suffix(".csv"), base.with_suffix(".done.json")
+
+
+def build_manifest(cfg, stage: str) -> pd.DataFrame:
+    """Inputs of `stage` as (species, path relative to the stage's input dir, bytes), sorted."""
+    from .audio_source import AudioSource, list_sources
+
+    if stage == "make_clips":
+        base = get_path(cfg, "raw_wav")
+        listing = list_sources
+    else:
+        base = get_path(cfg, "clips_1s")
+        listing = lambda d: [AudioSource(p, None, p.stat().st_size) for p in sorted(d.glob("*.wav"))]  # noqa: E731
+    rows = []
+    for species in cfg["species"]:
+        d = base / species
+        if d.exists():
+            rows.extend({"species": species, "path": src.key(base), "bytes": src.size} for src in listing(d))
+    manifest = pd.DataFrame(rows, columns=["species", "path", "bytes"])
+    out = shard_dir(cfg, stage) / "manifest.csv"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    manifest.to_csv(out, index=False)
+    logger.info("Manifest for %s: %d inputs -> %s", stage, len(manifest), out)
+    return manifest
+
+
+def _manifest_sha1(cfg, stage):
+    return hashlib.sha1((shard_dir(cfg, stage) / "manifest.csv").read_bytes()).hexdigest()
+
+
+def load_manifest(cfg, stage: str) -> pd.DataFrame:
+    path = shard_dir(cfg, stage) / "manifest.csv"
+    if not path.exists():
+        raise FileNotFoundError(f"No manifest for {stage}: run `python -m src shard manifest {stage}` first")
+    return pd.read_csv(path)
+
+
+def _atomic_write_csv(df: pd.DataFrame, path: Path) -> None:
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    df.to_csv(tmp, index=False)
+    os.replace(tmp, path)
+
+
+def _work_make_clips(cfg, rows):
+    from .audio_source import from_key, iter_payloads
+    from .make_clips import process_file
+
+    base, clips_base = get_path(cfg, "raw_wav"), get_path(cfg, "clips_1s")
+    out, failed = [], []
+    sources = [from_key(base, rel) for rel in rows["path"]]
+    for species, rel, (src, payload) in zip(rows["species"], rows["path"], iter_payloads(sources)):
+        out_dir = clips_base / species
+        out_dir.mkdir(parents=True, exist_ok=True)
+        if isinstance(payload, Exception):  # member missing from / unreadable in its archive
+            logger.warning("Failed %s: %s", rel, payload)
+            failed.append(rel)
+            continue
+        try:
+            index_rows, _ = process_file(src, species, cfg, out_dir, overwrite=True, payload=payload)
+        except Exception as e:
+            logger.warning("Failed %s: %s", rel, e)
+            failed.append(rel)
+            continue
+        out.extend(index_rows)
+    return pd.DataFrame(out), failed, []
+
+
+def _work_extract(cfg, rows):
+    """Embed the shard's clips; clips whose store row matches (clip_sha1, model hash) are only listed as reused."""
+    import torch
+    from .extract_features import embedding_row, file_sha1, load_encoder, load_store, model_hash, store_index
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    model = load_encoder(cfg, device)
+    mhash = model_hash(cfg)
+    known = store_index(load_store(get_path(cfg, "embeddings_csv")))
+    base = get_path(cfg, "clips_1s")
+    out, failed, reused = [], [], []
+    for species, rel in zip(rows["species"], rows["path"]):
+        path = base / rel
+        try:
+            sha = file_sha1(path)
+            prev = known.get((species, path.name))
+            if prev is not None and prev[0] == sha and prev[1] == mhash:
+                reused.append(rel)
+                continue
+            out.append(embedding_row(model, path, species, sha, mhash, cfg["sr"], cfg["n_mels"], device))
+        except Exception as e:
+            logger.warning("Skip %s: %s", rel, e)
+            failed.append(rel)
+    return pd.DataFrame(out), failed, reused
+
+
+def work(cfg, stage: str, shard: int, num_shards: int) -> dict:
+    """Process one shard; the .done.json marker is written only after the shard CSV."""
+    manifest = load_manifest(cfg, stage)
+    rows = manifest.iloc[shard::num_shards]
+    csv_path, done_path = _shard_paths(cfg, stage, shard, num_shards)
+    done_path.unlink(missing_ok=True)
+    t0 = time.perf_counter()
+    fn = _work_make_clips if stage == "make_clips" else _work_extract
+    df, failed, reused = fn(cfg, rows)
+    _atomic_write_csv(df, csv_path)
+    status = {
+        "stage": stage,
+        "shard": shard,
+        "num_shards": num_shards,
+        "manifest_sha1": _manifest_sha1(cfg, stage),
+        "n_inputs": len(rows),
+        "n_rows": len(df),
+        "failed": failed,
+        "reused": reused,
+        "seconds": round(time.perf_counter() - t0, 2),
+        "host": os.uname().nodename if hasattr(os, "uname") else "",
+    }
+    done_path.write_text(json.dumps(status, indent=1))
+    logger.info("Shard %d/%d of %s: %d inputs -> %d rows (%d reused, %d failed) in %.1fs",
+                shard, num_shards, stage, len(rows), len(df), len(reused), len(failed), status["seconds"])
+    return status
+
+
+def merge(cfg, stage: str, num_shards: int) -> pd.DataFrame:
+    """Check all shards are done for the current manifest, then assemble the stage's final output."""
+    manifest = load_manifest(cfg, stage)
+    msha = _manifest_sha1(cfg, stage)
+    missing, stale, parts, failed, reused = [], [], [], [], []
+    for i in range(num_shards):
+        csv_path, done_path = _shard_paths(cfg, stage, i, num_shards)
+        if not done_path.exists() or not csv_path.exists():
+            missing.append(i)
+            continue
+        status = json.loads(done_path.read_text())
+        if status["manifest_sha1"] != msha or status["n_inputs"] != len(manifest.iloc[i::num_shards]):
+            stale.append(i)
+            continue
+        failed.extend(status["failed"])
+        reused.extend(status.get("reused", []))
+        if status["n_rows"]:
+            parts.append(pd.read_csv(csv_path, dtype={"seg_params": str}))
+    if missing or stale:
+        raise RuntimeError(
+            f"{stage}: shards {missing + stale} not done for the current manifest; "
+            f"rerun each with `python -m src shard work {stage} --shard i/{num_shards}`"
+        )
+    df = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame()
+
+    if stage == "make_clips":
+        df = _dedupe_clips(df)
+        n_sources = df.groupby(["species", "source"]).ngroups if len(df) else 0
+        logger.info("%d clips from %d of %d sources (%d failed)", len(df), n_sources, len(manifest), len(failed))
+        _remove_stale_clips(cfg, manifest, df, failed)
+        out_path = get_path(cfg, "clip_index")
+        out_path.parent.mkdir(parents=True, exist_ok=True)
+        _atomic_write_csv(df, out_path)
+    else:
+        df, out_path = _merge_embeddings(cfg, manifest, df, failed, reused)
+    logger.info("Merged %d shards of %s: %d rows -> %s", num_shards, stage, len(df), out_path)
+    return df
+
+
+def _dedupe_clips(df: pd.DataFrame) -> pd.DataFrame:
+    """Drop identical repeated (species, clip) rows; two different rows for one clip are a conflict."""
+    if df.empty:
+        return df
+    df = df.drop_duplicates(ignore_index=True)
+    conflicts = df[df.duplicated(["species", "clip"], keep=False)]
+    if len(conflicts):
+        raise RuntimeError(
+            f"make_clips merge: {conflicts['clip'].nunique()} clips written by more than one source, e.g.\n"
+            f"{conflicts.head(6).to_string(index=False)}"
+        )
+    return df
+
+
+def _remove_stale_clips(cfg, manifest, df, failed):
+    """
+    As make_clips.run: clips of the previous index that the merged shards no longer produce
+    (e.g. after a segmentation change) are deleted, for the sources the shards processed.
+    """
+    from .audio_source import from_key
+    from .make_clips import _previous_index, remove_stale_clips, segmentation_params
+
+    params = segmentation_params(cfg)
+    if len(df) and ("seg_params" not in df or (df["seg_params"] != params).any()):
+        raise RuntimeError("make_clips merge: shards ran with other segmentation settings; rerun them")
+    base = get_path(cfg, "raw_wav")
+    failed = set(failed)
+    done_sources = {
+        (sp, str(from_key(base, rel))) for sp, rel in zip(manifest["species"], manifest["path"]) if rel not in failed
+    }
+    removed = remove_stale_clips(cfg, _previous_index(cfg), df.to_dict("records") if len(df) else [], done_sources)
+    if removed:
+        logger.info("Removed %d clips no longer produced by the current segmentation", removed)
+
+
+def _merge_embeddings(cfg, manifest, df, failed, reused):
+    """Upsert the shard rows into the incremental embedding store (see extract_features.run)."""
+    from .extract_features import load_store, store_index, upsert
+
+    key_of = {rel: (sp, Path(rel).name) for sp, rel in zip(manifest["species"], manifest["path"])}
+    got = list(zip(df["species"].astype(str), df["clip"])) if len(df) else []
+    dupes = len(got) - len(set(got))
+    lost = set(key_of.values()) - set(got) - {key_of[rel] for rel in reused}
+    if dupes or len(lost) != len(failed):
+        raise RuntimeError(f"extract_features merge: {dupes} duplicate rows, {len(lost)} clips missing")
+    hashes = df["model_hash"].unique() if len(df) else []
+    if len(hashes) > 1:
+        raise RuntimeError(f"extract_features merge: shards used different models {list(hashes)}")
+    out_path = get_path(cfg, "embeddings_csv")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    store = load_store(out_path)
+    known = store_index(store)
+    reused_hashes = {known[key_of[rel]][1] if key_of[rel] in known else None for rel in reused}
+    if None in reused_hashes or len(reused_hashes | set(hashes)) > 1:
+        raise RuntimeError("extract_features merge: the store changed since the shards ran; rerun them")
+    # Same row order as a single-process run
+    order = {k: n for n, k in enumerate(key_of.values())}
+    if len(df):
+        df = df.iloc[sorted(range(len(df)), key=lambda r: order[got[r]])]
+    # Rows of re-embedded clips are replaced; rows of clips that failed here are stale and dropped
+    replaced = {known[k][2] for k in got if k in known}
+    stale = {known[key_of[rel]][2] for rel in failed if key_of[rel] in known}
+    if stale:
+        logger.warning("Dropped %d stale rows whose clips failed to re-embed", len(stale))
+    merged = upsert(store, df, replaced | stale, out_path)
+    others = set(merged["model_hash"]) - set(hashes) if len(hashes) and len(merged) else set()
+    if others:
+        logger.warning("%s still holds rows from other models %s (clips outside the manifest); "
+                       "run extract_features to re-embed them", out_path, sorted(others))
+    logger.info("%d clips embedded, %d reused, %d failed", len(df), len(reused), len(failed))
+    return merged, out_path
+
+
+def run_local(cfg, stage: str, num_shards: int, retries: int = 1) -> pd.DataFrame:
+    """Manifest, then N worker subprocesses in parallel (failed shards retried alone), then merge."""
+    build_manifest(cfg, stage)
+    pending = list(range(num_shards))
+    for attempt in range(retries + 1):
+        procs = {
+            i: subprocess.Popen([sys.executable, "-m", "src", "shard", "work", stage, "--shard", f"{i}/{num_shards}"],
+                                cwd=PROJECT_ROOT)
+            for i in pending
+        }
+        pending = [i for i, p in procs.items() if p.wait() != 0]
+        if not pending:
+            break
+        logger.warning("Shards %s failed (attempt %d); rerunning them alone", pending, attempt + 1)
+    return merge(cfg, stage, num_shards)
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m src shard")
+    sub = parser.add_subparsers(dest="action", required=True)
+    p = sub.add_parser("manifest")
+    p.add_argument("stage", choices=STAGES)
+    p = sub.add_parser("work")
+    p.add_argument("stage", choices=STAGES)
+    p.add_argument("--shard", type=parse_shard, required=True, help="i/N")
+    p = sub.add_parser("merge")
+    p.add_argument("stage", choices=STAGES)
+    p.add_argument("--num-shards", type=int, required=True)
+    p = sub.add_parser("run-local")
+    p.add_argument("stage", choices=STAGES)
+    p.add_argument("--num-shards", type=int, default=os.cpu_count() or 1)
+    p.add_argument("--retries", type=int, default=1)
+    args = parser.parse_args()
+    cfg = load_config()
+    if args.action == "manifest":
+        build_manifest(cfg, args.stage)
+    elif args.action == "work":
+        work(cfg, args.stage, *args.shard)
+    elif args.action == "merge":
+        merge(cfg, args.stage, args.num_shards)
+    else:
+        run_local(cfg, args.stage, args.num_shards, args.retries)
+
+
+if __name__ == "__main__":
+    main()
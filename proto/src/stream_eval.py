@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+"""
+PROTO — Out-of-core transfer test and shuffled-feature baseline (python -m src evaluate_transfer --stream).
+The embedding CSV is read `eval.stream_chunk_rows` rows at a time, once. That pass writes a
+float32 row-major copy (outputs/stream_cache/embeddings.f32, read back through np.memmap) and
+fits a StandardScaler per species with partial_fit, so the scaler statistics take a single pass.
+The cache is reused while the embedding CSV, the labels and the dedup manifest keep their
+size / mtime (stream_cache/meta.json); otherwise it is rebuilt.
+The probe minimises LogisticRegression's objective (C=1, unpenalised intercept) by full-batch
+Newton over chunks: each iteration is one chunked pass accumulating the loss, gradient and
+(d+1)² Hessian, and iterations stop once the step falls below `eval.stream_tol`. This replaces
+mini-batch SGD partial_fit, whose last iterate kept drifting around the optimum (the shuffled
+baseline never settled, with or without averaging), so streamed and in-memory accuracies did not
+agree; Newton reaches the optimum of the same objective in ~10 passes. The price is the Hessian:
+8·(d+1)² bytes and an O(d³) solve per iteration, fine for embeddings up to a few thousand
+dimensions (128-d: 130 KB) but impractical much beyond NEWTON_MAX_DIM, where fit_probe warns.
+The shuffled baseline never copies the matrix: column j is permuted by the same RNG draw as the
+in-memory X.copy() + shuffle, and only the labeled source / target rows of the shuffled matrix
+are gathered, a block of columns at a time, into an on-disk memmap next to the cache. RAM holds
+one length-n permutation and one column block.
+`--stream --check` also runs the in-memory path and logs the differences (needs data that fits in RAM).
+"""
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import confusion_matrix
+from sklearn.preprocessing import StandardScaler
+
+from .config_loader import get_path
+from .dedup_clips import kept_clips
+from .evaluate_transfer import function_labels, transfer_pair
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CLASSES = np.array([0, 1])
+NEWTON_MAX_DIM = 4096  # (d+1)² float64 Hessian ≈ 134 MB and a d³ solve per iteration at this width
+
+
+def stream_settings(cfg):
+    ecfg = cfg.get("eval", {})
+    return (int(ecfg.get("stream_chunk_rows", 65536)), int(ecfg.get("stream_max_iter", 100)),
+            float(ecfg.get("stream_tol", 1e-6)))
+
+
+class EmbeddingStream:
+    """On-disk float32 embeddings (np.memmap) with per-row species, function label and labeled mask."""
+
+    def __init__(self, path, X, species, y_func, labeled_mask, scalers):
+        self.path = path
+        self.X = X
+        self.species = species
+        self.y_func = y_func
+        self.labeled_mask = labeled_mask
+        self.scalers = scalers  # species -> StandardScaler fit on its labeled rows
+
+    def rows(self, species):
+        return np.flatnonzero((self.species == species) & self.labeled_mask)
+
+
+def _file_stat(path):
+    return [path.stat().st_size, path.stat().st_mtime_ns] if path.exists() else None
+
+
+def cache_key(cfg) -> dict:
+    """Size / mtime of every input build_stream reads; the cache is valid while these match."""
+    dedup = bool(cfg.get("dedup", {}).get("enabled", False))
+    return {
+        "embeddings": _file_stat(get_path(cfg, "embeddings_csv")),
+        "labels": _file_stat(get_path(cfg, "labels_csv")),
+        "dedup_manifest": _file_stat(get_path(cfg, "dedup_manifest")) if dedup else None,
+    }
+
+
+def _scaler_state(scalers) -> dict:
+    names = sorted(scalers)
+    return {
+        "scaler_species": np.array(names, dtype=str),
+        "scaler_mean": np.stack([scalers[s].mean_ for s in names]) if names else np.empty((0, 0)),
+        "scaler_var": np.stack([scalers[s].var_ for s in names]) if names else np.empty((0, 0)),
+        "scaler_scale": np.stack([scalers[s].scale_ for s in names]) if names else np.empty((0, 0)),
+        "scaler_n": np.array([int(scalers[s].n_samples_seen_) for s in names], dtype=np.int64),
+    }
+
+
+def _scalers_from(z) -> dict:
+    scalers = {}
+    for i, s in enumerate(z["scaler_species"]):
+        sc = StandardScaler()
+        sc.mean_, sc.var_, sc.scale_ = z["scaler_mean"][i], z["scaler_var"][i], z["scaler_scale"][i]
+        sc.n_samples_seen_, sc.n_features_in_ = int(z["scaler_n"][i]), len(sc.mean_)
+        scalers[str(s)] = sc
+    return scalers
+
+
+def load_cached_stream(cfg, out_dir):
+    """EmbeddingStream from out_dir when its meta.json matches cache_key(cfg), else None."""
+    meta_path = out_dir / "meta.json"
+    if not meta_path.exists():
+        return None
+    meta = json.loads(meta_path.read_text())
+    if meta.get("key") != cache_key(cfg):
+        return None
+    n, d = meta["shape"]
+    out_path = out_dir / "embeddings.f32"
+    if not out_path.exists() or out_path.stat().st_size != n * d * 4:
+        return None
+    with np.load(out_dir / "rows.npz") as z:
+        scalers = _scalers_from(z)
+        species, y_func, labeled = z["species"], z["y_func"], z["labeled"]
+    X = np.memmap(out_path, dtype=np.float32, mode="r", shape=(n, d))
+    logger.info("Reusing %d × %d streamed embeddings in %s", n, d, out_path)
+    return EmbeddingStream(out_path, X, species, y_func, labeled, scalers)
+
+
+def build_stream(cfg, chunk_rows=None, rebuild=False):
+    """
+    One pass over the embedding CSV: float32 memmap copy, labels, per-species scalers.
+    Reuses outputs/stream_cache/ when the inputs are unchanged (unless `rebuild`).
+    """
+    emb_path = get_path(cfg, "embeddings_csv")
+    if not emb_path.exists():
+        raise FileNotFoundError(f"Run extract_features.py first: {emb_path}")
+    out_dir = get_path(cfg, "outputs") / "stream_cache"
+    if not rebuild:
+        stream = load_cached_stream(cfg, out_dir)
+        if stream is not None:
+            return stream
+    chunk_rows = chunk_rows or stream_settings(cfg)[0]
+    key = cache_key(cfg)
+    labels_path = get_path(cfg, "labels_csv")
+    labels_df = pd.read_csv(labels_path) if labels_path.exists() else None
+    keep = kept_clips(cfg)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    for old in [out_dir / "meta.json", *out_dir.glob("shuffled_*.f32")]:
+        old.unlink(missing_ok=True)  # invalidate first: a crash mid-rebuild must not leave a "valid" cache
+    out_path = out_dir / "embeddings.f32"
+
+    species, y_func, labeled, scalers = [], [], [], {}
+    n, d = 0, None
+    with open(out_path, "wb") as f:
+        for df in pd.read_csv(emb_path, chunksize=chunk_rows):
+            df["species"] = df["species"].astype(str)
+            if keep is not None:
+                df = df[[(s, c) in keep for s, c in zip(df["species"], df["clip"])]].reset_index(drop=True)
+            if df.empty:
+                continue
+            X = np.ascontiguousarray(df[[c for c in df.columns if c.startswith("f")]], dtype=np.float32)
+            d = X.shape[1]
+            y, m = function_labels(df, labels_df)
+            sp = df["species"].to_numpy(dtype=str)
+            for s in np.unique(sp[m]):
+                scalers.setdefault(s, StandardScaler()).partial_fit(X[m & (sp == s)])
+            f.write(X.tobytes())
+            species.append(sp)
+            y_func.append(y)
+            labeled.append(m)
+            n += len(X)
+    if n == 0:
+        raise ValueError(f"No embeddings left in {emb_path} after dedup filtering")
+    species, y_func, labeled = np.concatenate(species), np.concatenate(y_func), np.concatenate(labeled)
+    np.savez(out_dir / "rows.npz", species=species, y_func=y_func, labeled=labeled, **_scaler_state(scalers))
+    (out_dir / "meta.json").write_text(json.dumps({"key": key, "shape": [n, d]}, indent=2))
+    X = np.memmap(out_path, dtype=np.float32, mode="r", shape=(n, d))
+    logger.info("Streamed %d × %d embeddings to %s in chunks of %d rows", n, d, out_path, chunk_rows)
+    return EmbeddingStream(out_path, X, species, y_func, labeled, scalers)
+
+
+def iter_chunks(n_rows, chunk_rows, rng=None):
+    """Consecutive position ranges over n_rows (read sequentially); with rng, in shuffled chunk order."""
+    starts = np.arange(0, n_rows, chunk_rows)
+    if rng is not None:
+        starts = rng.permutation(starts)
+    for s in starts:
+        yield np.arange(s, min(s + chunk_rows, n_rows))
+
+
+def fit_scaler(get_rows, n_rows, chunk_rows):
+    """StandardScaler statistics in one pass over get_rows(positions) chunks."""
+    scaler = StandardScaler()
+    for pos in iter_chunks(n_rows, chunk_rows):
+        scaler.partial_fit(get_rows(pos))
+    return scaler
+
+
+def fit_probe(get_rows, y, scaler, chunk_rows, max_iter=100, tol=1e-6):
+    """
+    LogisticRegression(C=1) fit out of core by damped Newton: one chunked pass per iteration
+    accumulates loss, gradient and Hessian over scaled rows (+ intercept column). Stops when the
+    largest step component is below tol relative to the weights. Returns a fitted LogisticRegression.
+    """
+    d = scaler.n_features_in_
+    if d > NEWTON_MAX_DIM:
+        logger.warning("Streamed probe on %d-d embeddings: the Newton Hessian needs %.1f GB and a d³ solve per pass",
+                       d, 8 * (d + 1) ** 2 / 1e9)
+    y = np.asarray(y, dtype=np.float64)
+    reg = np.r_[np.ones(d), 0.0]  # the intercept is not penalised
+
+    def one_pass(w):
+        loss, g, H = 0.5 * np.sum(reg * w ** 2), reg * w, np.diag(reg)
+        for pos in iter_chunks(len(y), chunk_rows):
+            A = np.hstack([scaler.transform(np.asarray(get_rows(pos), dtype=np.float64)), np.ones((len(pos), 1))])
+            z, t = A @ w, y[pos]
+            p = 0.5 * (1.0 + np.tanh(0.5 * z))  # sigmoid without overflow
+            loss += np.sum(np.logaddexp(0.0, z) - t * z)
+            g += A.T @ (p - t)
+            H += (A * (p * (1.0 - p))[:, None]).T @ A
+        return loss, g, H
+
+    w = np.zeros(d + 1)
+    loss, g, H = one_pass(w)
+    n_iter = 0
+    for n_iter in range(1, max_iter + 1):
+        step, t = np.linalg.solve(H, g), 1.0
+        while True:
+            # Backtrack until the objective does not increase (Newton steps can overshoot early on)
+            w_new = w - t * step
+            loss_new, g_new, H_new = one_pass(w_new)
+            if loss_new <= loss + 1e-12 * abs(loss) or t < 1e-4:
+                break
+            t /= 2
+        w, loss, g, H = w_new, loss_new, g_new, H_new
+        if np.max(np.abs(t * step)) <= tol * max(1.0, np.max(np.abs(w))):
+            break
+    else:
+        logger.warning("Streamed probe did not converge in %d Newton iterations (eval.stream_max_iter)", max_iter)
+    clf = LogisticRegression()
+    clf.coef_, clf.intercept_ = w[None, :d], w[d:]
+    clf.classes_, clf.n_features_in_, clf.n_iter_ = CLASSES, d, np.array([n_iter])
+    return clf
+
+
+def score_probe(get_rows, y, scaler, clf, chunk_rows):
+    """(accuracy, confusion matrix) accumulated over chunks."""
+    cm = np.zeros((len(CLASSES), len(CLASSES)), dtype=np.int64)
+    for pos in iter_chunks(len(y), chunk_rows):
+        cm += confusion_matrix(y[pos], clf.predict(scaler.transform(get_rows(pos))), labels=CLASSES)
+    return float(np.trace(cm) / max(cm.sum(), 1)), cm
+
+
+def transfer_test(stream, cfg, source=None, target=None):
+    """Streaming eval2_transfer_test: probe on source labeled rows, accuracy on target labeled rows."""
+    source, target = transfer_pair(cfg, source, target)
+    src, tgt = stream.rows(source), stream.rows(target)
+    if len(src) < 10 or len(tgt) < 5:
+        logger.warning("Insufficient labeled %s/%s for transfer test", source, target)
+        return None, None
+    chunk_rows, max_iter, tol = stream_settings(cfg)
+    scaler = stream.scalers[source]
+    clf = fit_probe(lambda pos: stream.X[src[pos]], stream.y_func[src], scaler, chunk_rows, max_iter, tol)
+    acc, cm = score_probe(lambda pos: stream.X[tgt[pos]], stream.y_func[tgt], scaler, clf, chunk_rows)
+    logger.info("Eval2 (streamed) — Transfer test (%s→%s) accuracy: %.4f", source, target, acc)
+    logger.info("Confusion matrix (%s):\n%s", target, cm)
+    return acc, cm
+
+
+def shuffled_rows(X, rows, seed, out_path, col_block=16):
+    """
+    Rows `rows` of eval_baseline_random's X_shuf, written to a float32 memmap at out_path: column
+    j is X[:, j] permuted by the j-th rng.permutation(n), the same draws as rng.shuffle(X_shuf[:, j]).
+    Columns are gathered col_block at a time; only one length-n permutation is held at once.
+    """
+    n, d = X.shape
+    if out_path.exists() and out_path.stat().st_size == len(rows) * d * 4:
+        return np.memmap(out_path, dtype=np.float32, mode="r", shape=(len(rows), d))
+    rng = np.random.default_rng(seed)
+    tmp = out_path.with_suffix(out_path.suffix + ".tmp")
+    out = np.memmap(tmp, dtype=np.float32, mode="w+", shape=(len(rows), d))
+    for j0 in range(0, d, col_block):
+        block = np.empty((len(rows), min(col_block, d - j0)), dtype=np.float32)
+        for j in range(j0, j0 + block.shape[1]):
+            block[:, j - j0] = X[rng.permutation(n)[rows], j]
+        out[:, j0 : j0 + block.shape[1]] = block
+    out.flush()
+    del out
+    os.replace(tmp, out_path)
+    return np.memmap(out_path, dtype=np.float32, mode="r", shape=(len(rows), d))
+
+
+def baseline_rows(stream, cfg):
+    """(source rows, target rows, shuffled matrix at [source; target]) for the streamed baseline."""
+    source, target = transfer_pair(cfg)
+    src, tgt = stream.rows(source), stream.rows(target)
+    seed = cfg.get("seed", 42)
+    out_path = stream.path.parent / f"shuffled_{source}_{target}_seed{seed}.f32"
+    return src, tgt, shuffled_rows(stream.X, np.concatenate([src, tgt]), seed, out_path)
+
+
+def baseline_random(stream, cfg):
+    """Streaming eval_baseline_random: shuffled labeled rows gathered to disk instead of a shuffled copy."""
+    src, tgt = (stream.rows(sp) for sp in transfer_pair(cfg))
+    if len(src) < 10 or len(tgt) < 5:
+        return None
+    src, tgt, S = baseline_rows(stream, cfg)
+    chunk_rows, max_iter, tol = stream_settings(cfg)
+
+    def src_rows(pos):
+        return np.asarray(S[pos], dtype=np.float32)
+
+    def tgt_rows(pos):
+        return np.asarray(S[len(src) + pos], dtype=np.float32)
+
+    y_src, y_tgt = stream.y_func[src], stream.y_func[tgt]
+    scaler = fit_scaler(src_rows, len(src), chunk_rows)
+    clf = fit_probe(src_rows, y_src, scaler, chunk_rows, max_iter, tol)
+    acc, _ = score_probe(tgt_rows, y_tgt, scaler, clf, chunk_rows)
+    return acc
+
+
+def run(cfg, check=False):
+    stream = build_stream(cfg)
+    acc, cm = transfer_test(stream, cfg)
+    baseline_acc = baseline_random(stream, cfg)
+    if baseline_acc is not None:
+        logger.info("Baseline (shuffled features, streamed) transfer accuracy: %.4f", baseline_acc)
+        if acc is not None:
+            logger.info("SSL outperforms random: %s", acc > baseline_acc)
+    result = {"transfer_accuracy": acc, "confusion_matrix": cm, "baseline_accuracy": baseline_acc}
+    if check:
+        result["check"] = check_against_memory(stream, cfg, acc, baseline_acc)
+    return result
+
+
+def check_against_memory(stream, cfg, acc, baseline_acc):
+    """Compare with the in-memory path: scaler statistics, shuffled baseline matrix, accuracies."""
+    from . import evaluate_transfer as et
+
+    df, X, y_func, labeled_mask, _ = et.load_embeddings_and_labels(cfg)
+    source, target = transfer_pair(cfg)
+    src = (df["species"].values == source) & labeled_mask
+    ref = StandardScaler().fit(X[src])
+    mine = stream.scalers[source]
+
+    rng = np.random.default_rng(cfg.get("seed", 42))
+    X_shuf = X.copy()
+    for j in range(X_shuf.shape[1]):
+        rng.shuffle(X_shuf[:, j])
+    src_ids, tgt_ids, S = baseline_rows(stream, cfg)
+
+    mem_acc, _ = et.eval2_transfer_test(df, X, y_func, labeled_mask, cfg)
+    mem_baseline = et.eval_baseline_random(df, X, y_func, labeled_mask, cfg)
+    out = {
+        "rows_match": bool(len(X) == len(stream.X) and np.array_equal(y_func, stream.y_func)),
+        "max_abs_mean_diff": float(np.abs(ref.mean_ - mine.mean_).max()),
+        "max_rel_scale_diff": float(np.abs(ref.scale_ / mine.scale_ - 1).max()),
+        "shuffled_matrix_equal": bool(np.array_equal(X_shuf[np.concatenate([src_ids, tgt_ids])].astype(np.float32), S)),
+        "transfer_accuracy_memory": mem_acc,
+        "transfer_accuracy_stream": acc,
+        "baseline_accuracy_memory": mem_baseline,
+        "baseline_accuracy_stream": baseline_acc,
+    }
+    logger.info("Streamed vs in-memory:\n%s", pd.Series(out).to_string())
+    return out
+
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+PROTO — Parallel hyperparameter sweep for SSL training with ASHA-style early pruning.
+Trials sample `sweep.space` (temperature, lr, batch_size, projection_dim, ...) and train in a
+process pool from one shared feature cache: `sweep.n_views` augmented log-mels per clip plus the
+labeled probe set, computed once (outputs/sweep/cache/). Each trial is trained rung by rung
+(min_epochs, min_epochs·eta, ... max_epochs) and scored with train_ssl's leave-one-out kNN probe;
+asynchronous successive halving promotes only the top 1/eta of each rung, so poor trials stop early.
+Results: outputs/sweep/sweep.db (sqlite: trials + per-rung results), outputs/sweep/sweep_results.csv.
+The best trial's encoder is promoted to models/ssl_model.pt (unless --no-promote).
+"""
+import argparse
+import copy
+import hashlib
+import json
+import logging
+import math
+import multiprocessing
+import os
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from .config_loader import load_config, get_path
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# The InfoNCE loss scale depends on these, so without a probe set trials can only be ranked by
+# loss when every trial shares them
+LOSS_SCALE_PARAMS = ("temperature", "batch_size")
+
+DEFAULT_SPACE = {
+    "temperature": [0.05, 0.07, 0.1, 0.2],
+    "lr": {"min": 1e-4, "max": 3e-3, "log": True},
+    "batch_size": [32, 64, 128],
+    "projection_dim": [32, 64, 128],
+}
+
+
+class CachedViewDataset:
+    """Positive pairs drawn from precomputed augmented views (n_clips, n_views, n_mels, T)."""
+
+    def __init__(self, views, seed=None):
+        self.views = views
+        self.rng = np.random.default_rng(seed)
+
+    def __len__(self):
+        return len(self.views)
+
+    def __getitem__(self, i):
+        import torch
+
+        a, b = self.rng.choice(self.views.shape[1], size=2, replace=False)
+        pair = np.asarray(self.views[i, [a, b]], dtype=np.float32)
+        return torch.from_numpy(pair[0]).unsqueeze(0), torch.from_numpy(pair[1]).unsqueeze(0)
+
+
+def build_cache(cfg, cache_dir: Path, n_views: int):
+    """
+    Augmented views for every training clip + probe set; reused while the clips (path, size,
+    mtime), the labels file and the settings match.
+    """
+    from .train_ssl import ClipDataset, collect_clip_paths, load_probe_set
+
+    paths = sorted(collect_clip_paths(cfg))
+    seed = int(cfg.get("seed", 42))
+    probe_max = int(cfg.get("early_stopping", {}).get("probe_max_clips", 500))
+    files = [(p, os.stat(p).st_size, os.stat(p).st_mtime_ns) for p in paths]
+    labels_path = get_path(cfg, "labels_csv")
+    if labels_path.exists():
+        files.append((str(labels_path), labels_path.stat().st_size, labels_path.stat().st_mtime_ns))
+    key = hashlib.sha1(json.dumps(
+        [files, cfg["sr"], cfg["n_mels"], n_views, seed, probe_max], sort_keys=True
+    ).encode()).hexdigest()[:12]
+    meta_path = cache_dir / "cache.json"
+    if meta_path.exists() and json.loads(meta_path.read_text()).get("key") == key:
+        logger.info("Reusing feature cache %s (%d clips × %d views)", key, len(paths), n_views)
+        return cache_dir
+    if not paths:
+        raise FileNotFoundError(f"No clips found under {get_path(cfg, 'clips_1s')}. Run make_clips first.")
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    ds = ClipDataset(paths, cfg["sr"], cfg["n_mels"], augment=True, seed=seed)
+    first = ds._load_mel(paths[0])
+    views = np.lib.format.open_memmap(cache_dir / "views.npy", mode="w+", dtype=np.float16,
+                                      shape=(len(paths), n_views) + first.shape)
+    t0 = time.perf_counter()
+    for i, p in enumerate(paths):
+        for v in range(n_views):
+            views[i, v] = first if (i, v) == (0, 0) else ds._load_mel(p)
+    views.flush()
+    probe = load_probe_set(cfg, paths, probe_max)
+    if probe is not None:
+        np.save(cache_dir / "probe_mels.npy", probe[0].numpy().astype(np.float16))
+        np.save(cache_dir / "probe_labels.npy", probe[1].numpy())
+    else:
+        for name in ("probe_mels.npy", "probe_labels.npy"):
+            (cache_dir / name).unlink(missing_ok=True)
+        logger.warning("No labeled probe set; trials will be scored by negative loss")
+    meta_path.write_text(json.dumps({"key": key, "n_clips": len(paths), "n_views": n_views}))
+    logger.info("Feature cache: %d clips × %d views in %.1fs -> %s", len(paths), n_views,
+                time.perf_counter() - t0, cache_dir)
+    return cache_dir
+
+
+def _varies(spec) -> bool:
+    """Whether a sweep.space entry can take more than one value."""
+    if isinstance(spec, dict):
+        return float(spec["min"]) != float(spec["max"])
+    return spec is not None and len(set(spec)) > 1
+
+
+def sample_params(space, rng):
+    params = {}
+    for name, spec in space.items():
+        if isinstance(spec, dict):
+            lo, hi = float(spec["min"]), float(spec["max"])
+            if spec.get("log", False):
+                params[name] = float(math.exp(rng.uniform(math.log(lo), math.log(hi))))
+            else:
+                params[name] = float(rng.uniform(lo, hi))
+        else:
+            params[name] = spec[int(rng.integers(len(spec)))]
+            if isinstance(params[name], np.generic):
+                params[name] = params[name].item()
+    return params
+
+
+def trial_config(cfg, params):
+    tcfg = copy.deepcopy(cfg)
+    for name, value in params.items():
+        if name == "arch":
+            tcfg.setdefault("encoder", {})["arch"] = value
+        else:
+            tcfg[name] = value
+    return tcfg
+
+
+def rung_epochs(min_epochs, max_epochs, eta):
+    rungs, e = [], min_epochs
+    while e < max_epochs:
+        rungs.append(e)
+        e *= eta
+    return rungs + [max_epochs]
+
+
+def run_trial_segment(cfg, trial_id, params, end_epoch, cache_dir, trial_dir, n_threads=1):
+    """
+    Worker: train trial `trial_id` from its saved state up to `end_epoch`, score it and save state.
+    Returns {"trial_id", "epochs", "score", "loss", "seconds"}.
+    """
+    import torch
+
+    from .loader import build_loader
+    from .model import ProjectionHead, build_encoder
+    from .train_ssl import _atomic_save, knn_probe, train_epoch
+
+    torch.set_num_threads(n_threads)
+    t0 = time.perf_counter()
+    tcfg = trial_config(cfg, params)
+    seed = int(tcfg.get("seed", 42)) + 1000 * trial_id
+    torch.manual_seed(seed)
+    device = torch.device("cpu")
+    model = build_encoder(tcfg).to(device)
+    proj = ProjectionHead(embed_dim=int(tcfg["embed_dim"]), proj_dim=int(tcfg.get("projection_dim", 64))).to(device)
+    opt = torch.optim.Adam(list(model.parameters()) + list(proj.parameters()), lr=float(tcfg.get("lr", 1e-3)))
+
+    state_path = trial_dir / "state.pt"
+    start_epoch = 0
+    dataset = CachedViewDataset(np.load(cache_dir / "views.npy", mmap_mode="r"), seed=seed)
+    if state_path.exists():
+        state = torch.load(state_path, map_location=device, weights_only=False)
+        model.load_state_dict(state["encoder"])
+        proj.load_state_dict(state["projection"])
+        opt.load_state_dict(state["optimizer"])
+        torch.set_rng_state(state["torch_rng"])
+        dataset.rng = state["data_rng"]
+        start_epoch = state["epoch"]
+
+    lcfg = {**tcfg, "loader": {"num_workers": 0}, "seed": seed + start_epoch}
+    loader = build_loader(dataset, lcfg, int(tcfg.get("batch_size", 64)), shuffle=True)
+    temp = float(tcfg.get("temperature", 0.07))
+    loss = float("nan")
+    for _ in range(start_epoch, end_epoch):
+        loss = train_epoch(model, proj, opt, loader, device, temp)
+
+    if (cache_dir / "probe_mels.npy").exists():
+        probe = (torch.from_numpy(np.load(cache_dir / "probe_mels.npy").astype(np.float32)),
+                 torch.from_numpy(np.load(cache_dir / "probe_labels.npy")))
+        score = knn_probe(model, probe, device)
+    else:
+        score = -loss
+    trial_dir.mkdir(parents=True, exist_ok=True)
+    _atomic_save({
+        "encoder": model.state_dict(),
+        "projection": proj.state_dict(),
+        "optimizer": opt.state_dict(),
+        "epoch": end_epoch,
+        "torch_rng": torch.get_rng_state(),
+        "data_rng": dataset.rng,
+        "params": params,
+    }, state_path)
+    return {"trial_id": trial_id, "epochs": end_epoch, "score": float(score), "loss": float(loss),
+            "seconds": time.perf_counter() - t0}
+
+
+class SweepDB:
+    """sqlite record of trials and their per-rung results."""
+
+    def __init__(self, path: Path, sweep_name: str):
+        self.conn = sqlite3.connect(path)
+        self.sweep = sweep_name
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS trials (
+                sweep TEXT, trial_id INTEGER, params TEXT, status TEXT, rung INTEGER, epochs INTEGER,
+                score REAL, loss REAL, seconds REAL, PRIMARY KEY (sweep, trial_id));
+            CREATE TABLE IF NOT EXISTS results (
+                sweep TEXT, trial_id INTEGER, rung INTEGER, epochs INTEGER, score REAL, loss REAL,
+                seconds REAL, finished REAL);
+        """)
+
+    def add_trial(self, trial_id, params):
+        self.conn.execute("INSERT OR REPLACE INTO trials VALUES (?, ?, ?, 'running', -1, 0, NULL, NULL, 0)",
+                          (self.sweep, trial_id, json.dumps(params)))
+        self.conn.commit()
+
+    def add_result(self, rung, res, status):
+        self.conn.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                          (self.sweep, res["trial_id"], rung, res["epochs"], res["score"], res["loss"],
+                           res["seconds"], time.time()))
+        self.conn.execute(
+            "UPDATE trials SET status = ?, rung = ?, epochs = ?, score = ?, loss = ?, seconds = seconds + ? "
+            "WHERE sweep = ? AND trial_id = ?",
+            (status, rung, res["epochs"], res["score"], res["loss"], res["seconds"], self.sweep, res["trial_id"]),
+        )
+        self.conn.commit()
+
+    def set_status(self, trial_id, status):
+        self.conn.execute("UPDATE trials SET status = ? WHERE sweep = ? AND trial_id = ?",
+                          (status, self.sweep, trial_id))
+        self.conn.commit()
+
+    def trials(self) -> pd.DataFrame:
+        return pd.read_sql_query("SELECT * FROM trials WHERE sweep = ? ORDER BY trial_id", self.conn,
+                                 params=(self.sweep,))
+
+
+class ASHA:
+    """Asynchronous successive halving: promote a trial from rung k once it is in that rung's top 1/eta."""
+
+    def __init__(self, rungs, eta, max_trials):
+        self.rungs, self.eta, self.max_trials = rungs, eta, max_trials
+        self.results = [dict() for _ in rungs]  # rung -> {trial_id: score}
+        self.promoted = [set() for _ in rungs]
+        self.n_started = 0
+
+    def next_job(self):
+        """(trial_id, rung) to run next, or None if nothing can start right now."""
+        for k in range(len(self.rungs) - 2, -1, -1):
+            ranked = sorted(self.results[k].items(), key=lambda kv: kv[1], reverse=True)
+            for trial_id, _ in ranked[: len(ranked) // self.eta]:
+                if trial_id not in self.promoted[k]:
+                    self.promoted[k].add(trial_id)
+                    return trial_id, k + 1
+        if self.n_started < self.max_trials:
+            self.n_started += 1
+            return self.n_started - 1, 0
+        return None
+
+    def report(self, trial_id, rung, score):
+        """score: anything orderable, higher is better (e.g. (probe accuracy, -loss))."""
+        self.results[rung][trial_id] = score
+
+    def is_final(self, trial_id):
+        return trial_id in self.results[-1]
+
+
+def run(cfg, max_trials=None, n_workers=None, promote=True):
+    scfg = cfg.get("sweep", {})
+    max_trials = int(max_trials or scfg.get("max_trials", 16))
+    n_workers = int(n_workers or scfg.get("n_workers") or os.cpu_count() or 1)
+    eta = int(scfg.get("eta", 3))
+    rungs = rung_epochs(int(scfg.get("min_epochs", 2)), int(scfg.get("max_epochs", cfg.get("epochs", 50))), eta)
+    space = scfg.get("space") or DEFAULT_SPACE
+    n_threads = max(1, (os.cpu_count() or 1) // n_workers)
+
+    out_dir = get_path(cfg, "outputs") / "sweep"
+    cache_dir = build_cache(cfg, out_dir / "cache", int(scfg.get("n_views", 4)))
+    varied = [name for name in LOSS_SCALE_PARAMS if _varies(space.get(name))]
+    if varied and not (cache_dir / "probe_mels.npy").exists():
+        raise ValueError(
+            f"No labeled probe set, and sweep.space varies {varied}: losses at different values are not "
+            "comparable. Add labels (python -m src create_labels) or fix these to single values in sweep.space."
+        )
+    sweep_name = time.strftime("%Y%m%d-%H%M%S")
+    trials_dir = out_dir / "trials" / sweep_name
+    db = SweepDB(out_dir / "sweep.db", sweep_name)
+    rng = np.random.default_rng(int(cfg.get("seed", 42)))
+    params = {}
+    asha = ASHA(rungs, eta, max_trials)
+    logger.info("Sweep %s: up to %d trials, rungs %s epochs, %d workers × %d threads",
+                sweep_name, max_trials, rungs, n_workers, n_threads)
+
+    t0 = time.perf_counter()
+    running = {}
+    ctx = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx) as pool:
+        while True:
+            while len(running) < n_workers:
+                job = asha.next_job()
+                if job is None:
+                    break
+                trial_id, rung = job
+                if rung == 0:
+                    params[trial_id] = sample_params(space, rng)
+                    db.add_trial(trial_id, params[trial_id])
+                else:
+                    db.set_status(trial_id, "running")
+                fut = pool.submit(run_trial_segment, cfg, trial_id, params[trial_id], rungs[rung],
+                                  cache_dir, trials_dir / f"trial_{trial_id:03d}", n_threads)
+                running[fut] = (trial_id, rung)
+            if not running:
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                trial_id, rung = running.pop(fut)
+                try:
+                    res = fut.result()
+                except Exception as e:
+                    logger.warning("Trial %d failed at rung %d: %s", trial_id, rung, e)
+                    db.set_status(trial_id, "failed")
+                    continue
+                asha.report(trial_id, rung, (res["score"], -res["loss"]))  # loss breaks probe ties
+                db.add_result(rung, res, "completed" if asha.is_final(trial_id) else "paused")
+                logger.info("Trial %d rung %d (%d epochs): score %.4f loss %.4f  %s",
+                            trial_id, rung, res["epochs"], res["score"], res["loss"], params[trial_id])
+
+    # Trials never promoted past their rung were pruned
+    report = db.trials()
+    report.loc[report["status"] == "paused", "status"] = "pruned"
+    for trial_id in report.loc[report["status"] == "pruned", "trial_id"]:
+        db.set_status(int(trial_id), "pruned")
+    report = pd.concat([report.drop(columns="params"),
+                        pd.DataFrame([json.loads(p) for p in report["params"]])], axis=1)
+    report = report.sort_values(["rung", "score", "loss"], ascending=[False, False, True])
+    report.to_csv(out_dir / "sweep_results.csv", index=False)
+    total_epochs = int(report["epochs"].sum())
+    logger.info("Sweep finished in %.1fs: %d trials, %d epochs trained (%d without pruning)\n%s",
+                time.perf_counter() - t0, len(report), total_epochs, len(report) * rungs[-1],
+                report.round(4).to_string(index=False))
+
+    ok = report[report["status"] != "failed"]
+    if ok.empty:
+        logger.error("No trial finished")
+        return report
+    best = ok.iloc[0]
+    best_params = params[int(best["trial_id"])]
+    logger.info("Best trial %d (%d epochs, score %.4f): %s", best["trial_id"], best["epochs"], best["score"], best_params)
+    if promote:
+        import torch
+
+        from .model import build_encoder
+        from .train_ssl import save_encoder
+
+        state = torch.load(trials_dir / f"trial_{int(best['trial_id']):03d}" / "state.pt", weights_only=False)
+        tcfg = trial_config(cfg, best_params)
+        model = build_encoder(tcfg)
+        model.load_state_dict(state["encoder"])
+        models_dir = get_path(cfg, "models")
+        models_dir.mkdir(parents=True, exist_ok=True)
+        save_encoder(models_dir / "ssl_model.pt", model, tcfg, epoch=int(best["epochs"]),
+                     metric={"sweep_probe": float(best["score"])}, sweep=sweep_name, params=best_params)
+        logger.info("Promoted trial %d to %s", best["trial_id"], models_dir / "ssl_model.pt")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-trials", type=int, default=None)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--no-promote", action="store_true", help="Do not overwrite models/ssl_model.pt")
+    args = parser.parse_args()
+    cfg = load_config()
+    run(cfg, max_trials=args.max_trials, n_workers=args.workers, promote=not args.no_promote)
+
+
+if __name__ == "__main__":
+    main()
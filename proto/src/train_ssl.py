@@ -2,101 +2,76 @@
 """
 PROTO — Self-supervised representation learning (SimCLR-style InfoNCE).
 Input: log-mel spectrogram 80 mel bins. Encoder: small CNN → 128-d → projection head.
+Checkpoints: models/checkpoint_last.pt (full training state, --resume), models/ssl_model.pt (best encoder).
 """
 import argparse
 import logging
+import os
+import random
 from pathlib import Path
 
 import numpy as np
-import torch
-import torch.nn as nn
-import torch.nn.functional as F
-from torch.utils.data import Dataset, DataLoader
 import soundfile as sf
-import librosa
 
 from .config_loader import load_config, get_path
+from .mel import log_mel
+from .dedup_clips import kept_clips
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
-def log_mel(signal: np.ndarray, sr: int, n_mels: int = 80, n_fft: int = 512, hop: int = 160) -> np.ndarray:
-    S = librosa.feature.melspectrogram(y=signal, sr=sr, n_mels=n_mels, n_fft=n_fft, hop_length=hop)
-    return librosa.power_to_db(S + 1e-8, ref=np.max).astype(np.float32)
+class ClipDataset:
+    """Map-style dataset of augmented view pairs (a plain class, so this module imports without torch)."""
 
-
-class ClipDataset(Dataset):
-    def __init__(self, clip_paths, sr, n_mels, augment=True, max_time_shift_sec=0.1, noise_std=0.005):
+    def __init__(self, clip_paths, sr, n_mels, augment=True, max_time_shift_sec=0.1, noise_std=0.005, seed=None):
         self.clip_paths = clip_paths
         self.sr = sr
         self.n_mels = n_mels
         self.augment = augment
         self.max_shift = int(max_time_shift_sec * sr)
         self.noise_std = noise_std
+        self.seed = seed
+        # Per-dataset RNG; DataLoader workers reseed it (see loader.seed_worker)
+        self.rng = np.random.default_rng(seed)
+        import torch
+
+        # Current epoch, in shared memory so persistent workers see set_epoch from the main process
+        self._epoch = torch.zeros(1, dtype=torch.long).share_memory_()
+
+    def set_epoch(self, epoch):
+        """With a seed, augmentations come from (seed, epoch, index): identical after --resume."""
+        self._epoch[0] = epoch
 
     def __len__(self):
         return len(self.clip_paths)
 
-    def _load_mel(self, path):
+    def _load_mel(self, path, rng=None):
+        rng = rng or self.rng
         y, _ = sf.read(path)
         if len(y.shape) > 1:
             y = y.mean(axis=1)
         if self.augment and self.max_shift > 0:
-            shift = np.random.randint(-self.max_shift, self.max_shift + 1)
+            shift = rng.integers(-self.max_shift, self.max_shift + 1)
             y = np.roll(y, shift)
         if self.augment and self.noise_std > 0:
-            y = y + np.random.randn(len(y)).astype(np.float32) * self.noise_std
+            y = y + rng.standard_normal(len(y)).astype(np.float32) * self.noise_std
         mel = log_mel(y, self.sr, self.n_mels)
         return mel
 
     def __getitem__(self, i):
-        mel_a = self._load_mel(self.clip_paths[i])
-        mel_b = self._load_mel(self.clip_paths[i])
-        return torch.from_numpy(mel_a).unsqueeze(0), torch.from_numpy(mel_b).unsqueeze(0)
-
-
-class Encoder(nn.Module):
-    """Small CNN: (1, n_mels, T) -> 128-d."""
-
-    def __init__(self, n_mels=80, embed_dim=128):
-        super().__init__()
-        self.conv = nn.Sequential(
-            nn.Conv2d(1, 32, 3, padding=1),
-            nn.BatchNorm2d(32),
-            nn.ReLU(),
-            nn.MaxPool2d(2),
-            nn.Conv2d(32, 64, 3, padding=1),
-            nn.BatchNorm2d(64),
-            nn.ReLU(),
-            nn.MaxPool2d(2),
-            nn.Conv2d(64, 128, 3, padding=1),
-            nn.BatchNorm2d(128),
-            nn.ReLU(),
-            nn.AdaptiveAvgPool2d(1),
-        )
-        self.fc = nn.Linear(128, embed_dim)
-
-    def forward(self, x):
-        h = self.conv(x)
-        h = h.view(h.size(0), -1)
-        return self.fc(h)
-
-
-class ProjectionHead(nn.Module):
-    def __init__(self, embed_dim=128, proj_dim=64):
-        super().__init__()
-        self.mlp = nn.Sequential(
-            nn.Linear(embed_dim, embed_dim),
-            nn.ReLU(),
-            nn.Linear(embed_dim, proj_dim),
-        )
+        import torch
 
-    def forward(self, z):
-        return self.mlp(z)
+        rng = np.random.default_rng([self.seed, int(self._epoch[0]), i]) if self.seed is not None else self.rng
+        mel_a = self._load_mel(self.clip_paths[i], rng)
+        mel_b = self._load_mel(self.clip_paths[i], rng)
+        return torch.from_numpy(mel_a).unsqueeze(0), torch.from_numpy(mel_b).unsqueeze(0)
 
 
 def info_nce_loss(z_i, z_j, temperature=0.07):
+    import torch
+    import torch.nn.functional as F
+
     batch = z_i.size(0)
     z_i = F.normalize(z_i, dim=1)
     z_j = F.normalize(z_j, dim=1)
@@ -107,21 +82,38 @@ def info_nce_loss(z_i, z_j, temperature=0.07):
 
 def collect_clip_paths(cfg):
     clips_base = get_path(cfg, "clips_1s")
+    keep = kept_clips(cfg)
     paths = []
     for species in cfg["species"]:
         d = clips_base / species
         if d.exists():
-            paths.extend(d.glob("*.wav"))
+            paths.extend(p for p in d.glob("*.wav") if keep is None or (species, p.name) in keep)
     return [str(p) for p in paths]
 
 
-def train_epoch(model, proj, opt, loader, device, temperature):
+def train_epoch(model, proj, opt, loader, device, temperature, timings=None, chunk_size=0, logit_block=0,
+                on_batch=None):
+    """
+    One pass over loader; mean loss. If `timings` is a dict it receives the data-wait/compute split.
+    chunk_size > 0 uses the memory-bounded gradient-cache step (grad_cache.py) instead of the naive one.
+    on_batch(step, h_a): optional hook receiving the first view's encoder outputs (naive step only).
+    """
+    from .grad_cache import grad_cache_step
+    from .loader import StepTimer
+
     model.train()
     proj.train()
     total_loss = 0.0
     n_batches = 0
+    timer = StepTimer(device)
     for (x_a, x_b) in loader:
-        x_a, x_b = x_a.to(device), x_b.to(device)
+        timer.data_ready()
+        if chunk_size > 0:
+            total_loss += grad_cache_step(model, proj, opt, x_a, x_b, device, temperature, chunk_size, logit_block)
+            n_batches += 1
+            timer.step_done()
+            continue
+        x_a, x_b = x_a.to(device, non_blocking=True), x_b.to(device, non_blocking=True)
         h_a = model(x_a)
         h_b = model(x_b)
         z_a = proj(h_a)
@@ -130,53 +122,300 @@ def train_epoch(model, proj, opt, loader, device, temperature):
         opt.zero_grad()
         loss.backward()
         opt.step()
+        if on_batch is not None:
+            on_batch(n_batches, h_a.detach())
         total_loss += loss.item()
         n_batches += 1
+        timer.step_done()
+    if timings is not None:
+        timings.update(timer.summary())
     return total_loss / max(n_batches, 1)
 
 
-def main():
-    parser = argparse.ArgumentParser()
-    parser.add_argument("--epochs", type=int, default=None)
-    parser.add_argument("--batch-size", type=int, default=None)
-    parser.add_argument("--lr", type=float, default=None)
-    args = parser.parse_args()
-    cfg = load_config()
+def _rng_state():
+    import torch
+
+    state = {"torch": torch.get_rng_state(), "numpy": np.random.get_state(), "python": random.getstate()}
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def _set_rng_state(state):
+    import torch
+
+    torch.set_rng_state(state["torch"])
+    np.random.set_state(state["numpy"])
+    random.setstate(state["python"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def _atomic_save(obj, path: Path) -> None:
+    import torch
+
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    torch.save(obj, tmp)
+    os.replace(tmp, path)
+
+
+def save_checkpoint(path: Path, model, proj, opt, epoch, stopper, cfg, sampler=None) -> None:
+    _atomic_save({
+        "encoder": model.state_dict(),
+        "projection": proj.state_dict(),
+        "optimizer": opt.state_dict(),
+        "epoch": epoch,
+        "rng": _rng_state(),
+        "early_stopping": stopper.state_dict(),
+        "config": {k: v for k, v in cfg.items() if k != "paths"},
+        "sampler": sampler.state_dict() if sampler is not None else None,
+    }, path)
+
+
+def save_encoder(path: Path, model, cfg, **extra) -> None:
+    """Encoder-only checkpoint in the layout extract_features.load_encoder expects."""
+    state = {"encoder": model.state_dict(), "config": {k: v for k, v in cfg.items() if k != "paths"}}
+    state.update(extra)
+    _atomic_save(state, path)
+
+
+class EarlyStopping:
+    """Track the best value of a metric and stop after `patience` epochs without improvement."""
+
+    def __init__(self, mode="min", patience=5, min_delta=1e-3, ema=0.0):
+        self.mode = mode
+        self.patience = patience
+        self.min_delta = min_delta
+        self.ema = ema
+        self.smoothed = None
+        self.best = None
+        self.bad_epochs = 0
+
+    def step(self, value):
+        """Feed one epoch's value; return True if it is a new best."""
+        if self.smoothed is None or self.ema <= 0:
+            self.smoothed = value
+        else:
+            self.smoothed = self.ema * self.smoothed + (1 - self.ema) * value
+        v = self.smoothed
+        better = self.best is None or (
+            v < self.best - self.min_delta if self.mode == "min" else v > self.best + self.min_delta
+        )
+        if better:
+            self.best = v
+            self.bad_epochs = 0
+        else:
+            self.bad_epochs += 1
+        return better
+
+    @property
+    def should_stop(self):
+        return self.patience > 0 and self.bad_epochs >= self.patience
+
+    def state_dict(self):
+        return {"smoothed": self.smoothed, "best": self.best, "bad_epochs": self.bad_epochs}
+
+    def load_state_dict(self, state):
+        self.smoothed = state["smoothed"]
+        self.best = state["best"]
+        self.bad_epochs = state["bad_epochs"]
+
+
+def load_probe_set(cfg, paths, max_clips=500):
+    """Labeled clips (no augmentation) for the kNN probe: (mel tensor, labels) or None."""
+    import pandas as pd
+    import torch
+
+    labels_path = get_path(cfg, "labels_csv")
+    if not labels_path.exists():
+        return None
+    labels = pd.read_csv(labels_path)
+    labels = labels[labels["label"].isin([0, 1])]
+    lookup = {(str(s), c): int(l) for s, c, l in zip(labels["species"], labels["clip"], labels["label"])}
+    items = [(p, lookup[(Path(p).parent.name, Path(p).name)]) for p in paths
+             if (Path(p).parent.name, Path(p).name) in lookup]
+    if len(items) < 10:
+        return None
+    rng = np.random.default_rng(cfg.get("seed", 42))
+    if len(items) > max_clips:
+        items = [items[i] for i in rng.choice(len(items), size=max_clips, replace=False)]
+    ds = ClipDataset([p for p, _ in items], cfg["sr"], cfg["n_mels"], augment=False)
+    mels = torch.stack([torch.from_numpy(ds._load_mel(p)).unsqueeze(0) for p in ds.clip_paths])
+    return mels, torch.tensor([l for _, l in items])
+
+
+def _probe_embeddings(model, mels, device, batch_size):
+    import torch
+
+    model.eval()
+    with torch.no_grad():
+        return torch.cat([model(mels[i : i + batch_size].to(device)).cpu() for i in range(0, len(mels), batch_size)])
+
+
+def embed_clips(model, dataset, ids, device, batch_size=256):
+    """(len(ids), d) no-grad encoder outputs for dataset clips `ids`, loaded batch by batch."""
+    import torch
+
+    out = []
+    for s in range(0, len(ids), batch_size):
+        mels = torch.stack([torch.from_numpy(dataset._load_mel(dataset.clip_paths[i])).unsqueeze(0)
+                            for i in ids[s : s + batch_size]])
+        out.append(_probe_embeddings(model, mels, device, batch_size).numpy())
+    return np.concatenate(out)
+
+
+def knn_probe(model, probe_set, device, k=5, batch_size=256):
+    """Leave-one-out cosine kNN accuracy of alarm labels on encoder embeddings."""
+    import torch.nn.functional as F
+
+    mels, y = probe_set
+    z = F.normalize(_probe_embeddings(model, mels, device, batch_size), dim=1)
+    sims = z @ z.t()
+    sims.fill_diagonal_(-float("inf"))
+    idx = sims.topk(min(k, len(z) - 1), dim=1).indices
+    pred = (y[idx].float().mean(dim=1) > 0.5).long()
+    return (pred == y).float().mean().item()
+
+
+def linear_probe(model, probe_set, device, folds=5, batch_size=256, seed=42):
+    """Cross-validated logistic-regression accuracy of alarm labels on frozen encoder embeddings."""
+    from sklearn.linear_model import LogisticRegression
+    from sklearn.model_selection import StratifiedKFold, cross_val_score
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import StandardScaler
+
+    mels, y = probe_set
+    z = _probe_embeddings(model, mels, device, batch_size)
+    y = y.numpy()
+    folds = max(2, min(folds, int(np.bincount(y).min())))
+    clf = make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000, random_state=seed))
+    cv = StratifiedKFold(n_splits=folds, shuffle=True, random_state=seed)
+    return float(cross_val_score(clf, z.numpy(), y, cv=cv).mean())
+
+
+def train(cfg, epochs=None, batch_size=None, lr=None, resume=False):
+    """Train the SSL encoder; returns {"epochs_run", "best", "loss", "history"}."""
+    import torch
+
+    from .loader import build_loader, set_epoch
+    from .model import ProjectionHead, build_encoder
+    from .sampler import build_batch_sampler
+
     torch.manual_seed(cfg.get("seed", 42))
+    np.random.seed(cfg.get("seed", 42))
+    random.seed(cfg.get("seed", 42))
 
     paths = collect_clip_paths(cfg)
     if not paths:
         logger.error("No clips found under %s. Run make_clips.py first.", get_path(cfg, "clips_1s"))
-        return
+        return None
     logger.info("Training on %d clips", len(paths))
 
-    dataset = ClipDataset(paths, cfg["sr"], cfg["n_mels"], augment=True)
-    batch_size = int(args.batch_size or cfg.get("batch_size", 64))
-    loader = DataLoader(
-        dataset,
-        batch_size=batch_size,
-        shuffle=True,
-        num_workers=0,
-        pin_memory=False,
-    )
+    dataset = ClipDataset(paths, cfg["sr"], cfg["n_mels"], augment=True, seed=cfg.get("seed", 42))
+    batch_size = int(batch_size or cfg.get("batch_size", 64))
+    sampler = build_batch_sampler(cfg, paths, batch_size)
+    loader = build_loader(dataset, cfg, batch_size, shuffle=True, batch_sampler=sampler)
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    model = Encoder(n_mels=int(cfg["n_mels"]), embed_dim=int(cfg["embed_dim"])).to(device)
+    model = build_encoder(cfg).to(device)
     proj = ProjectionHead(embed_dim=int(cfg["embed_dim"]), proj_dim=int(cfg.get("projection_dim", 64))).to(device)
-    lr = float(args.lr if args.lr is not None else cfg.get("lr", 1e-3))
+    lr = float(lr if lr is not None else cfg.get("lr", 1e-3))
     opt = torch.optim.Adam(list(model.parameters()) + list(proj.parameters()), lr=lr)
-    epochs = int(args.epochs or cfg.get("epochs", 50))
+    epochs = int(epochs or cfg.get("epochs", 50))
     temp = float(cfg.get("temperature", 0.07))
+    chunk_size = int(cfg.get("contrastive", {}).get("chunk_size") or 0)
+    logit_block = int(cfg.get("contrastive", {}).get("logit_block") or 0)
 
-    for ep in range(epochs):
-        loss = train_epoch(model, proj, opt, loader, device, temp)
-        if (ep + 1) % 10 == 0 or ep == 0:
-            logger.info("Epoch %d loss %.4f", ep + 1, loss)
+    es_cfg = cfg.get("early_stopping", {})
+    metric = es_cfg.get("metric", "none")
+    probed = metric in ("probe", "linear")
+    probe_set = load_probe_set(cfg, paths, int(es_cfg.get("probe_max_clips", 500))) if probed else None
+    if probed and probe_set is None:
+        logger.warning("No labeled clips for the %s probe; early stopping on smoothed loss instead", metric)
+        metric, probed = "loss", False
+    stopper = EarlyStopping(
+        mode="max" if probed else "min",
+        patience=int(es_cfg.get("patience", 0)) if metric != "none" else 0,
+        min_delta=float(es_cfg.get("min_delta", 1e-3)),
+        ema=float(es_cfg.get("ema", 0.8)) if metric == "loss" else 0.0,
+    )
+    ckpt_every = int(cfg.get("checkpoint", {}).get("every", 5))
 
     out_dir = get_path(cfg, "models")
     out_dir.mkdir(parents=True, exist_ok=True)
-    state = {"encoder": model.state_dict(), "config": {k: v for k, v in cfg.items() if k != "paths"}}
-    torch.save(state, out_dir / "ssl_model.pt")
-    logger.info("Saved %s", out_dir / "ssl_model.pt")
+    last_path = out_dir / "checkpoint_last.pt"
+    best_path = out_dir / "ssl_model.pt"
+
+    start_epoch = 0
+    if resume and last_path.exists():
+        ckpt = torch.load(last_path, map_location=device, weights_only=False)
+        model.load_state_dict(ckpt["encoder"])
+        proj.load_state_dict(ckpt["projection"])
+        opt.load_state_dict(ckpt["optimizer"])
+        stopper.load_state_dict(ckpt["early_stopping"])
+        _set_rng_state(ckpt["rng"])
+        if sampler is not None and ckpt.get("sampler"):
+            sampler.load_state_dict(ckpt["sampler"])
+        start_epoch = ckpt["epoch"]
+        logger.info("Resumed from %s at epoch %d", last_path, start_epoch)
+    elif resume:
+        logger.warning("--resume given but %s not found; starting from scratch", last_path)
+
+    on_batch = sampler.record if sampler is not None and sampler.mining else None
+    if on_batch is not None and chunk_size > 0:
+        logger.warning("Hard-negative mining needs the naive step; contrastive.chunk_size > 0 disables it")
+        on_batch = None
+    # Un-augmented views for the sampler's refresh of clips not drawn since the last one
+    plain = ClipDataset(paths, cfg["sr"], cfg["n_mels"], augment=False) if on_batch is not None else None
+
+    loss = float("nan")
+    epochs_run = start_epoch
+    history = []
+    for ep in range(start_epoch, epochs):
+        epochs_run = ep + 1
+        set_epoch(loader, ep, int(cfg.get("seed", 42)))
+        timings = {}
+        loss = train_epoch(
+            model, proj, opt, loader, device, temp, timings=timings, chunk_size=chunk_size, logit_block=logit_block,
+            on_batch=on_batch,
+        )
+        if on_batch is not None:
+            sampler.end_epoch(embed=lambda ids: embed_clips(model, plain, ids, device, batch_size))
+        if metric == "probe":
+            value = knn_probe(model, probe_set, device)
+        elif metric == "linear":
+            value = linear_probe(model, probe_set, device, seed=cfg.get("seed", 42))
+        else:
+            value = loss
+        history.append({"epoch": ep + 1, "loss": loss, metric: value})
+        improved = stopper.step(value)
+        if (ep + 1) % 10 == 0 or ep == 0 or (improved and probed):
+            logger.info(
+                "Epoch %d loss %.4f %s %.4f | data wait %.2fs (%.0f%%) compute %.2fs over %d steps",
+                ep + 1, loss, metric, stopper.smoothed, timings["data_sec"],
+                100 * timings["data_frac"], timings["compute_sec"], timings["steps"],
+            )
+        if improved or metric == "none":
+            save_encoder(best_path, model, cfg, epoch=ep + 1, metric={metric: stopper.smoothed})
+        if (ep + 1) % ckpt_every == 0 or ep + 1 == epochs or stopper.should_stop:
+            save_checkpoint(last_path, model, proj, opt, ep + 1, stopper, cfg, sampler)
+        if stopper.should_stop:
+            logger.info("Early stopping at epoch %d (best %s %.4f)", ep + 1, metric, stopper.best)
+            break
+
+    best = stopper.best if stopper.best is not None else float("nan")
+    logger.info("Saved %s (best %s %.4f) and %s", best_path, metric, best, last_path)
+    return {"epochs_run": epochs_run, "best": stopper.best, "loss": loss, "history": history}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--epochs", type=int, default=None)
+    parser.add_argument("--batch-size", type=int, default=None)
+    parser.add_argument("--lr", type=float, default=None)
+    parser.add_argument("--resume", action="store_true", help="Continue from models/checkpoint_last.pt")
+    args = parser.parse_args()
+    cfg = load_config()
+    train(cfg, epochs=args.epochs, batch_size=args.batch_size, lr=args.lr, resume=args.resume)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,78 @@
+"""Streamed transfer test / baseline vs the in-memory path (run from proto/: python -m pytest tests)."""
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import StandardScaler
+
+from src import evaluate_transfer as et
+from src import stream_eval
+
+
+def _reference(X, y):
+    scaler = StandardScaler().fit(X)
+    # float64 input: on float32 LBFGS stops well short of the optimum the streamed probe reaches
+    clf = LogisticRegression(max_iter=10000, tol=1e-10).fit(scaler.transform(X.astype(np.float64)), y)
+    return scaler, clf
+
+
+@pytest.mark.parametrize("signal", [1.0, 0.0])  # informative features, and pure noise (the shuffled baseline)
+def test_fit_probe_matches_lbfgs(signal):
+    rng = np.random.default_rng(0)
+    X = rng.standard_normal((300, 32)).astype(np.float32)
+    y = (signal * X[:, 0] + 0.5 * rng.standard_normal(300) > 0).astype(int)
+    scaler, ref = _reference(X, y)
+    clf = stream_eval.fit_probe(lambda pos: X[pos], y, scaler, chunk_rows=64)
+    np.testing.assert_allclose(clf.coef_, ref.coef_, atol=1e-4)
+    np.testing.assert_allclose(clf.intercept_, ref.intercept_, atol=1e-4)
+    X_te = rng.standard_normal((200, 32)).astype(np.float32)
+    assert np.mean(clf.predict(scaler.transform(X_te)) == ref.predict(scaler.transform(X_te))) >= 0.99
+
+
+def test_shuffled_rows_match_in_memory_shuffle(tmp_path):
+    rng = np.random.default_rng(1)
+    X = rng.standard_normal((500, 20)).astype(np.float32)
+    rows = np.sort(rng.choice(500, size=60, replace=False))
+    X_shuf = X.copy()
+    shuffle_rng = np.random.default_rng(42)
+    for j in range(X.shape[1]):
+        shuffle_rng.shuffle(X_shuf[:, j])
+    S = stream_eval.shuffled_rows(X, rows, 42, tmp_path / "shuffled.f32", col_block=7)
+    np.testing.assert_array_equal(np.asarray(S), X_shuf[rows])
+
+
+def _cfg(tmp_path):
+    rng = np.random.default_rng(2)
+    rows = []
+    for species, prefix in (("Monkey", "monkey"), ("Deer", "deer")):
+        for i in range(120):
+            alarm = i % 2 == 0  # function_labels' naming convention: even index = alarm
+            emb = rng.standard_normal(16) + (0.8 if alarm else -0.8) * np.eye(16)[0]
+            rows.append({"clip": f"{prefix}_{i:04d}_clip000.wav", "species": species,
+                         **{f"f{j}": v for j, v in enumerate(emb)}})
+    emb_path = tmp_path / "audio_embeddings.csv"
+    pd.DataFrame(rows).to_csv(emb_path, index=False)
+    return {
+        "seed": 42,
+        "species": ["Monkey", "Deer"],
+        "eval": {"stream_chunk_rows": 50},
+        "paths": {"embeddings_csv": emb_path, "labels_csv": tmp_path / "none.csv",
+                  "dedup_manifest": tmp_path / "none_manifest.csv", "outputs": tmp_path},
+    }
+
+
+def test_streamed_accuracies_match_in_memory(tmp_path):
+    cfg = _cfg(tmp_path)
+    result = stream_eval.run(cfg, check=True)
+    check = result["check"]
+    assert check["rows_match"] and check["shuffled_matrix_equal"]
+    assert check["max_abs_mean_diff"] < 1e-5
+    assert abs(check["transfer_accuracy_stream"] - check["transfer_accuracy_memory"]) <= 0.01
+    assert abs(check["baseline_accuracy_stream"] - check["baseline_accuracy_memory"]) <= 0.01
+
+    # Unchanged inputs: the cache is reused, not rewritten
+    mtime = (tmp_path / "stream_cache" / "embeddings.f32").stat().st_mtime_ns
+    stream = stream_eval.build_stream(cfg)
+    assert (tmp_path / "stream_cache" / "embeddings.f32").stat().st_mtime_ns == mtime
+    df, X, _, _, _ = et.load_embeddings_and_labels(cfg)
+    np.testing.assert_array_equal(np.asarray(stream.X), X.astype(np.float32))